@@ -9,10 +9,12 @@ else:
     from . import anki_utils
     from . import deck_utils
     from . import cloudlanguagetools
+    from . import perf_stats
 
-    ankiutils = anki_utils.AnkiUtils()
+    performance_stats = perf_stats.PerformanceStats()
+    ankiutils = anki_utils.AnkiUtils(performance_stats=performance_stats)
     deckutils = deck_utils.DeckUtils(ankiutils)
-    cloud_language_tools = cloudlanguagetools.CloudLanguageTools()
-    languagetools = languagetools.LanguageTools(ankiutils, deckutils, cloud_language_tools)
+    cloud_language_tools = cloudlanguagetools.CloudLanguageTools(performance_stats=performance_stats)
+    languagetools = languagetools.LanguageTools(ankiutils, deckutils, cloud_language_tools, performance_stats=performance_stats)
     gui.init(languagetools)
     editor.init(languagetools)
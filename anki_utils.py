@@ -4,11 +4,15 @@ import anki.template
 import anki.sound
 import PyQt5
 from . import constants    
+from . import audio_utils
+from . import task_scheduler
 
     
 class AnkiUtils():
-    def __init__(self):
-        pass
+    def __init__(self, performance_stats=None):
+        self.performance_stats = performance_stats
+        # created on first use
+        self.task_scheduler = None
 
     def get_config(self):
         return aqt.mw.addonManager.getConfig(__name__)
@@ -46,6 +50,13 @@ class AnkiUtils():
     def get_deckid_modelid_pairs(self):
         return aqt.mw.col.db.all("select did, mid from notes inner join cards on notes.id = cards.nid group by mid, did")
 
+    def get_deckid_modelid_pairs_modified_since(self, modified_time):
+        # only cards / notes added or changed since modified_time
+        return aqt.mw.col.db.all("select did, mid from notes inner join cards on notes.id = cards.nid where cards.mod >= ? or notes.mod >= ? group by mid, did", modified_time, modified_time)
+
+    def deckid_modelid_pair_exists(self, deck_id, model_id):
+        return aqt.mw.col.db.scalar("select 1 from cards inner join notes on notes.id = cards.nid where cards.did = ? and notes.mid = ? limit 1", deck_id, model_id) != None
+
     def get_noteids_for_deck_note_type(self, deck_id, model_id, sample_size):
         sql_query = f'SELECT notes.id FROM notes INNER JOIN cards ON notes.id = cards.nid WHERE notes.mid={model_id} AND cards.did={deck_id} ORDER BY RANDOM() LIMIT {sample_size}'
 
@@ -58,6 +69,29 @@ class AnkiUtils():
 
         return note_ids
 
+    def get_deck_note_type_signature(self, deck_id, model_id):
+        # changes when notes are added, removed or edited
+        return aqt.mw.col.db.first("SELECT count(distinct notes.id), max(notes.mod), sum(distinct notes.id) FROM notes INNER JOIN cards ON notes.id = cards.nid WHERE notes.mid = ? AND cards.did = ?", model_id, deck_id)
+
+    def get_browser_next_note_deck_ids(self, browser, count):
+        # (note_id, deck_id) for the rows after the current one. the browser table only exposes the current row,
+        # the following rows are read through the qt view and its model
+        table_view = browser.form.tableView
+        model = table_view.model()
+        if model == None or not hasattr(model, 'get_card_ids'):
+            return []
+        current_index = table_view.selectionModel().currentIndex()
+        if not current_index.isValid():
+            return []
+        current_row = current_index.row()
+        result = []
+        for row in range(current_row + 1, min(current_row + 1 + count, model.rowCount())):
+            card_ids = model.get_card_ids([model.index(row, 0)])
+            if len(card_ids) > 0:
+                card = aqt.mw.col.get_card(card_ids[0])
+                result.append((card.nid, card.did))
+        return result
+
     def get_note_by_id(self, note_id):
         note = aqt.mw.col.getNote(note_id)
         return note
@@ -75,11 +109,40 @@ class AnkiUtils():
         return aqt.mw.col.decks.id_for_name(deck_name)
 
     def media_add_file(self, filename):
+        # hard link into the media folder when possible, so that the audio is only stored once
+        media_dir = aqt.mw.col.media.dir()
+        if media_dir != None:
+            media_filename = audio_utils.link_media_file(filename, media_dir)
+            if media_filename != None:
+                return media_filename
         full_filename = aqt.mw.col.media.addFile(filename)
         return full_filename
 
-    def run_in_background(self, task_fn, task_done_fn):
-        aqt.mw.taskman.run_in_background(task_fn, task_done_fn)
+    def media_add_files(self, filenames):
+        # register a group of generated files, returns the media filenames in the same order.
+        # anki has no call registering several files at once, see audio_utils.register_media_files. hard linked files
+        # don't go through anki at all, the media folder gets scanned for new files on the next media sync.
+        return audio_utils.register_media_files(filenames, aqt.mw.col.media.dir(), aqt.mw.col.media.addFile)
+
+    def update_notes(self, notes):
+        # single backend call, the notes are saved in one database transaction. col.update_notes appeared in 2.1.45,
+        # older versions save each note
+        if hasattr(aqt.mw.col, 'update_notes'):
+            aqt.mw.col.update_notes(notes)
+        else:
+            for note in notes:
+                note.flush()
+
+    def get_task_scheduler(self):
+        if self.task_scheduler == None:
+            self.task_scheduler = task_scheduler.TaskScheduler(self.run_on_main, self.performance_stats)
+        return self.task_scheduler
+
+    def run_in_background(self, task_fn, task_done_fn, priority=constants.TaskPriority.interactive, cancellation_token=None):
+        return self.get_task_scheduler().submit(task_fn, task_done_fn, priority=priority, cancellation_token=cancellation_token)
+
+    def map_in_task_class(self, fn, items, max_workers):
+        return self.get_task_scheduler().map_in_task_class(fn, items, max_workers)
 
     def run_on_main(self, task_fn):
         aqt.mw.taskman.run_on_main(task_fn)
@@ -101,12 +164,19 @@ class AnkiUtils():
         timer.timer_obj.timeout.connect(task)
         timer.timer_obj.start(timer.delay_ms)
 
+    def stop_timer(self, timer):
+        if timer.timer_obj != None:
+            timer.timer_obj.stop()
+
     def info_message(self, message, parent):
         aqt.utils.showInfo(message, title=constants.ADDON_NAME, textFormat='rich', parent=parent)
 
     def critical_message(self, message, parent):
         aqt.utils.showCritical(message, title=constants.ADDON_NAME, parent=parent)
 
+    def tooltip_message(self, message):
+        aqt.utils.tooltip(message)
+
     def ask_user(self, message, parent):
         result = aqt.utils.askUser(message, parent=parent)
         return result
@@ -0,0 +1,118 @@
+import sys
+import time
+import threading
+import logging
+
+if hasattr(sys, '_pytest_mode'):
+    import constants
+    import errors
+    import task_scheduler
+else:
+    from . import constants
+    from . import errors
+    from . import task_scheduler
+
+# warms the audio cache, for speakable fields so that the speak button in the editor plays right away, and for
+# the samples of the voice selection dialog. there is a single prefetcher, see LanguageTools.get_audio_prefetcher.
+# requests go through the task scheduler as prefetch tasks, behind anything interactive, and a character budget per
+# time window keeps prefetching from using up the user's quota.
+
+class AudioPrefetcher():
+    def __init__(self, languagetools,
+            character_budget=constants.AUDIO_PREFETCH_CHARACTER_BUDGET,
+            budget_window_seconds=constants.AUDIO_PREFETCH_BUDGET_WINDOW_SECONDS):
+        self.languagetools = languagetools
+        self.character_budget = character_budget
+        self.budget_window_seconds = budget_window_seconds
+        self.lock = threading.Lock()
+        # notified when pending becomes empty
+        self.pending_done = threading.Condition(self.lock)
+
+        # replaced when the editor loads another note, queued requests for older notes are dropped
+        self.cancellation_token = task_scheduler.CancellationToken()
+        # (source_text, voice_key) queued or in flight -> cancellation token, so that the same audio isn't requested twice
+        self.pending = {}
+
+        self.budget_window_start = time.time()
+        self.characters_used = 0
+        # when the service returns an error (quota exceeded for example), stop until the next budget window
+        self.suspended = False
+
+    def new_generation(self):
+        with self.lock:
+            self.cancellation_token.cancel()
+            self.cancellation_token = task_scheduler.CancellationToken()
+            self.remove_cancelled()
+
+    def remove_cancelled(self):
+        # queued tasks which got cancelled won't start, so they won't clear their pending entry
+        self.pending = {key: cancellation_token for key, cancellation_token in self.pending.items() if not cancellation_token.cancelled}
+        if len(self.pending) == 0:
+            self.pending_done.notify_all()
+
+    def prefetch(self, source_text, voice, cancellation_token=None):
+        # cancellation_token: for requests which don't belong to the editor's note, otherwise the current generation
+        # fields holding only markup, an image or a sound tag have nothing to speak
+        if self.languagetools.text_utils.is_empty(source_text):
+            return
+        voice_key = voice['voice_key']
+        if self.languagetools.is_tts_audio_cached(source_text, voice['service'], voice_key, {}):
+            return
+        key = (source_text, str(voice_key))
+        with self.lock:
+            self.remove_cancelled()
+            if key in self.pending or len(self.pending) >= constants.AUDIO_PREFETCH_MAX_PENDING:
+                return
+            if cancellation_token == None:
+                cancellation_token = self.cancellation_token
+            self.pending[key] = cancellation_token
+        self.languagetools.anki_utils.run_in_background(lambda: self.prefetch_task(key, cancellation_token, source_text, voice), None,
+            priority=constants.TaskPriority.prefetch, cancellation_token=cancellation_token)
+
+    def reserve_budget(self, character_count):
+        with self.lock:
+            if time.time() - self.budget_window_start > self.budget_window_seconds:
+                self.budget_window_start = time.time()
+                self.characters_used = 0
+                self.suspended = False
+            if self.suspended or self.characters_used + character_count > self.character_budget:
+                return False
+            self.characters_used += character_count
+            return True
+
+    def prefetch_task(self, key, cancellation_token, source_text, voice):
+        try:
+            if cancellation_token.cancelled:
+                self.languagetools.performance_stats.increment('audio_prefetch.cancelled')
+                return
+            # the budget is charged with the text actually sent to the service, not the field's html
+            processed_text = self.languagetools.text_utils.process(source_text, constants.TransformationType.Audio)
+            if len(processed_text) == 0:
+                return
+            if not self.reserve_budget(len(processed_text)):
+                self.languagetools.performance_stats.increment('audio_prefetch.over_budget')
+                return
+            self.languagetools.get_tts_audio(source_text, voice['service'], voice['language_code'], voice['voice_key'], {}, processed_text=processed_text)
+            self.languagetools.performance_stats.increment('audio_prefetch.done')
+        except errors.AudioLanguageToolsRequestError as e:
+            # other errors (text not supported by the voice for example) only concern this text
+            if e.status_code in constants.AUDIO_PREFETCH_SUSPEND_STATUS_CODES:
+                logging.warning(f'audio prefetch failed, suspending prefetch: {e}')
+                with self.lock:
+                    self.suspended = True
+            else:
+                logging.warning(f'could not prefetch audio: {e}')
+        except:
+            logging.exception('could not prefetch audio')
+        finally:
+            with self.lock:
+                # unless a newer request for the same audio replaced it
+                if self.pending.get(key, None) is cancellation_token:
+                    del self.pending[key]
+                self.remove_cancelled()
+
+    def wait(self):
+        # until the requests which haven't been cancelled are done
+        with self.lock:
+            self.remove_cancelled()
+            self.pending_done.wait_for(lambda: len(self.pending) == 0)
@@ -0,0 +1,157 @@
+import sys
+import os
+import re
+import filecmp
+import logging
+
+if hasattr(sys, '_pytest_mode'):
+    import errors
+else:
+    from . import errors
+
+# long text to speech inputs are split into sentence chunks which are synthesized separately,
+# the resulting mp3 files are then joined by concatenating their frames.
+# generated files get registered in the collection media folder without copying them when possible.
+
+# western sentence terminators need to be followed by whitespace (3.14 is not a sentence end), cjk ones don't
+SENTENCE_END_RE = re.compile(r'[.!?]+(?:\s+|$)|[。！？]+\s*')
+
+def split_sentences(text):
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_RE.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+def chunk_text(text, min_sentence_length):
+    # a chunk ends after every sentence of at least min_sentence_length characters, shorter sentences are joined to
+    # the following one. whether a chunk ends after a sentence only depends on that sentence, so editing or
+    # inserting a sentence only changes its own chunk, the other chunks keep their audio cache entries.
+    # sentences are never cut in the middle.
+    chunks = []
+    current_chunk = ''
+    for sentence in split_sentences(text):
+        current_chunk += sentence
+        if len(sentence.strip()) >= min_sentence_length:
+            chunks.append(current_chunk)
+            current_chunk = ''
+    if len(current_chunk) > 0:
+        chunks.append(current_chunk)
+    chunks = [chunk.strip() for chunk in chunks]
+    return [chunk for chunk in chunks if len(chunk) > 0]
+
+# mpeg audio layer III frame headers
+MPEG_VERSION_1 = 3
+MPEG_VERSION_2 = 2
+MPEG_VERSION_2_5 = 0
+LAYER_3 = 1
+
+BITRATES_KBPS = {
+    MPEG_VERSION_1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    MPEG_VERSION_2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0],
+    MPEG_VERSION_2_5: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0]
+}
+SAMPLE_RATES = {
+    MPEG_VERSION_1: [44100, 48000, 32000, 0],
+    MPEG_VERSION_2: [22050, 24000, 16000, 0],
+    MPEG_VERSION_2_5: [11025, 12000, 8000, 0]
+}
+
+def get_frame_length(header):
+    # returns 0 if the 4 bytes are not a valid layer III frame header
+    if header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return 0
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    if version not in BITRATES_KBPS or layer != LAYER_3:
+        return 0
+    bitrate = BITRATES_KBPS[version][header[2] >> 4]
+    sample_rate = SAMPLE_RATES[version][(header[2] >> 2) & 0x03]
+    if bitrate == 0 or sample_rate == 0:
+        return 0
+    padding = (header[2] >> 1) & 0x01
+    samples_per_frame_factor = 144 if version == MPEG_VERSION_1 else 72
+    return samples_per_frame_factor * bitrate * 1000 // sample_rate + padding
+
+def get_id3v2_length(data):
+    if len(data) < 10 or data[0:3] != b'ID3':
+        return 0
+    # synchsafe integer, 7 bits per byte
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer_length = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer_length
+
+def is_vbr_info_frame(frame):
+    # xing / info / vbri header, describes the frame count of the original file, which is wrong once files are joined
+    return b'Xing' in frame[:64] or b'Info' in frame[:64] or b'VBRI' in frame[:64]
+
+def get_mp3_frames(data):
+    frames = []
+    position = get_id3v2_length(data)
+    end = len(data)
+    if end - position >= 128 and data[end - 128:end - 125] == b'TAG':
+        # id3v1 tag
+        end -= 128
+    while position + 4 <= end:
+        frame_length = get_frame_length(data[position:position + 4])
+        if frame_length == 0 or position + frame_length > end:
+            # not at a frame boundary, look for the next sync word
+            position = data.find(b'\xff', position + 1, end)
+            if position == -1:
+                break
+            continue
+        frames.append(data[position:position + frame_length])
+        position += frame_length
+    if len(frames) > 0 and is_vbr_info_frame(frames[0]):
+        frames = frames[1:]
+    return frames
+
+def concatenate_mp3(audio_content_list):
+    output = []
+    for i, audio_content in enumerate(audio_content_list):
+        frames = get_mp3_frames(audio_content)
+        if len(frames) == 0:
+            raise errors.AudioFormatError(f'chunk {i} is not mp3 audio, could not join audio')
+        output.extend(frames)
+    return b''.join(output)
+
+def link_media_file(source_path, media_dir):
+    # register a generated audio file in the media folder as a hard link instead of a copy. the user_files
+    # cache entry stays in place, files there are only ever replaced (os.replace), never modified, so the media
+    # file can't change underneath anki. returns the media filename, or None when the file couldn't be linked
+    # (different filesystem, no hard link support, existing file with different contents), the caller then copies.
+    filename = os.path.basename(source_path)
+    target_path = os.path.join(media_dir, filename)
+    if os.path.exists(target_path):
+        if os.path.samefile(source_path, target_path) or filecmp.cmp(source_path, target_path, shallow=False):
+            return filename
+        return None
+    try:
+        os.link(source_path, target_path)
+    except OSError as e:
+        logging.info(f'could not hard link {source_path} into the media folder: {e}')
+        return None
+    return filename
+
+def link_media_files(source_paths, media_dir):
+    # register a group of generated files. the same audio is often used by many notes of a bulk run,
+    # each distinct file is only linked once. returns source path -> media filename (or None, see link_media_file)
+    media_filenames = {}
+    for source_path in source_paths:
+        if source_path not in media_filenames:
+            media_filenames[source_path] = link_media_file(source_path, media_dir)
+    return media_filenames
+
+def register_media_files(source_paths, media_dir, add_file):
+    # returns the media filenames in the same order as source_paths. each distinct file is linked once, files which
+    # can't be linked (or all of them when media_dir is None) are registered once with add_file, which copies them.
+    media_filenames = {}
+    if media_dir != None:
+        media_filenames = link_media_files(source_paths, media_dir)
+    for source_path in source_paths:
+        if media_filenames.get(source_path) == None:
+            media_filenames[source_path] = add_file(source_path)
+    return [media_filenames[source_path] for source_path in source_paths]
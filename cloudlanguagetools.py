@@ -1,45 +1,77 @@
+import sys
 import os
-import requests
 import json
 import logging
 
-from . import constants
-from . import errors
-from . import version
+if hasattr(sys, '_pytest_mode'):
+    import constants
+    import errors
+    import version
+    import transport
+    import perf_stats
+else:
+    from . import constants
+    from . import errors
+    from . import version
+    from . import transport
+    from . import perf_stats
 
 class CloudLanguageTools():
-    def __init__(self):
+    def __init__(self, transport_instance=None, performance_stats=None):
         self.base_url = 'https://cloud-language-tools-prod.anki.study'
         if constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_BASE_URL in os.environ:
             self.base_url = os.environ[constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_BASE_URL]
+        self.transport = transport_instance
+        if self.transport == None:
+            self.transport = transport.build_transport_from_environment()
+        self.performance_stats = performance_stats
+        if self.performance_stats == None:
+            self.performance_stats = perf_stats.PerformanceStats()
+
+    def get(self, url_path, headers=None):
+        with self.performance_stats.timer(url_path) as timer_context:
+            response = self.transport.request('GET', self.base_url + url_path, headers=headers)
+            self.record_response(timer_context, response)
+        return response
+
+    def post(self, url_path, json_data, headers=None):
+        request_bytes = len(json.dumps(json_data))
+        with self.performance_stats.timer(url_path, request_bytes=request_bytes) as timer_context:
+            response = self.transport.request('POST', self.base_url + url_path, json_data=json_data, headers=headers)
+            self.record_response(timer_context, response)
+        return response
+
+    def record_response(self, timer_context, response):
+        timer_context.response_bytes = len(response.content)
+        timer_context.error = response.status_code != 200
 
 
     def get_language_list(self):
-        response = requests.get(self.base_url + '/language_list')
+        response = self.get('/language_list')
         return json.loads(response.content)
 
     def get_translation_language_list(self):
-        response = requests.get(self.base_url + '/translation_language_list')
+        response = self.get('/translation_language_list')
         return json.loads(response.content)
 
     def get_transliteration_language_list(self):
-        response = requests.get(self.base_url + '/transliteration_language_list')
+        response = self.get('/transliteration_language_list')
         return json.loads(response.content)
 
     def api_key_validate_query(self, api_key):
-        response = requests.post(self.base_url + '/verify_api_key', json={
+        response = self.post('/verify_api_key', {
             'api_key': api_key
         })
         data = json.loads(response.content)
         return data
 
     def account_info(self, api_key):
-        response = requests.get(self.base_url + '/account', headers={'api_key': api_key})
+        response = self.get('/account', headers={'api_key': api_key})
         data = json.loads(response.content)
         return data
 
     def language_detection(self, api_key, field_sample):
-        response = requests.post(self.base_url + '/detect', json={
+        response = self.post('/detect', {
                 'text_list': field_sample
         }, headers={'api_key': api_key})
         if response.status_code == 200:
@@ -53,7 +85,7 @@ class CloudLanguageTools():
             return None        
 
     def get_tts_voice_list(self, api_key):
-        response = requests.get(self.base_url + '/voice_list')
+        response = self.get('/voice_list')
         if response.status_code == 200:
             data = json.loads(response.content)
             return data
@@ -70,7 +102,7 @@ class CloudLanguageTools():
             'deck_name': 'n/a',
             'options': options
         }
-        response = requests.post(self.base_url + url_path, json=data, 
+        response = self.post(url_path, data, 
             headers={'api_key': api_key, 'client': constants.CLIENT_NAME, 'client_version': version.ANKI_LANGUAGE_TOOLS_VERSION})
 
         if response.status_code == 200:
@@ -80,10 +112,10 @@ class CloudLanguageTools():
             error_msg = response_data
             if 'error' in response_data:
                 error_msg = 'Error: ' + response_data['error']
-            raise errors.AudioLanguageToolsRequestError(f'Status Code: {response.status_code} ({error_msg})')
+            raise errors.AudioLanguageToolsRequestError(f'Status Code: {response.status_code} ({error_msg})', status_code=response.status_code)
 
     def get_translation(self, api_key, source_text, translation_option):
-        response = requests.post(self.base_url + '/translate', json={
+        response = self.post('/translate', {
             'text': source_text,
             'service': translation_option['service'],
             'from_language_key': translation_option['source_language_id'],
@@ -92,7 +124,7 @@ class CloudLanguageTools():
         return response
 
     def get_transliteration(self, api_key, source_text, transliteration_option):
-        response = requests.post(self.base_url + '/transliterate', json={
+        response = self.post('/transliterate', {
                 'text': source_text,
                 'service': transliteration_option['service'],
                 'transliteration_key': transliteration_option['transliteration_key']
@@ -100,7 +132,7 @@ class CloudLanguageTools():
         return response        
 
     def get_translation_all(self, api_key, source_text, from_language, to_language):
-        response = requests.post(self.base_url + '/translate_all', json={
+        response = self.post('/translate_all', {
                 'text': source_text,
                 'from_language': from_language,
                 'to_language': to_language
@@ -1,6 +1,15 @@
 import enum
 
 ENV_VAR_ANKI_LANGUAGE_TOOLS_BASE_URL = 'ANKI_LANGUAGE_TOOLS_BASE_URL'
+# record / replay requests, for benchmarks
+ENV_VAR_ANKI_LANGUAGE_TOOLS_TRANSPORT = 'ANKI_LANGUAGE_TOOLS_TRANSPORT'
+ENV_VAR_ANKI_LANGUAGE_TOOLS_CASSETTE = 'ANKI_LANGUAGE_TOOLS_CASSETTE'
+ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_LATENCY_MS = 'ANKI_LANGUAGE_TOOLS_REPLAY_LATENCY_MS'
+ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_JITTER_MS = 'ANKI_LANGUAGE_TOOLS_REPLAY_JITTER_MS'
+ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_ERROR_RATE = 'ANKI_LANGUAGE_TOOLS_REPLAY_ERROR_RATE'
+ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_SEED = 'ANKI_LANGUAGE_TOOLS_REPLAY_SEED'
+TRANSPORT_MODE_RECORD = 'record'
+TRANSPORT_MODE_REPLAY = 'replay'
 CONFIG_DECK_LANGUAGES = 'deck_languages'
 CONFIG_WANTED_LANGUAGES = 'wanted_languages'
 CONFIG_BATCH_TRANSLATION = 'batch_translations'
@@ -10,21 +19,105 @@ CONFIG_VOICE_SELECTION = 'voice_selection'
 CONFIG_APPLY_UPDATES_AUTOMATICALLY = 'apply_updates_automatically'
 CONFIG_LIVE_UPDATE_DELAY = 'live_update_delay'
 CONFIG_TEXT_PROCESSING = 'text_processing'
+CONFIG_AUDIO_PREFETCH = 'audio_prefetch'
+CONFIG_AUDIO_PREFETCH_NEXT_NOTES = 'audio_prefetch_next_notes'
 ADDON_NAME = 'Language Tools'
 MENU_PREFIX = ADDON_NAME + ':'
 DEFAULT_LANGUAGE = 'en' # always add this language, even if the user didn't add it themselves
 EDITOR_WEB_FIELD_ID_TRANSLATION = 'translation'
 
-GREEN_STYLESHEET = 'background-color: #69F0AE;'
+GREEN_COLOR = '#69F0AE'
+GREEN_STYLESHEET = f'background-color: {GREEN_COLOR};'
 RED_STYLESHEET = 'background-color: #FFCDD2;'
 
-GREEN_STYLESHEET_NIGHTMODE = 'background-color: #2E7D32;'
+GREEN_COLOR_NIGHTMODE = '#2E7D32'
+GREEN_STYLESHEET_NIGHTMODE = f'background-color: {GREEN_COLOR_NIGHTMODE};'
 RED_STYLESHEET_NIGHTMODE = 'background-color: #B71C1C;'
 
 DOCUMENTATION_PERFORM_LANGUAGE_MAPPING = 'Please setup Language Mappings, from the Anki main screen: <b>Tools -> Language Tools: Language Mapping</b>'
 
 CLIENT_NAME = 'languagetools'
 
+# below this number of consecutive simple replacements, sequential str.replace is faster than a single regex pass
+MULTI_PATTERN_MIN_GROUP_SIZE = 8
+
+HTML_TO_TEXT_CACHE_SIZE = 4096
+# a regex text replacement taking longer than this (cpu time) on a text gets reported as slow
+TEXT_REPLACEMENT_TIME_BUDGET_MS = 250
+TEXT_REPLACEMENT_PROFILE_SAMPLE_SIZE = 50
+# profiling samples at most this many language mapped fields
+TEXT_REPLACEMENT_PROFILE_MAX_FIELDS = 20
+# profiling a suspicious pattern runs it on prefixes of the text, growing by this factor
+TEXT_REPLACEMENT_PROFILE_PREFIX_GROWTH = 1.25
+
+# text normalization, applied to cache keys, stored under the text processing settings
+CONFIG_TEXT_PROCESSING_NORMALIZATION = 'normalization'
+NORMALIZATION_UNICODE_NFC = 'unicode_nfc'
+NORMALIZATION_COLLAPSE_WHITESPACE = 'collapse_whitespace'
+NORMALIZATION_REMOVE_ZERO_WIDTH = 'remove_zero_width'
+NORMALIZATION_FOLD_ENTITIES = 'fold_entities'
+NORMALIZATION_DEFAULTS = {
+    NORMALIZATION_UNICODE_NFC: True,
+    NORMALIZATION_COLLAPSE_WHITESPACE: True,
+    NORMALIZATION_REMOVE_ZERO_WIDTH: True,
+    NORMALIZATION_FOLD_ENTITIES: True
+}
+
+INITIALIZATION_MAX_WORKERS = 4
+INITIALIZATION_TIMEOUT_SECONDS = 60
+API_KEY_VALIDATION_CACHE_FILENAME = 'api_key_validation.json'
+API_KEY_VALIDATION_TTL_SECONDS = 24 * 3600
+VOICE_LIST_TTL_SECONDS = 3600
+
+# text to speech for long inputs is split into sentence chunks, synthesized concurrently, see audio_utils.py
+TTS_LONG_TEXT_MIN_LENGTH = 400
+# sentences shorter than this are synthesized together with the following sentence
+TTS_CHUNK_MIN_SENTENCE_LENGTH = 20
+TTS_CHUNK_MAX_WORKERS = 4
+
+# editor audio prefetch, see audio_prefetch.py. runs as prefetch tasks, see TASK_SCHEDULER_MAX_RUNNING_PREFETCH
+AUDIO_PREFETCH_NEXT_NOTES_DEFAULT = 5
+AUDIO_PREFETCH_MAX_PENDING = 50
+AUDIO_PREFETCH_CHARACTER_BUDGET = 5000
+AUDIO_PREFETCH_BUDGET_WINDOW_SECONDS = 3600
+# service responses which suspend prefetching until the next budget window (invalid api key, quota exceeded)
+AUDIO_PREFETCH_SUSPEND_STATUS_CODES = [401, 402, 403, 429]
+# the voice selection dialog prefetches the samples once the voice selection didn't change for this long
+VOICE_SAMPLE_PREFETCH_DELAY_MS = 1500
+
+# live updates in the editor, each source field has its own debounce delay, between the minimum and the
+# live_update_delay config value. it follows the typing cadence of the field (smoothed interval between edits)
+# and the latency of the service, since a request made in the middle of typing costs more when it's slow
+LIVE_UPDATE_DELAY_DEFAULT_MS = 2500
+LIVE_UPDATE_MIN_DELAY_MS = 300
+LIVE_UPDATE_TYPING_INTERVAL_FACTOR = 1.5
+LIVE_UPDATE_SERVICE_LATENCY_FACTOR = 0.5
+LIVE_UPDATE_SMOOTHING = 0.3
+
+# bulk audio runs register media files and save notes in groups, see media_batch.py
+MEDIA_REGISTRATION_GROUP_SIZE = 50
+MEDIA_REGISTRATION_FLUSH_INTERVAL_SECONDS = 10
+
+# background tasks, see task_scheduler.py. maximum number of tasks running at the same time, per priority class
+TASK_SCHEDULER_MAX_RUNNING_INTERACTIVE = 4
+TASK_SCHEDULER_MAX_RUNNING_PREFETCH = 2
+TASK_SCHEDULER_MAX_RUNNING_BATCH = 2
+
+# local language pre-detection, see language_detection.py
+LANGUAGE_DETECTION_NGRAM_MODEL_FILENAME = 'language_detection_ngrams.json'
+LANGUAGE_DETECTION_DOMINANT_SCRIPT_RATIO = 0.9
+LANGUAGE_DETECTION_KANA_MIN_RATIO = 0.1
+LANGUAGE_DETECTION_MIN_TRIGRAMS = 80
+# average log probability per trigram, and margin over the second best language
+LANGUAGE_DETECTION_MIN_SCORE = -7.0
+LANGUAGE_DETECTION_MIN_MARGIN = 0.25
+LANGUAGE_DETECTION_CACHE_FILENAME = 'language_detection.json'
+# decks sharing a note type field are detected together, each deck contributes this many samples (at least)
+LANGUAGE_DETECTION_SKETCH_SAMPLE_SIZE = 20
+LANGUAGE_DETECTION_SKETCH_MIN_TRIGRAMS = 20
+# max share of letters whose script differs between a deck and the pooled sample
+LANGUAGE_DETECTION_SKETCH_MAX_DISTANCE = 0.2
+
 class TransformationType(enum.Enum):
     Translation = enum.auto()
     Transliteration = enum.auto()
@@ -34,6 +127,18 @@ class ReplaceType(enum.Enum):
     simple = enum.auto()
     regex = enum.auto()
 
+class LanguageDetectionMethod(enum.Enum):
+    cached = enum.auto() # field content unchanged since the last detection
+    shared = enum.auto() # same result as the other decks using this note type
+    local = enum.auto()
+    cloud = enum.auto()
+
+# in scheduling order, interactive tasks start first
+class TaskPriority(enum.Enum):
+    interactive = enum.auto() # the user is waiting for the result (editor, playing audio, dialog contents)
+    prefetch = enum.auto() # warming caches, the result may never be needed
+    batch = enum.auto() # bulk runs over many notes
+
 # these are special languages that we store on a field level, which don't allow translating to/from
 class SpecialLanguage(enum.Enum):
     transliteration = enum.auto()
@@ -5,30 +5,40 @@ else:
     from . import errors
 
 # represent a deck + notetype combination (DNT)
+# instances are interned by DeckUtils, so identity is the common case for equality
 class DeckNoteType():
+    __slots__ = ('deck_id', 'deck_name', 'model_id', 'model_name', 'hash_value')
+
     def __init__(self, deck_id, deck_name, model_id, model_name):
         self.deck_id = deck_id
         self.deck_name = deck_name
         self.model_id = model_id 
         self.model_name = model_name
+        self.hash_value = hash((deck_id, model_id))
+
     def __str__(self):
         return f'{self.model_name} / {self.deck_name}'
 
     def __eq__(self, other):
+        if other is self:
+            return True
         if type(other) is type(self):
             return self.deck_id == other.deck_id and self.model_id == other.model_id
         else:
             return False    
 
     def __hash__(self):
-        return hash((self.deck_id, self.model_id))
+        return self.hash_value
 
 
 # represent a deck + notetype + field combination (DNTF), which can be associated with a language
 class DeckNoteTypeField():
+    __slots__ = ('deck_note_type', 'field_name', 'hash_value')
+
     def __init__(self, deck_note_type, field_name):
         self.deck_note_type = deck_note_type
         self.field_name = field_name
+        self.hash_value = hash((deck_note_type.hash_value, field_name))
 
     def get_model_name(self):
         return self.deck_note_type.model_name
@@ -40,13 +50,15 @@ class DeckNoteTypeField():
         return f'{self.get_model_name()} / {self.get_deck_name()} / {self.field_name}'
 
     def __eq__(self, other):
+        if other is self:
+            return True
         if type(other) is type(self):
-            return self.deck_note_type == other.deck_note_type and self.field_name == other.field_name
+            return self.hash_value == other.hash_value and self.deck_note_type == other.deck_note_type and self.field_name == other.field_name
         else:
             return False    
 
     def __hash__(self):
-        return hash((self.deck_note_type, self.field_name))
+        return self.hash_value
 
 class Deck():
     def __init__(self):
@@ -59,9 +71,49 @@ class Deck():
         self.note_type_map[note_type].append(deck_note_type_field)
 
 
+# the parts of an anki note type that the addon needs, looked up once per note type
+class ModelMetadata():
+    def __init__(self, model):
+        self.model_name = model['name']
+        self.field_names = [x['name'] for x in model['flds']]
+        self.field_index_map = {field_name: index for index, field_name in enumerate(self.field_names)}
+
+
 class DeckUtils():
     def __init__(self, anki_utils):
         self.anki_utils = anki_utils
+        self.model_metadata_cache = {}
+        self.deck_name_cache = {}
+        # interned DNT / DNTF instances
+        self.deck_note_type_map = {}
+        self.deck_note_type_field_map = {}
+
+    # must be called when note types or decks are modified / renamed
+    def clear_metadata_cache(self):
+        self.model_metadata_cache = {}
+        self.deck_name_cache = {}
+        self.deck_note_type_map = {}
+        self.deck_note_type_field_map = {}
+
+    def get_model_metadata(self, model_id) -> ModelMetadata:
+        model_metadata = self.model_metadata_cache.get(model_id, None)
+        if model_metadata == None:
+            model = self.anki_utils.get_model(model_id)
+            if model == None:
+                raise errors.AnkiItemNotFoundError(f'Note Type id {model_id} not found')
+            model_metadata = ModelMetadata(model)
+            self.model_metadata_cache[model_id] = model_metadata
+        return model_metadata
+
+    def get_deck_name(self, deck_id):
+        deck_name = self.deck_name_cache.get(deck_id, None)
+        if deck_name == None:
+            deck = self.anki_utils.get_deck(deck_id)
+            if deck == None:
+                raise errors.AnkiItemNotFoundError(f'Deck id {deck_id} not found')
+            deck_name = deck['name']
+            self.deck_name_cache[deck_id] = deck_name
+        return deck_name
 
     # just build a new Deck object
     def new_deck(self):
@@ -69,7 +121,11 @@ class DeckUtils():
 
     # from a DNT + field name, return DNTF
     def build_dntf_from_dnt(self, deck_note_type, field_name):
-        return DeckNoteTypeField(deck_note_type, field_name)
+        key = (deck_note_type, field_name)
+        deck_note_type_field = self.deck_note_type_field_map.get(key, None)
+        if deck_note_type_field == None:
+            deck_note_type_field = self.deck_note_type_field_map.setdefault(key, DeckNoteTypeField(deck_note_type, field_name))
+        return deck_note_type_field
 
     # given a note and the card, build DNT (used within note editor)
     # note: anki.notes.Note
@@ -89,17 +145,22 @@ class DeckUtils():
         deck_note_type = self.build_deck_note_type(deck_id, model_id)
         return deck_note_type    
 
-    def build_deck_note_type_from_editor(self, editor):
+    # given a note being edited, return (deck_id, model_id) without loading the deck or model
+    def editor_get_deck_id_model_id(self, editor):
         note = editor.note
         if note == None:
             raise errors.AnkiNoteEditorError(f'editor.note not found')
 
         if editor.addMode:
-            deck_note_type = self.build_deck_note_type_from_addcard(note, editor.parentWindow)
+            deck_id = editor.parentWindow.deckChooser.selectedId()
         else:
-            deck_note_type = self.build_deck_note_type_from_note_card(note, editor.card)
+            deck_id = editor.card.did
 
-        return deck_note_type
+        return deck_id, note.mid
+
+    def build_deck_note_type_from_editor(self, editor):
+        deck_id, model_id = self.editor_get_deck_id_model_id(editor)
+        return self.build_deck_note_type(deck_id, model_id)
 
     # given an editor and field index, return DNTF
     def editor_get_dntf(self, editor, field_index):
@@ -109,21 +170,18 @@ class DeckUtils():
 
     # given deck id, model id, build DNT
     def build_deck_note_type(self, deck_id, model_id) -> DeckNoteType:
-        model = self.anki_utils.get_model(model_id)
-        if model == None:
-            raise errors.AnkiItemNotFoundError(f'Note Type id {model_id} not found')
-        model_name = model['name']
-        deck = self.anki_utils.get_deck(deck_id)
-        if deck == None:
-            raise errors.AnkiItemNotFoundError(f'Deck id {deck_id} not found')
-        deck_name = deck['name']
-        deck_note_type = DeckNoteType(deck_id, deck_name, model_id, model_name)
+        key = (deck_id, model_id)
+        deck_note_type = self.deck_note_type_map.get(key, None)
+        if deck_note_type == None:
+            model_name = self.get_model_metadata(model_id).model_name
+            deck_name = self.get_deck_name(deck_id)
+            deck_note_type = self.deck_note_type_map.setdefault(key, DeckNoteType(deck_id, deck_name, model_id, model_name))
         return deck_note_type
 
     # given a deck id, model id and field name, build DNTF
     def build_deck_note_type_field(self, deck_id, model_id, field_name) -> DeckNoteTypeField:
         deck_note_type = self.build_deck_note_type(deck_id, model_id)
-        return DeckNoteTypeField(deck_note_type, field_name)
+        return self.build_dntf_from_dnt(deck_note_type, field_name)
 
     # given a deck name, model name and field name, build the DNTF
     def build_deck_note_type_field_from_names(self, deck_name, model_name, field_name) -> DeckNoteTypeField:
@@ -139,25 +197,17 @@ class DeckUtils():
             raise errors.AnkiItemNotFoundError(f'Deck {deck_name} not found')
 
         deck_note_type = self.build_deck_note_type(deck_id, model_id)
-        return DeckNoteTypeField(deck_note_type, field_name)    
+        return self.build_dntf_from_dnt(deck_note_type, field_name)    
 
     # given a DNT, get field names
     def get_field_names(self, deck_note_type):
-        model = self.anki_utils.get_model(deck_note_type.model_id)
-        fields = model['flds']
-        field_names = [x['name'] for x in fields]
-        return field_names        
+        return list(self.get_model_metadata(deck_note_type.model_id).field_names)
 
     # given a DNT and field index, return DNTF
     def get_dntf_from_fieldindex(self, deck_note_type: DeckNoteType, field_index) -> DeckNoteTypeField:
-        model = self.anki_utils.get_model(deck_note_type.model_id)
-        fields = model['flds']
-        field_name = fields[field_index]['name']
-        return self.build_dntf_from_dnt(deck_note_type, field_name)        
+        field_name = self.get_model_metadata(deck_note_type.model_id).field_names[field_index]
+        return self.build_dntf_from_dnt(deck_note_type, field_name)
 
     def get_field_id(self, deck_note_type_field: DeckNoteTypeField):
-        model = self.anki_utils.get_model(deck_note_type_field.deck_note_type.model_id)
-        fields = model['flds']
-        field_names = [x['name'] for x in fields]
-        field_index = field_names.index(deck_note_type_field.field_name)
-        return field_index    
\ No newline at end of file
+        model_metadata = self.get_model_metadata(deck_note_type_field.deck_note_type.model_id)
+        return model_metadata.field_index_map[deck_note_type_field.field_name]
@@ -1,6 +1,6 @@
 import sys
 import logging
-from typing import List, Dict
+from typing import List
 import PyQt5
 
 if hasattr(sys, '_pytest_mode'):
@@ -422,7 +422,9 @@ class BatchConversionDialog(PyQt5.QtWidgets.QDialog):
             if len(self.transliteration_options) == 0:
                 self.languagetools.anki_utils.critical_message(f'No service found for transliteration from language {self.languagetools.get_language_name(self.from_language)}', self)
                 return
-        self.languagetools.anki_utils.run_in_background(self.loadTranslationsTask, self.loadTranslationDone)
+        self.text_utils = self.languagetools.text_utils
+        self.skipped_counts_before = self.text_utils.get_skipped_counts()
+        self.languagetools.anki_utils.run_in_background(self.loadTranslationsTask, self.loadTranslationDone, priority=constants.TaskPriority.batch)
 
     def loadTranslationsTask(self):
         self.load_errors = []
@@ -452,18 +454,28 @@ class BatchConversionDialog(PyQt5.QtWidgets.QDialog):
                     self.noteTableModel.setToFieldData(i, translation_result)
                 return set_to_field
 
+            # prepare all the payloads before sending requests
+            processed_texts = self.languagetools.process_texts_for_batch(self.from_field_data, self.transformation_type)
+
         except Exception as e:
             self.load_errors.append(e)
             return
 
 
+        # near duplicate texts only get sent once
+        result_by_normalized_text = {}
         i = 0
-        for field_data in self.from_field_data:
+        for field_data, processed_text in zip(self.from_field_data, processed_texts):
             try:
-                if self.transformation_type == constants.TransformationType.Translation:
-                    translation_result = self.languagetools.get_translation(field_data, self.translation_option)
-                elif self.transformation_type == constants.TransformationType.Transliteration:
-                    translation_result = self.languagetools.get_transliteration(field_data, self.transliteration_option)
+                normalized_text = self.languagetools.text_utils.normalize(processed_text)
+                if normalized_text in result_by_normalized_text:
+                    translation_result = result_by_normalized_text[normalized_text]
+                else:
+                    if self.transformation_type == constants.TransformationType.Translation:
+                        translation_result = self.languagetools.get_translation(field_data, self.translation_option, processed_text=processed_text)
+                    elif self.transformation_type == constants.TransformationType.Transliteration:
+                        translation_result = self.languagetools.get_transliteration(field_data, self.transliteration_option, processed_text=processed_text)
+                    result_by_normalized_text[normalized_text] = translation_result
                 self.languagetools.anki_utils.run_on_main(get_set_to_field_lambda(i, translation_result))
             except errors.LanguageToolsRequestError as e:
                 self.load_errors.append(e)
@@ -480,6 +492,7 @@ class BatchConversionDialog(PyQt5.QtWidgets.QDialog):
 
 
     def loadTranslationDone(self, future_result):
+        skipped_rules_str = gui_utils.get_skipped_rules_html(self.text_utils, self.skipped_counts_before)
         if len(self.load_errors) > 0:
             error_counts = {}
             for error_exception in self.load_errors:
@@ -487,8 +500,10 @@ class BatchConversionDialog(PyQt5.QtWidgets.QDialog):
                 current_count = error_counts.get(error, 0)
                 error_counts[error] = current_count + 1
             error_message = '<p><b>Errors</b>: ' + ', '.join([f'{key} ({value} times)' for key, value in error_counts.items()]) + '</p>'
-            complete_message = f'<p>Encountered errors while generating {self.transformation_type.name}. You can still click <b>Apply to Notes</b> to apply the values retrieved to your notes.</p>' + error_message
+            complete_message = f'<p>Encountered errors while generating {self.transformation_type.name}. You can still click <b>Apply to Notes</b> to apply the values retrieved to your notes.</p>' + error_message + skipped_rules_str
             self.languagetools.anki_utils.critical_message(complete_message, self)
+        elif len(skipped_rules_str) > 0:
+            self.languagetools.anki_utils.info_message(skipped_rules_str, self)
 
     def accept(self):
         if self.to_fields_empty == False:
@@ -501,9 +516,11 @@ class BatchConversionDialog(PyQt5.QtWidgets.QDialog):
         for (note_id, i) in zip(self.note_id_list, range(len(self.note_id_list))):
             to_field_data = self.noteTableModel.to_field_data[i]
             if to_field_data != None:
-                note = self.languagetools.anki_utils.get_note_by_id(note_id)
+                with self.languagetools.performance_stats.timer('anki_get_note'):
+                    note = self.languagetools.anki_utils.get_note_by_id(note_id)
                 note[self.to_field] = to_field_data
-                note.flush()
+                with self.languagetools.performance_stats.timer('anki_note_flush'):
+                    note.flush()
         self.close()
         # memorize this setting
         deck_note_type_field = self.languagetools.deck_utils.build_dntf_from_dnt(self.deck_note_type, self.to_field)
@@ -514,8 +531,6 @@ class BatchConversionDialog(PyQt5.QtWidgets.QDialog):
 
 
 def prepare_batch_transformation_dialogue(languagetools, deck_note_type, note_id_list, transformation_type):
-    deck_map: Dict[str, Deck] = languagetools.get_populated_decks()
-
     dialog = BatchConversionDialog(languagetools, deck_note_type, note_id_list, transformation_type)
     dialog.setupUi()
     return dialog
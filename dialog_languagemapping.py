@@ -16,17 +16,184 @@ else:
     from . import errors
     from .languagetools import LanguageTools
 
-class LanguageMappingDeckWidgets(object):
-    def __init__(self):
-        pass
+COL_INDEX_NAME = 0
+COL_INDEX_LANGUAGE = 1
+COL_INDEX_SAMPLES = 2
+
+# decks are expanded when the dialog opens, unless there are more than this
+EXPAND_ALL_MAX_DECK_COUNT = 50
+
+class LanguageMappingTreeNode():
+    # a deck, note type or field row. note type / field rows of a deck are only created when the view needs them
+    __slots__ = ('parent', 'row', 'name', 'deck', 'dntf_list', 'dntf', 'children')
+
+    def __init__(self, parent, row, name, deck=None, dntf_list=None, dntf=None):
+        self.parent = parent
+        self.row = row
+        self.name = name
+        self.deck = deck
+        self.dntf_list = dntf_list
+        self.dntf = dntf
+        self.children = None
+
+
+class LanguageMappingTreeModel(PyQt5.QtCore.QAbstractItemModel):
+    def __init__(self, dialog_ui, deck_map: Dict[str, deck_utils.Deck]):
+        PyQt5.QtCore.QAbstractItemModel.__init__(self, None)
+        self.dialog_ui = dialog_ui
+        self.deck_nodes = [LanguageMappingTreeNode(None, row, deck_name, deck=deck) for row, (deck_name, deck) in enumerate(deck_map.items())]
+        self.visible_deck_nodes = self.deck_nodes
+        # field rows which have been realized
+        self.field_node_map = {}
+        self.header_text = ['Deck / Note Type / Field', 'Language', '']
+
+        self.bold_font = PyQt5.QtGui.QFont()
+        self.bold_font.setBold(True)
+        self.changed_background = PyQt5.QtGui.QColor(constants.GREEN_COLOR)
+        if self.dialog_ui.languagetools.anki_utils.night_mode_enabled():
+            self.changed_background = PyQt5.QtGui.QColor(constants.GREEN_COLOR_NIGHTMODE)
+
+    def setFilter(self, filter_text):
+        # only the list of top level rows changes, no need to look at note types / fields
+        self.beginResetModel()
+        self.visible_deck_nodes = [node for node in self.deck_nodes if self.dialog_ui.matchFilter(filter_text, node.name)]
+        for row, node in enumerate(self.visible_deck_nodes):
+            node.row = row
+        self.endResetModel()
+        return len(self.visible_deck_nodes)
+
+    def getChildNodes(self, parent):
+        if not parent.isValid():
+            return self.visible_deck_nodes
+        node = parent.internalPointer()
+        if node.children == None:
+            if node.deck != None:
+                node.children = [LanguageMappingTreeNode(node, row, note_type_name, dntf_list=dntf_list)
+                    for row, (note_type_name, dntf_list) in enumerate(node.deck.note_type_map.items())]
+            elif node.dntf_list != None:
+                node.children = [LanguageMappingTreeNode(node, row, dntf.field_name, dntf=dntf)
+                    for row, dntf in enumerate(node.dntf_list)]
+                for field_node in node.children:
+                    self.field_node_map[field_node.dntf] = field_node
+            else:
+                node.children = []
+        return node.children
+
+    def index(self, row, column, parent=PyQt5.QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return PyQt5.QtCore.QModelIndex()
+        return self.createIndex(row, column, self.getChildNodes(parent)[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return PyQt5.QtCore.QModelIndex()
+        parent_node = index.internalPointer().parent
+        if parent_node == None:
+            return PyQt5.QtCore.QModelIndex()
+        return self.createIndex(parent_node.row, 0, parent_node)
+
+    def rowCount(self, parent=PyQt5.QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.getChildNodes(parent))
+
+    def hasChildren(self, parent=PyQt5.QtCore.QModelIndex()):
+        # answer without creating the child rows
+        if not parent.isValid():
+            return len(self.visible_deck_nodes) > 0
+        if parent.column() > 0:
+            return False
+        return parent.internalPointer().dntf == None
+
+    def columnCount(self, parent=PyQt5.QtCore.QModelIndex()):
+        return len(self.header_text)
+
+    def flags(self, index):
+        if not index.isValid():
+            return PyQt5.QtCore.Qt.NoItemFlags
+        if index.column() == COL_INDEX_LANGUAGE and index.internalPointer().dntf != None:
+            return PyQt5.QtCore.Qt.ItemIsEditable | PyQt5.QtCore.Qt.ItemIsSelectable | PyQt5.QtCore.Qt.ItemIsEnabled
+        return PyQt5.QtCore.Qt.ItemIsSelectable | PyQt5.QtCore.Qt.ItemIsEnabled
+
+    def data(self, index, role):
+        if not index.isValid():
+            return PyQt5.QtCore.QVariant()
+
+        node = index.internalPointer()
+        column = index.column()
+
+        if role == PyQt5.QtCore.Qt.DisplayRole or role == PyQt5.QtCore.Qt.EditRole:
+            if column == COL_INDEX_NAME:
+                return PyQt5.QtCore.QVariant(node.name)
+            if node.dntf != None:
+                if column == COL_INDEX_LANGUAGE:
+                    if role == PyQt5.QtCore.Qt.EditRole:
+                        return PyQt5.QtCore.QVariant(self.dialog_ui.getFieldLanguageIndex(node.dntf))
+                    return PyQt5.QtCore.QVariant(self.dialog_ui.language_name_list[self.dialog_ui.getFieldLanguageIndex(node.dntf)])
+                if column == COL_INDEX_SAMPLES:
+                    return PyQt5.QtCore.QVariant('Show Samples')
+
+        if role == PyQt5.QtCore.Qt.FontRole:
+            if column == COL_INDEX_NAME and node.dntf == None:
+                return self.bold_font
+
+        if role == PyQt5.QtCore.Qt.BackgroundRole:
+            if column == COL_INDEX_LANGUAGE and node.dntf in self.dialog_ui.language_mapping_changes:
+                return self.changed_background
+
+        return PyQt5.QtCore.QVariant()
+
+    def setData(self, index, value, role=PyQt5.QtCore.Qt.EditRole):
+        if not index.isValid() or role != PyQt5.QtCore.Qt.EditRole:
+            return False
+        node = index.internalPointer()
+        if index.column() != COL_INDEX_LANGUAGE or node.dntf == None:
+            return False
+        self.dialog_ui.fieldLanguageIndexChanged(node.dntf, value)
+        return True
+
+    def fieldLanguageChanged(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
+        # rows which haven't been realized yet will pick up the change when they get displayed
+        field_node = self.field_node_map.get(deck_note_type_field, None)
+        if field_node == None:
+            return
+        # the row of a deck hidden by the filter is stale, its rows will be reset when the filter changes
+        deck_node = field_node.parent.parent
+        if deck_node.row >= len(self.visible_deck_nodes) or self.visible_deck_nodes[deck_node.row] is not deck_node:
+            return
+        index = self.createIndex(field_node.row, COL_INDEX_LANGUAGE, field_node)
+        self.dataChanged.emit(index, index)
+
+    def headerData(self, col, orientation, role):
+        if orientation == PyQt5.QtCore.Qt.Horizontal and role == PyQt5.QtCore.Qt.DisplayRole:
+            return PyQt5.QtCore.QVariant(self.header_text[col])
+        return PyQt5.QtCore.QVariant()
+
+
+class LanguageComboBoxDelegate(PyQt5.QtWidgets.QStyledItemDelegate):
+    # a single combobox, created when a language cell gets edited
+    def __init__(self, language_name_list, parent=None):
+        PyQt5.QtWidgets.QStyledItemDelegate.__init__(self, parent)
+        self.language_name_list = language_name_list
+
+    def createEditor(self, parent, option, index):
+        editor = PyQt5.QtWidgets.QComboBox(parent)
+        editor.setObjectName('field_language')
+        editor.addItems(self.language_name_list)
+        editor.setMaxVisibleItems(15)
+        editor.setStyleSheet("combobox-popup: 0;")
+        # commit as soon as a language is picked. connected once here, setEditorData runs again every time the
+        # model emits dataChanged while the editor is open
+        editor.currentIndexChanged.connect(lambda current_index: self.commitData.emit(editor))
+        return editor
 
-class LanguageMappingNoteTypeWidgets(object):
-    def __init__(self):
-        pass
+    def setEditorData(self, editor, index):
+        editor.blockSignals(True)
+        editor.setCurrentIndex(index.data(PyQt5.QtCore.Qt.EditRole))
+        editor.blockSignals(False)
 
-class LanguageMappingFieldWidgets(object):
-    def __init__(self):
-        pass
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentIndex(), PyQt5.QtCore.Qt.EditRole)
 
 
 class LanguageMappingDialog_UI(object):
@@ -39,15 +206,10 @@ class LanguageMappingDialog_UI(object):
         self.language_name_list = data['language_name_list']
         self.language_code_list = data['language_code_list']
         self.language_name_list.append('Not Set')
+        self.language_index_map = {language_code: index for index, language_code in enumerate(self.language_code_list)}
 
         self.language_mapping_changes = {}
 
-        self.deckWidgetMap = {}
-        self.deckNoteTypeWidgetMap = {}
-        self.fieldWidgetMap = {}
-
-        self.dntfComboxBoxMap = {}
-
         self.autodetect_in_progress = False
         self.interrupt_autodetect = False
 
@@ -59,20 +221,6 @@ class LanguageMappingDialog_UI(object):
 
         self.topLevel = PyQt5.QtWidgets.QVBoxLayout(Dialog)
 
-        self.scrollArea = PyQt5.QtWidgets.QScrollArea()
-        
-        self.scrollArea.setVerticalScrollBarPolicy(PyQt5.QtCore.Qt.ScrollBarAlwaysOn)
-        self.scrollArea.setHorizontalScrollBarPolicy(PyQt5.QtCore.Qt.ScrollBarAlwaysOff)
-        self.scrollArea.setWidgetResizable(True)
-        self.scrollArea.setObjectName("scrollArea")
-
-        self.layoutWidget = PyQt5.QtWidgets.QWidget()
-        self.layoutWidget.setObjectName("layoutWidget")
-
-        all_decks = PyQt5.QtWidgets.QVBoxLayout(self.layoutWidget)
-        all_decks.setContentsMargins(20, 20, 20, 20)
-        all_decks.setObjectName("all_decks")
-
         # add header
         self.topLevel.addWidget(gui_utils.get_header_label('Language Mapping'))
 
@@ -81,6 +229,8 @@ class LanguageMappingDialog_UI(object):
         vlayout_left_side = PyQt5.QtWidgets.QVBoxLayout()
         self.autodetect_progressbar = PyQt5.QtWidgets.QProgressBar()
         vlayout_left_side.addWidget(self.autodetect_progressbar)
+        self.autodetect_result_label = PyQt5.QtWidgets.QLabel()
+        vlayout_left_side.addWidget(self.autodetect_result_label)
         hlayout_global.addLayout(vlayout_left_side)
 
         font2 = PyQt5.QtGui.QFont()
@@ -101,6 +251,7 @@ class LanguageMappingDialog_UI(object):
         self.filter_text_input = PyQt5.QtWidgets.QLineEdit()
         self.filter_text_input.textChanged.connect(self.filterTextChanged)
         hlayout.addWidget(self.filter_text_input)
+        self.total_deck_count = len(deck_map)
         self.filter_result_label = PyQt5.QtWidgets.QLabel(self.getFilterResultText(len(deck_map), len(deck_map)))
         hlayout.addWidget(self.filter_result_label)
         
@@ -108,18 +259,22 @@ class LanguageMappingDialog_UI(object):
 
         self.topLevel.addLayout(hlayout_global)
 
-        self.deck_name_widget_map = {}
-        for deck_name, deck in deck_map.items():
-            deck_layout = self.layoutDecks(deck_name, deck)
-            frame = PyQt5.QtWidgets.QFrame()
-            frame.setObjectName(f'frame_{deck_name}')
-            frame.setLayout(deck_layout)
-            self.deck_name_widget_map[deck_name] = frame
-            all_decks.addWidget(frame)
-
-
-        self.scrollArea.setWidget(self.layoutWidget)
-        self.topLevel.addWidget(self.scrollArea)
+        # decks / note types / fields, rows are only realized when the view displays them
+        self.tree_model = LanguageMappingTreeModel(self, deck_map)
+        self.tree_view = PyQt5.QtWidgets.QTreeView()
+        self.tree_view.setObjectName('language_mapping_tree')
+        self.tree_view.setModel(self.tree_model)
+        self.tree_view.setUniformRowHeights(True)
+        self.tree_view.setItemDelegateForColumn(COL_INDEX_LANGUAGE, LanguageComboBoxDelegate(self.language_name_list, self.tree_view))
+        self.tree_view.setEditTriggers(PyQt5.QtWidgets.QAbstractItemView.CurrentChanged | PyQt5.QtWidgets.QAbstractItemView.SelectedClicked)
+        self.tree_view.header().setSectionResizeMode(COL_INDEX_NAME, PyQt5.QtWidgets.QHeaderView.Stretch)
+        self.tree_view.header().setSectionResizeMode(COL_INDEX_LANGUAGE, PyQt5.QtWidgets.QHeaderView.Stretch)
+        self.tree_view.header().setSectionResizeMode(COL_INDEX_SAMPLES, PyQt5.QtWidgets.QHeaderView.ResizeToContents)
+        self.tree_view.header().setStretchLastSection(False)
+        self.tree_view.expanded.connect(self.treeItemExpanded)
+        self.tree_view.clicked.connect(self.treeItemClicked)
+        self.topLevel.addWidget(self.tree_view)
+        self.expandDecks()
 
         self.buttonBox = PyQt5.QtWidgets.QDialogButtonBox()
         self.applyButton = self.buttonBox.addButton("Apply", PyQt5.QtWidgets.QDialogButtonBox.AcceptRole)
@@ -132,163 +287,45 @@ class LanguageMappingDialog_UI(object):
         self.buttonBox.rejected.connect(self.reject)
         self.topLevel.addWidget(self.buttonBox)
 
+    def expandDecks(self):
+        deck_count = self.tree_model.rowCount()
+        if deck_count <= EXPAND_ALL_MAX_DECK_COUNT:
+            for row in range(deck_count):
+                self.tree_view.expand(self.tree_model.index(row, 0))
 
-    def layoutDecks(self, deck_name, deck: deck_utils.Deck):
-        layout = PyQt5.QtWidgets.QVBoxLayout()
-
-        deckWidgets = LanguageMappingDeckWidgets()
-        self.deckWidgetMap[deck_name] = deckWidgets
-        self.deckNoteTypeWidgetMap[deck_name] = {}
-        self.fieldWidgetMap[deck_name] = {}
-
-        deckWidgets.deck_info = PyQt5.QtWidgets.QHBoxLayout()
-        deckWidgets.deck_info.setObjectName("deck_info")
-        
-        fontSize = 14
-
-        deckWidgets.deck_label = PyQt5.QtWidgets.QLabel(self.layoutWidget)
-        font1 = PyQt5.QtGui.QFont()
-        font1.setBold(True)
-        font1.setPointSize(fontSize)
-        deckWidgets.deck_label.setFont(font1)
-        deckWidgets.deck_label.setObjectName("deck_label")
-        deckWidgets.deck_label.setText('Deck:')
-        deckWidgets.deck_info.addWidget(deckWidgets.deck_label)
-
-        font2 = PyQt5.QtGui.QFont()
-        font2.setPointSize(fontSize)
-        deckWidgets.deck_name = PyQt5.QtWidgets.QLabel(self.layoutWidget)
-        deckWidgets.deck_name.setObjectName(f'deck_name_{deck_name}')
-        deckWidgets.deck_name.setText(deck_name)
-        deckWidgets.deck_name.setFont(font2)
-        deckWidgets.deck_info.addWidget(deckWidgets.deck_name)
-
-        deckWidgets.deck_info.addStretch(1)
-
-        layout.addLayout(deckWidgets.deck_info)
-        
-        # iterate over note types 
-        for note_type_name, dntf_list in deck.note_type_map.items():
-            self.layoutNoteTypes(layout, deck_name, note_type_name, dntf_list)
-
-        # add spacing at the end
-        layout.addSpacing(30)
-
-        layout.addStretch(1)
-
-        return layout
-                        
-
-    def layoutNoteTypes(self, layout, deck_name, note_type_name, dntf_list: List[deck_utils.DeckNoteTypeField]):
-        noteTypeWidgets = LanguageMappingNoteTypeWidgets()
-        self.deckNoteTypeWidgetMap[deck_name][note_type_name] = noteTypeWidgets
-        self.fieldWidgetMap[deck_name][note_type_name] = {}
-
-        noteTypeWidgets.note_type_info = PyQt5.QtWidgets.QHBoxLayout()
-        noteTypeWidgets.note_type_info.setObjectName("note_type_info")
-
-        fontSize = 12
-
-        font1 = PyQt5.QtGui.QFont()
-        font1.setBold(True)
-        font1.setPointSize(fontSize)
-
-        noteTypeWidgets.note_type_label = PyQt5.QtWidgets.QLabel(self.layoutWidget)
-        noteTypeWidgets.note_type_label.setObjectName("note_type_label")
-        noteTypeWidgets.note_type_label.setText('Note Type:')
-        noteTypeWidgets.note_type_label.setFont(font1)
-        noteTypeWidgets.note_type_info.addWidget(noteTypeWidgets.note_type_label)
-
-        font2 = PyQt5.QtGui.QFont()
-        font2.setPointSize(fontSize)
-        noteTypeWidgets.note_type_name = PyQt5.QtWidgets.QLabel(self.layoutWidget)
-        noteTypeWidgets.note_type_name.setObjectName(f"note_type_name_{deck_name}_{note_type_name}")
-        noteTypeWidgets.note_type_name.setText(note_type_name)
-        noteTypeWidgets.note_type_name.setFont(font2)
-        noteTypeWidgets.note_type_info.addWidget(noteTypeWidgets.note_type_name)
-
-        noteTypeWidgets.note_type_info.addStretch(1)
-
-        layout.addLayout(noteTypeWidgets.note_type_info)
-
-        noteTypeWidgets.field_info = PyQt5.QtWidgets.QGridLayout()
-        noteTypeWidgets.field_info.setContentsMargins(20, 0, 0, 0)
-        # set stretch factors
-        noteTypeWidgets.field_info.setColumnStretch(0, 50)
-        noteTypeWidgets.field_info.setColumnStretch(1, 50)
-        noteTypeWidgets.field_info.setColumnStretch(2, 0)
-        noteTypeWidgets.field_info.setObjectName("field_info")
-
-        row = 0
-        for deck_note_type_field in dntf_list:
-            self.layoutField(row, deck_note_type_field, noteTypeWidgets.field_info)
-            row += 1
-
-        layout.addLayout(noteTypeWidgets.field_info)
-
-
-    def layoutField(self, row:int, deck_note_type_field: deck_utils.DeckNoteTypeField, gridLayout: PyQt5.QtWidgets.QGridLayout):
-
-        fieldWidgets = LanguageMappingFieldWidgets()
-        self.fieldWidgetMap[deck_note_type_field.deck_note_type.deck_name][deck_note_type_field.deck_note_type.model_name][deck_note_type_field.field_name] = fieldWidgets
-
-        language_set = self.languagetools.get_language(deck_note_type_field)
-
-        fieldWidgets.field_label = PyQt5.QtWidgets.QLabel(self.layoutWidget)
-        field_label_obj_name = f'field_label_{str(deck_note_type_field)}'
-        fieldWidgets.field_label.setObjectName(field_label_obj_name)
-        fieldWidgets.field_label.setText(deck_note_type_field.field_name)
-        gridLayout.addWidget(fieldWidgets.field_label, row, 0, 1, 1)
-
-        fieldWidgets.field_language = PyQt5.QtWidgets.QComboBox(self.layoutWidget)
-        field_language_obj_name = f'field_language_{str(deck_note_type_field)}'
-        fieldWidgets.field_language.setObjectName(field_language_obj_name)
-        fieldWidgets.field_language.addItems(self.language_name_list)
-        fieldWidgets.field_language.setMaxVisibleItems(15)
-        fieldWidgets.field_language.setStyleSheet("combobox-popup: 0;")
-        self.setFieldLanguageIndex(fieldWidgets.field_language, language_set)
-
-        # listen to events
-        def get_currentIndexChangedLambda(comboBox, deck_note_type_field: deck_utils.DeckNoteTypeField):
-            def callback(currentIndex):
-                self.fieldLanguageIndexChanged(comboBox, deck_note_type_field, currentIndex)
-            return callback
-        fieldWidgets.field_language.currentIndexChanged.connect(get_currentIndexChangedLambda(fieldWidgets.field_language, deck_note_type_field)) 
-
-        self.dntfComboxBoxMap[deck_note_type_field] = fieldWidgets.field_language
-
-        gridLayout.addWidget(fieldWidgets.field_language, row, 1, 1, 1)
+    def treeItemExpanded(self, index):
+        # expanding a deck shows all its fields
+        if index.parent().isValid():
+            return
+        for row in range(self.tree_model.rowCount(index)):
+            self.tree_view.expand(self.tree_model.index(row, 0, index))
 
-        fieldWidgets.field_samples_button = PyQt5.QtWidgets.QPushButton(self.layoutWidget)
-        field_samples_button_obj_name = f'field_samples_{str(deck_note_type_field)}'
-        fieldWidgets.field_samples_button.setObjectName(field_samples_button_obj_name)
-        fieldWidgets.field_samples_button.setText('Show Samples')
+    def treeItemClicked(self, index):
+        node = index.internalPointer()
+        if index.column() == COL_INDEX_SAMPLES and node.dntf != None:
+            self.showFieldSamples(node.dntf)
 
-        def getShowFieldSamplesLambda(deck_note_type_field: deck_utils.DeckNoteTypeField):
-            def callback():
-                self.showFieldSamples(deck_note_type_field)
-            return callback
-        fieldWidgets.field_samples_button.pressed.connect(getShowFieldSamplesLambda(deck_note_type_field))
+    def getFieldLanguageIndex(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
+        if deck_note_type_field in self.language_mapping_changes:
+            return self.getLanguageIndex(self.language_mapping_changes[deck_note_type_field])
+        return self.getLanguageIndex(self.languagetools.get_language(deck_note_type_field))
 
-        gridLayout.addWidget(fieldWidgets.field_samples_button, row, 2, 1, 1)
+    def setFieldLanguage(self, deck_note_type_field: deck_utils.DeckNoteTypeField, language):
+        self.fieldLanguageIndexChanged(deck_note_type_field, self.getLanguageIndex(language))
 
-    def setFieldLanguageIndex(self, comboBox, language):
+    def getLanguageIndex(self, language):
         if language != None:
             # locate index of language
-            current_index = self.language_code_list.index(language)
-            comboBox.setCurrentIndex(current_index)
-        else:
-            # not set
-            comboBox.setCurrentIndex(len(self.language_name_list) - 1)
+            return self.language_index_map[language]
+        # not set
+        return len(self.language_name_list) - 1
 
-    def fieldLanguageIndexChanged(self, comboBox, deck_note_type_field: deck_utils.DeckNoteTypeField, currentIndex):
-        # print(f'fieldLanguageIndexChanged: {deck_note_type_field}')
+    def fieldLanguageIndexChanged(self, deck_note_type_field: deck_utils.DeckNoteTypeField, currentIndex):
         language_code = None
         if currentIndex < len(self.language_code_list):
             language_code = self.language_code_list[currentIndex]
         self.language_mapping_changes[deck_note_type_field] = language_code
-        # change stylesheet of combobox
-        comboBox.setStyleSheet(self.languagetools.anki_utils.get_green_stylesheet() + "combobox-popup: 0;")
+        self.tree_model.fieldLanguageChanged(deck_note_type_field)
         # enable apply button
         if not self.autodetect_in_progress:
             self.enableApplyButton()
@@ -328,14 +365,9 @@ class LanguageMappingDialog_UI(object):
 
     def filterTextChanged(self, new_filter_text):
         self.filter_text = new_filter_text
-        total_count = len(self.deck_name_widget_map)
-        displayed_count = 0
-        for deck_name, frame in self.deck_name_widget_map.items():
-            if self.matchFilter(new_filter_text, deck_name):
-                frame.setVisible(True)
-                displayed_count += 1
-            else:
-                frame.setVisible(False)
+        total_count = self.total_deck_count
+        displayed_count = self.tree_model.setFilter(new_filter_text)
+        self.expandDecks()
         filter_result = self.getFilterResultText(displayed_count, total_count)
         self.filter_result_label.setText(filter_result)
 
@@ -353,7 +385,7 @@ class LanguageMappingDialog_UI(object):
         if self.languagetools.ensure_api_key_checked() == False:
             return
 
-        self.languagetools.anki_utils.run_in_background(self.runLanguageDetectionBackground, self.runLanguageDetectionDone)
+        self.languagetools.anki_utils.run_in_background(self.runLanguageDetectionBackground, self.runLanguageDetectionDone, priority=constants.TaskPriority.batch)
 
     def runLanguageDetectionBackground(self):
         try:
@@ -362,36 +394,42 @@ class LanguageMappingDialog_UI(object):
             self.disableApplyButton()
 
             dtnf_list: List[deck_utils.DeckNoteTypeField] = self.languagetools.get_populated_dntf()
-            progress_max = 0
-            for dntf in dtnf_list:
-                deck_name = dntf.deck_note_type.deck_name
-                if self.matchFilter(self.filter_text, deck_name):
-                    progress_max += 1
+            dtnf_list = [dntf for dntf in dtnf_list if self.matchFilter(self.filter_text, dntf.deck_note_type.deck_name)]
+            progress_max = len(dtnf_list)
             self.setProgressBarMax(progress_max)
 
             progress = 0
-            for dntf in dtnf_list:
+            method_counts = {method: 0 for method in constants.LanguageDetectionMethod}
+            for dntf, language, detection_method in self.languagetools.detect_field_languages(dtnf_list):
                 if self.interrupt_autodetect == True:
                     return
 
-                deck_name = dntf.deck_note_type.deck_name
-                if self.matchFilter(self.filter_text, deck_name):
-                    language = self.languagetools.perform_language_detection_deck_note_type_field(dntf)
-                    #self.language_mapping_changes[deck_note_type_field] = language
-                    # need to set combo box correctly.
-                    comboBox = self.dntfComboxBoxMap[dntf]
-                    self.setFieldLanguageIndex(comboBox, language)
-
-                    # progress bar
-                    self.setProgressValue(progress)
-                    progress += 1
+                method_counts[detection_method] += 1
+                self.setDetectedLanguage(dntf, language)
+
+                # progress bar
+                self.setProgressValue(progress)
+                progress += 1
             
             self.setProgressValue(progress_max)
+            self.setDetectionResultText(f'{method_counts[constants.LanguageDetectionMethod.cached]} fields unchanged, '
+                f'{method_counts[constants.LanguageDetectionMethod.shared]} shared with other decks, '
+                f'{method_counts[constants.LanguageDetectionMethod.local]} detected locally, '
+                f'{method_counts[constants.LanguageDetectionMethod.cloud]} using the cloud service')
         except:
             logging.exception('could not run language detection')
             error_message = str(sys.exc_info())
             self.displayErrorMessage(error_message)
+        finally:
+            # keep what was detected so far, even when interrupted
+            self.languagetools.save_language_detection_cache()
+
+
+    def setDetectedLanguage(self, deck_note_type_field, language):
+        self.languagetools.anki_utils.run_on_main(lambda: self.setFieldLanguage(deck_note_type_field, language))
 
+    def setDetectionResultText(self, text):
+        self.languagetools.anki_utils.run_on_main(lambda: self.autodetect_result_label.setText(text))
 
     def setProgressBarMax(self, progress_max):
         self.languagetools.anki_utils.run_on_main(lambda: self.autodetect_progressbar.setMaximum(progress_max))
@@ -0,0 +1,108 @@
+import sys
+import PyQt5
+import logging
+
+if hasattr(sys, '_pytest_mode'):
+    import constants
+    import gui_utils
+    from languagetools import LanguageTools
+else:
+    from . import constants
+    from . import gui_utils
+    from .languagetools import LanguageTools
+
+class PerformanceStatsDialog(PyQt5.QtWidgets.QDialog):
+    COLUMNS = [
+        ('Endpoint', None),
+        ('Count', 'count'),
+        ('Errors', 'error_count'),
+        ('Mean ms', 'mean_ms'),
+        ('p50 ms', 'p50_ms'),
+        ('p90 ms', 'p90_ms'),
+        ('p99 ms', 'p99_ms'),
+        ('Max ms', 'max_ms'),
+        ('Sent bytes', 'request_bytes'),
+        ('Received bytes', 'response_bytes')
+    ]
+
+    def __init__(self, languagetools: LanguageTools):
+        super(PyQt5.QtWidgets.QDialog, self).__init__()
+        self.languagetools = languagetools
+
+    def setupUi(self):
+        self.setWindowTitle(constants.ADDON_NAME)
+        self.resize(900, 500)
+
+        vlayout = PyQt5.QtWidgets.QVBoxLayout(self)
+        vlayout.addWidget(gui_utils.get_header_label('Performance Stats'))
+
+        self.stats_table = PyQt5.QtWidgets.QTableWidget()
+        self.stats_table.setColumnCount(len(self.COLUMNS))
+        self.stats_table.setHorizontalHeaderLabels([column[0] for column in self.COLUMNS])
+        self.stats_table.setEditTriggers(PyQt5.QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.stats_table.horizontalHeader().setSectionResizeMode(PyQt5.QtWidgets.QHeaderView.ResizeToContents)
+        vlayout.addWidget(self.stats_table, 1)
+
+        self.counters_label = PyQt5.QtWidgets.QLabel()
+        self.counters_label.setWordWrap(True)
+        vlayout.addWidget(self.counters_label)
+
+        hlayout = PyQt5.QtWidgets.QHBoxLayout()
+        self.refresh_button = PyQt5.QtWidgets.QPushButton('Refresh')
+        self.reset_button = PyQt5.QtWidgets.QPushButton('Reset')
+        self.export_button = PyQt5.QtWidgets.QPushButton('Export JSON...')
+        self.close_button = PyQt5.QtWidgets.QPushButton('Close')
+        hlayout.addWidget(self.refresh_button)
+        hlayout.addWidget(self.reset_button)
+        hlayout.addWidget(self.export_button)
+        hlayout.addStretch()
+        hlayout.addWidget(self.close_button)
+        vlayout.addLayout(hlayout)
+
+        self.refresh_button.pressed.connect(self.refresh)
+        self.reset_button.pressed.connect(self.reset)
+        self.export_button.pressed.connect(self.export_json)
+        self.close_button.pressed.connect(self.close)
+
+        self.refresh()
+
+    def refresh(self):
+        stats = self.languagetools.get_performance_stats()
+        endpoints = stats['endpoints']
+        self.stats_table.setRowCount(len(endpoints))
+        for row, (endpoint, endpoint_stats) in enumerate(endpoints.items()):
+            for column, (header, key) in enumerate(self.COLUMNS):
+                if key == None:
+                    value = endpoint
+                else:
+                    value = endpoint_stats[key]
+                    if value == None:
+                        value = ''
+                self.stats_table.setItem(row, column, PyQt5.QtWidgets.QTableWidgetItem(str(value)))
+        counters = [f'<b>{key}</b>: {value}' for key, value in stats['counters'].items()]
+        hit_rates = [f'<b>{key} hit rate</b>: {value:.1%}' for key, value in stats['hit_rates'].items()]
+        self.counters_label.setText(f"Collected over {stats['elapsed_s']}s. " + ', '.join(counters + hit_rates))
+
+    def reset(self):
+        self.languagetools.reset_performance_stats()
+        self.refresh()
+
+    def export_json(self):
+        filename, _ = PyQt5.QtWidgets.QFileDialog.getSaveFileName(self, 'Export Performance Stats', 'languagetools_performance_stats.json', 'JSON (*.json)')
+        if len(filename) == 0:
+            return
+        self.export_json_file(filename)
+
+    def export_json_file(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.languagetools.performance_stats.to_json())
+        logging.info(f'exported performance stats to {filename}')
+
+def prepare_performance_stats_dialog(languagetools):
+    dialog = PerformanceStatsDialog(languagetools)
+    dialog.setupUi()
+    return dialog
+
+def performance_stats_dialog(languagetools):
+    dialog = prepare_performance_stats_dialog(languagetools)
+    dialog.exec_()
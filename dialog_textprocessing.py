@@ -169,7 +169,9 @@ class TextProcessingDialog(PyQt5.QtWidgets.QDialog):
     def __init__(self, languagetools: LanguageTools):
         super(PyQt5.QtWidgets.QDialog, self).__init__()
         self.languagetools = languagetools
-        self.textReplacementTableModel = TextReplacementsTableModel(self.update_transformed_text, languagetools.text_utils.replacements)
+        # edit copies of the replacements, the live ones get replaced when the settings are saved
+        replacements = [text_utils.TextReplacement(replacement.to_dict()) for replacement in languagetools.text_utils.replacements]
+        self.textReplacementTableModel = TextReplacementsTableModel(self.update_transformed_text, replacements)
 
     def setupUi(self):
         self.setWindowTitle(constants.ADDON_NAME)
@@ -229,6 +231,35 @@ class TextProcessingDialog(PyQt5.QtWidgets.QDialog):
         hlayout.addWidget(self.add_replace_regex_button)
         self.remove_replace_button = PyQt5.QtWidgets.QPushButton('Remove Selected Rule')
         hlayout.addWidget(self.remove_replace_button)
+        self.profile_rules_button = PyQt5.QtWidgets.QPushButton('Profile Rules')
+        hlayout.addWidget(self.profile_rules_button)
+        vlayout.addLayout(hlayout)
+
+        self.profile_results_label = PyQt5.QtWidgets.QLabel()
+        self.profile_results_label.setWordWrap(True)
+        vlayout.addWidget(self.profile_results_label)
+
+        # rules which weren't applied, or went over the time budget on some texts, since anki started
+        self.rule_status_label = PyQt5.QtWidgets.QLabel(self.get_rule_status_text())
+        self.rule_status_label.setWordWrap(True)
+        vlayout.addWidget(self.rule_status_label)
+
+        # text normalization
+        # ==================
+
+        vlayout.addWidget(gui_utils.get_medium_label('Text Normalization (for caching and duplicate detection)'))
+        normalization_options = self.languagetools.text_utils.normalization_options
+        self.normalization_checkboxes = {}
+        hlayout = PyQt5.QtWidgets.QHBoxLayout()
+        for option_key, label in [(constants.NORMALIZATION_UNICODE_NFC, 'Unicode NFC'),
+                                  (constants.NORMALIZATION_COLLAPSE_WHITESPACE, 'Collapse Whitespace'),
+                                  (constants.NORMALIZATION_REMOVE_ZERO_WIDTH, 'Remove Zero-Width Characters'),
+                                  (constants.NORMALIZATION_FOLD_ENTITIES, 'Fold Non-Breaking Spaces')]:
+            checkbox = PyQt5.QtWidgets.QCheckBox(label)
+            checkbox.setChecked(normalization_options[option_key])
+            hlayout.addWidget(checkbox)
+            self.normalization_checkboxes[option_key] = checkbox
+        hlayout.addStretch()
         vlayout.addLayout(hlayout)
 
         # setup bottom buttons
@@ -249,6 +280,7 @@ class TextProcessingDialog(PyQt5.QtWidgets.QDialog):
         self.add_replace_simple_button.pressed.connect(lambda: self.textReplacementTableModel.add_replacement(constants.ReplaceType.simple))
         self.add_replace_regex_button.pressed.connect(lambda: self.textReplacementTableModel.add_replacement(constants.ReplaceType.regex))
         self.remove_replace_button.pressed.connect(self.delete_text_replacement)
+        self.profile_rules_button.pressed.connect(self.profile_rules)
         self.typing_timer = self.languagetools.anki_utils.wire_typing_timer(self.sample_text_input, self.sample_text_changed)
         self.sample_transformation_type_combo_box.currentIndexChanged.connect(self.sample_transformation_type_changed)
 
@@ -261,7 +293,8 @@ class TextProcessingDialog(PyQt5.QtWidgets.QDialog):
     def get_text_processing_settings(self):
         replacement_list = self.textReplacementTableModel.replacements
         replacement_dict_list = [x.to_dict() for x in replacement_list]
-        return {'replacements': replacement_dict_list}
+        normalization_options = {key: checkbox.isChecked() for key, checkbox in self.normalization_checkboxes.items()}
+        return {'replacements': replacement_dict_list, constants.CONFIG_TEXT_PROCESSING_NORMALIZATION: normalization_options}
 
     def update_transformed_text(self):
         # get the sample text
@@ -279,12 +312,79 @@ class TextProcessingDialog(PyQt5.QtWidgets.QDialog):
         self.languagetools.anki_utils.run_on_main(lambda: self.sample_text_transformed_label.setText(label_text))
 
 
+    def profile_rules(self):
+        self.profile_rules_button.setEnabled(False)
+        self.profile_results_label.setText('Profiling rules on field samples...')
+        # widgets are read here on the main thread, the task only gets plain values
+        sample_text = self.sample_text_input.text()
+        text_processing_settings = self.get_text_processing_settings()
+        self.languagetools.anki_utils.run_in_background(
+            lambda: self.profile_rules_task(sample_text, text_processing_settings), self.profile_rules_done)
+
+    def profile_rules_task(self, sample_text, text_processing_settings):
+        samples = self.languagetools.get_text_processing_profile_samples(constants.TEXT_REPLACEMENT_PROFILE_SAMPLE_SIZE,
+            constants.TEXT_REPLACEMENT_PROFILE_MAX_FIELDS)
+        if len(sample_text) > 0:
+            samples.append(sample_text)
+        utils = text_utils.TextUtils(text_processing_settings)
+        return len(samples), utils.profile_replacements(samples)
+
+    def profile_rules_done(self, future_result):
+        self.profile_rules_button.setEnabled(True)
+        try:
+            sample_count, profile_list = future_result.result()
+        except Exception as e:
+            self.profile_results_label.setText(f'Could not profile rules: {html.escape(str(e))}')
+            return
+        rows = []
+        for profile in profile_list:
+            warning = profile['warning']
+            if warning == None:
+                warning = ''
+            rows.append(f"<tr><td>{html.escape(str(profile['pattern']))}</td><td>{profile['replace_type']}</td>"
+                f"<td>{profile['total_ms']:.2f}</td><td>{profile['max_ms']:.2f}</td><td>{profile['changed_count']}</td>"
+                f"<td><b>{html.escape(warning)}</b></td></tr>")
+        self.profile_results_label.setText(f'Rule cost over {sample_count} field samples:'
+            '<table cellpadding="3"><tr><th>Pattern</th><th>Type</th><th>Total ms</th><th>Max ms</th><th>Texts Changed</th><th>Warning</th></tr>'
+            + ''.join(rows) + '</table>')
+
+    def get_rule_status_text(self):
+        text_utils_instance = self.languagetools.text_utils
+        lines = []
+        skipped_rules = [f'<b>{html.escape(str(replacement.pattern))}</b> ({skipped_count} texts)' for replacement, skipped_count in text_utils_instance.get_skipped_replacements()]
+        if len(skipped_rules) > 0:
+            lines.append('These rules were not applied, their pattern can be very slow and needs to be confirmed when saving: ' + ', '.join(skipped_rules))
+        slow_rules = [f'<b>{html.escape(str(replacement.pattern))}</b> ({replacement.slow_count} texts)' for replacement in text_utils_instance.get_slow_replacements()]
+        if len(slow_rules) > 0:
+            lines.append(f'These rules exceeded the time budget of {constants.TEXT_REPLACEMENT_TIME_BUDGET_MS}ms on some texts: ' + ', '.join(slow_rules))
+        return '<br/>'.join(lines)
+
+    def check_regex_patterns(self):
+        # a pattern which can backtrack exponentially hangs text processing, python regexes can't be interrupted
+        for replacement in self.textReplacementTableModel.replacements:
+            regex_warning = replacement.get_regex_warning()
+            if regex_warning == None:
+                continue
+            if replacement.get_processor() == None:
+                self.languagetools.anki_utils.critical_message(f'Regex rule <b>{html.escape(replacement.pattern)}</b>: {html.escape(regex_warning)}', self)
+                return False
+            if replacement.confirmed_pattern == replacement.pattern:
+                continue
+            proceed = self.languagetools.anki_utils.ask_user(f'Regex rule {replacement.pattern}: {regex_warning}. Save it anyway ?', self)
+            if proceed == False:
+                return False
+            # stored with the rule, otherwise it doesn't run
+            replacement.confirmed_pattern = replacement.pattern
+        return True
+
     def delete_text_replacement(self):
         rows_indices = self.table_view.selectionModel().selectedIndexes()
         if len(rows_indices) == 1:
             self.textReplacementTableModel.delete_rows(rows_indices[0])
 
     def accept(self):
+        if not self.check_regex_patterns():
+            return
         self.languagetools.store_text_processing_settings(self.get_text_processing_settings())
         self.close()
 
@@ -6,14 +6,23 @@ if hasattr(sys, '_pytest_mode'):
     import deck_utils
     import gui_utils
     import errors
+    import task_scheduler
     from languagetools import LanguageTools
 else:
     from . import constants
     from . import deck_utils
     from . import gui_utils
     from . import errors
+    from . import task_scheduler
     from .languagetools import LanguageTools
 
+class SamplePrefetchTimer():
+    # see AnkiUtils.call_on_timer_expire
+    def __init__(self, delay_ms):
+        self.delay_ms = delay_ms
+        self.timer_obj = None
+
+
 class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
     def __init__(self, languagetools: LanguageTools, voice_list):
         super(PyQt5.QtWidgets.QDialog, self).__init__()
@@ -21,6 +30,12 @@ class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
         
         # get list of languages
         self.voice_list = voice_list
+        # language code -> voices, sorted by description
+        self.voices_by_language = {}
+        for voice in self.voice_list:
+            self.voices_by_language.setdefault(voice['language_code'], []).append(voice)
+        for voices in self.voices_by_language.values():
+            voices.sort(key=lambda x: x['voice_description'])
         wanted_language_arrays = languagetools.get_wanted_language_arrays()
         self.language_name_list = wanted_language_arrays['language_name_list']
         self.language_code_list = wanted_language_arrays['language_code_list']
@@ -33,6 +48,10 @@ class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
 
         self.voice_select_callback_enabled = True
 
+        # cancelled whenever the samples or the voice change, queued sample requests are dropped when they're outdated
+        self.prefetch_cancellation_token = task_scheduler.CancellationToken()
+        self.prefetch_timer = SamplePrefetchTimer(constants.VOICE_SAMPLE_PREFETCH_DELAY_MS)
+
     def setupUi(self):
         self.setWindowTitle(constants.ADDON_NAME)
         self.resize(700, 500)
@@ -136,14 +155,13 @@ class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
         samples_reload_button.pressed.connect(self.load_field_samples)
         buttonBox.accepted.connect(self.accept)
         buttonBox.rejected.connect(self.reject)
+        self.finished.connect(self.cancel_prefetch)
 
     def language_index_changed(self, current_index):
         self.voice_select_callback_enabled = False
         self.language_code = self.language_code_list[current_index]
         self.language_name = self.language_name_list[current_index]
-        # filter voices that match this language
-        available_voices = [x for x in self.voice_list if x['language_code'] == self.language_code]
-        self.available_voices = sorted(available_voices, key=lambda x: x['voice_description'])
+        self.available_voices = self.voices_by_language.get(self.language_code, [])
         available_voice_mappings = self.available_voices
         available_voice_names = [x['voice_description'] for x in self.available_voices]
         self.voice_combobox.clear()
@@ -170,6 +188,7 @@ class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
 
     def voice_index_changed(self, current_index):
         if self.voice_select_callback_enabled:
+            self.start_prefetch()
             voice = self.available_voices[current_index]
             change_required = False
             if self.language_code not in self.voice_selection_settings:
@@ -193,6 +212,32 @@ class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
                 self.sample_labels[i].setText(self.field_samples[i])
             else:
                 self.sample_labels[i].setText('empty')
+        self.start_prefetch()
+
+    def get_selected_voice(self):
+        if len(self.available_voices) == 0:
+            return None
+        return self.available_voices[self.voice_combobox.currentIndex()]
+
+    def cancel_prefetch(self):
+        self.languagetools.anki_utils.stop_timer(self.prefetch_timer)
+        self.prefetch_cancellation_token.cancel()
+
+    def start_prefetch(self):
+        # generate audio for the samples with the selected voice, so that play audio doesn't wait for the service.
+        # only once the selection has settled, going through the voice list doesn't request audio for every voice
+        self.cancel_prefetch()
+        self.languagetools.anki_utils.call_on_timer_expire(self.prefetch_timer, self.prefetch_samples)
+
+    def prefetch_samples(self):
+        # each sample is a separate prefetch request, subject to the audio prefetch budget
+        voice = self.get_selected_voice()
+        if voice == None:
+            return
+        self.prefetch_cancellation_token = task_scheduler.CancellationToken()
+        audio_prefetcher = self.languagetools.get_audio_prefetcher()
+        for source_text in self.field_samples:
+            audio_prefetcher.prefetch(source_text, voice, cancellation_token=self.prefetch_cancellation_token)
 
     def play_sample(self, i):
         if i < len(self.field_samples):
@@ -201,9 +246,7 @@ class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
                 # no voice available
                 self.languagetools.anki_utils.critical_message(f'No voice available for {self.language_name}', self)
                 return
-            # get index of voice
-            voice_index = self.voice_combobox.currentIndex()
-            voice = self.available_voices[voice_index]
+            voice = self.get_selected_voice()
 
             self.sample_play_buttons[i].setText('Loading...')
             self.sample_play_buttons[i].setDisabled(True)
@@ -217,6 +260,10 @@ class VoiceSelectionDialog(PyQt5.QtWidgets.QDialog):
         language_code = voice['language_code']
 
         try:
+            if self.languagetools.is_tts_audio_cached(source_text, service, voice_key, {}):
+                self.languagetools.performance_stats.increment('voice_sample_prefetch.hit')
+            else:
+                self.languagetools.performance_stats.increment('voice_sample_prefetch.miss')
             self.languagetools.play_tts_audio(source_text, service, language_code, voice_key, {})
         except errors.LanguageToolsRequestError as err:
             self.play_audio_error = str(err)
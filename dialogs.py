@@ -3,6 +3,7 @@ from typing import List, Dict
 import traceback
 import logging
 import json
+import html
 import urllib.parse
 
 import aqt.qt
@@ -17,6 +18,7 @@ if hasattr(sys, '_pytest_mode'):
     import dialog_voiceselection
     import dialog_apikey
     import dialog_batchtransformation
+    import media_batch
     from languagetools import LanguageTools
 else:
     from . import constants
@@ -27,6 +29,7 @@ else:
     from . import dialog_voiceselection
     from . import dialog_apikey
     from . import dialog_batchtransformation
+    from . import media_batch
     from .languagetools import LanguageTools
 
 
@@ -210,20 +213,27 @@ class AddAudioDialog(aqt.qt.QDialog):
         action_str = f'Add Audio to {self.to_field}'
         aqt.mw.checkpoint(action_str)
 
-        aqt.mw.taskman.run_in_background(self.add_audio_task, self.add_audio_task_done)
+        self.text_utils = self.languagetools.text_utils
+        self.skipped_counts_before = self.text_utils.get_skipped_counts()
+        self.languagetools.anki_utils.run_in_background(self.add_audio_task, self.add_audio_task_done, priority=constants.TaskPriority.batch)
 
     def add_audio_task(self):
         self.generate_audio_errors = []
+        registration_batch = media_batch.MediaRegistrationBatch(self.languagetools)
         i = 0
-        for note_id in self.note_id_list:
-            try:
-                result = self.languagetools.generate_audio_for_field(note_id, self.from_field, self.to_field, self.voice)
-                if result == True:
-                    self.success_count += 1
-            except errors.LanguageToolsRequestError as err:
-                self.generate_audio_errors.append(str(err))
-            i += 1
-            aqt.mw.taskman.run_on_main(lambda: self.progress_bar.setValue(i))
+        try:
+            for note_id in self.note_id_list:
+                try:
+                    result = self.languagetools.generate_audio_for_field(note_id, self.from_field, self.to_field, self.voice, media_batch=registration_batch)
+                    if result == True:
+                        self.success_count += 1
+                except errors.LanguageToolsRequestError as err:
+                    self.generate_audio_errors.append(str(err))
+                i += 1
+                aqt.mw.taskman.run_on_main(lambda: self.progress_bar.setValue(i))
+        finally:
+            # last, incomplete group. also when the run stops on an error, the audio has been generated already
+            registration_batch.flush()
 
     def add_audio_task_done(self, future_result):
         # are there any errors ?
@@ -234,9 +244,10 @@ class AddAudioDialog(aqt.qt.QDialog):
                 current_count = error_counts.get(error, 0)
                 error_counts[error] = current_count + 1
             errors_str = '<p><b>Errors</b>: ' + ', '.join([f'{key} ({value} times)' for key, value in error_counts.items()]) + '</p>'
-        completion_message = f"Added Audio to field <b>{self.to_field}</b> using voice <b>{self.voice['voice_description']}</b>. Success: <b>{self.success_count}</b> out of <b>{len(self.note_id_list)}</b>.{errors_str}"
+        skipped_rules_str = gui_utils.get_skipped_rules_html(self.text_utils, self.skipped_counts_before)
+        completion_message = f"Added Audio to field <b>{self.to_field}</b> using voice <b>{self.voice['voice_description']}</b>. Success: <b>{self.success_count}</b> out of <b>{len(self.note_id_list)}</b>.{errors_str}{skipped_rules_str}"
         self.close()
-        if len(errors_str) > 0:
+        if len(errors_str) > 0 or len(skipped_rules_str) > 0:
             aqt.utils.showWarning(completion_message, title=constants.ADDON_NAME, parent=self)
         else:
             aqt.utils.showInfo(completion_message, title=constants.ADDON_NAME, parent=self)
@@ -256,6 +267,9 @@ class NoteSettingsDialogBase(aqt.qt.QDialog):
         self.apply_updates_setting_changed = False
         self.apply_updates_value = True
 
+        self.audio_prefetch_setting_changed = False
+        self.audio_prefetch_value = False
+
     def layout_rules(self, vlayout):
 
         font_bold = QtGui.QFont()
@@ -488,6 +502,12 @@ class NoteSettingsDialog(NoteSettingsDialogBase):
         self.checkbox.setContentsMargins(10, 0, 10, 0)
         vlayout.addWidget(self.checkbox)
 
+        vlayout.addWidget(gui_utils.get_medium_label('Prefetch Audio'))
+        self.audio_prefetch_checkbox = QtWidgets.QCheckBox(f'Generate audio in the background when a note is loaded in the editor, and for the next {self.languagetools.get_audio_prefetch_next_notes()} notes in the Browser')
+        self.audio_prefetch_checkbox.setChecked(self.languagetools.get_audio_prefetch_enabled())
+        self.audio_prefetch_checkbox.setContentsMargins(10, 0, 10, 0)
+        vlayout.addWidget(self.audio_prefetch_checkbox)
+
         vlayout.addStretch()
 
         # buttom buttons
@@ -500,6 +520,7 @@ class NoteSettingsDialog(NoteSettingsDialogBase):
   
         # wire events
         self.checkbox.stateChanged.connect(self.apply_updates_state_changed)
+        self.audio_prefetch_checkbox.stateChanged.connect(self.audio_prefetch_state_changed)
         buttonBox.accepted.connect(self.accept)
         buttonBox.rejected.connect(self.reject)
 
@@ -522,6 +543,11 @@ class NoteSettingsDialog(NoteSettingsDialogBase):
         self.apply_updates_setting_changed = True
         self.apply_updates_value = self.checkbox.isChecked()
         self.enable_apply_button()
+
+    def audio_prefetch_state_changed(self, state):
+        self.audio_prefetch_setting_changed = True
+        self.audio_prefetch_value = self.audio_prefetch_checkbox.isChecked()
+        self.enable_apply_button()
     
     def enable_apply_button(self):
         self.applyButton.setEnabled(True)
@@ -531,6 +557,8 @@ class NoteSettingsDialog(NoteSettingsDialogBase):
     def accept(self):
         if self.apply_updates_setting_changed:
             self.languagetools.set_apply_updates_automatically(self.apply_updates_value)
+        if self.audio_prefetch_setting_changed:
+            self.languagetools.set_audio_prefetch_enabled(self.audio_prefetch_value)
 
         for dntf in self.remove_translation_map.keys():
             self.languagetools.remove_translation_setting(dntf)
@@ -596,11 +624,14 @@ class RunRulesDialog(NoteSettingsDialogBase):
             # don't continue
             return
 
-        aqt.mw.taskman.run_in_background(self.process_rules_task, self.process_rules_task_done)
+        self.text_utils = self.languagetools.text_utils
+        self.skipped_counts_before = self.text_utils.get_skipped_counts()
+        self.languagetools.anki_utils.run_in_background(self.process_rules_task, self.process_rules_task_done, priority=constants.TaskPriority.batch)
 
 
 
     def process_rules_task(self):
+        registration_batch = media_batch.MediaRegistrationBatch(self.languagetools)
         try:
             translation_settings = self.languagetools.get_batch_translation_settings(self.deck_note_type)
             transliteration_settings = self.languagetools.get_batch_transliteration_settings(self.deck_note_type)
@@ -615,12 +646,18 @@ class RunRulesDialog(NoteSettingsDialogBase):
             logging.debug(f'num rules enabled: {num_rules}')
             aqt.mw.taskman.run_on_main(lambda: self.progress_bar.setMaximum(len(self.note_id_list) * num_rules))
 
+            # each note is loaded once, for the text preprocessing and for the rules
+            notes = []
+            for note_id in self.note_id_list:
+                with self.languagetools.performance_stats.timer('anki_get_note'):
+                    notes.append(aqt.mw.col.getNote(note_id))
+            processed_text_map = self.preprocess_rule_inputs(notes, translation_settings, transliteration_settings, audio_settings)
+
             progress_value = 0
             self.attempt_count = 0
             self.success_count = 0
             self.generate_errors = []
-            for note_id in self.note_id_list:
-                note = aqt.mw.col.getNote(note_id)
+            for note_index, (note_id, note) in enumerate(zip(self.note_id_list, notes)):
                 for to_field, setting in translation_settings.items():
                     if self.target_field_checkbox_map[to_field].isChecked():
                         try:
@@ -632,7 +669,8 @@ class RunRulesDialog(NoteSettingsDialogBase):
 
                             field_data = note[from_field]
                             translation_option = setting['translation_option']
-                            translation_result = self.languagetools.get_translation(field_data, translation_option)
+                            processed_text = self.get_processed_text(processed_text_map, from_field, constants.TransformationType.Translation, note_index)
+                            translation_result = self.languagetools.get_translation(field_data, translation_option, processed_text=processed_text)
                             note[to_field] = translation_result
                             self.success_count += 1
                         except Exception as err:
@@ -651,7 +689,8 @@ class RunRulesDialog(NoteSettingsDialogBase):
 
                             field_data = note[from_field]
                             transliteration_option = setting['transliteration_option']
-                            transliteration_result = self.languagetools.get_transliteration(field_data, transliteration_option)
+                            processed_text = self.get_processed_text(processed_text_map, from_field, constants.TransformationType.Transliteration, note_index)
+                            transliteration_result = self.languagetools.get_transliteration(field_data, transliteration_option, processed_text=processed_text)
                             note[to_field] = transliteration_result
                             self.success_count += 1
                         except Exception as err:
@@ -671,8 +710,10 @@ class RunRulesDialog(NoteSettingsDialogBase):
                             from_language_code = self.languagetools.get_language(from_dntf)
                             voice_selection_settings = self.languagetools.get_voice_selection_settings()
                             voice = voice_selection_settings[from_language_code]
-                            result = self.languagetools.generate_audio_tag_collection(field_data, voice)
-                            note[to_field] = result['sound_tag']
+                            processed_text = self.get_processed_text(processed_text_map, from_field, constants.TransformationType.Audio, note_index)
+                            generated_filename = self.languagetools.get_tts_audio(field_data, voice['service'], voice['language_code'], voice['voice_key'], {}, processed_text=processed_text)
+                            if generated_filename != None:
+                                registration_batch.add_audio(note, to_field, generated_filename)
                             self.success_count += 1
                         except Exception as err:
                             logging.error(f'error while getting audio for note_id {note_id}', exc_info=True)
@@ -680,14 +721,56 @@ class RunRulesDialog(NoteSettingsDialogBase):
                         progress_value += 1
                         aqt.mw.taskman.run_on_main(lambda: self.progress_bar.setValue(progress_value))
 
-                # write output to note
-                note.flush()
-
+                # write output to note, notes are saved in groups
+                registration_batch.add_note(note)
 
         except:
             logging.error('processing error', exc_info=True)
-
-
+        finally:
+            # last, incomplete group. also when the run stops on an error, the notes processed so far get saved
+            registration_batch.flush()
+
+
+
+    def preprocess_rule_inputs(self, notes, translation_settings, transliteration_settings, audio_settings):
+        # run text processing for all notes up front, for each (source field, transformation type).
+        # source fields which are the target of another enabled rule get processed when the rule runs, since their
+        # content changes while rules get applied.
+        enabled_rules = []
+        for transformation_type, settings in [(constants.TransformationType.Translation, translation_settings),
+                                              (constants.TransformationType.Transliteration, transliteration_settings)]:
+            for to_field, setting in settings.items():
+                if self.target_field_checkbox_map[to_field].isChecked():
+                    enabled_rules.append((transformation_type, setting['from_field'], to_field))
+        for to_field, from_field in audio_settings.items():
+            if self.target_field_checkbox_map[to_field].isChecked():
+                enabled_rules.append((constants.TransformationType.Audio, from_field, to_field))
+
+        target_fields = set([to_field for transformation_type, from_field, to_field in enabled_rules])
+        source_fields = set([from_field for transformation_type, from_field, to_field in enabled_rules if from_field not in target_fields])
+        if len(source_fields) == 0:
+            return {}
+        field_texts = {from_field: [] for from_field in source_fields}
+        for note in notes:
+            for from_field in list(field_texts.keys()):
+                try:
+                    field_texts[from_field].append(note[from_field])
+                except KeyError:
+                    # field not present, the error gets reported when the rule runs
+                    del field_texts[from_field]
+        processed_text_map = {}
+        for transformation_type, from_field, to_field in enabled_rules:
+            key = (from_field, transformation_type)
+            if from_field not in field_texts or key in processed_text_map:
+                continue
+            processed_text_map[key] = self.languagetools.process_texts_for_batch(field_texts[from_field], transformation_type)
+        return processed_text_map
+
+    def get_processed_text(self, processed_text_map, from_field, transformation_type, note_index):
+        processed_texts = processed_text_map.get((from_field, transformation_type), None)
+        if processed_texts == None:
+            return None
+        return processed_texts[note_index]
 
     def process_rules_task_done(self, future_result):
         # are there any errors ?
@@ -698,9 +781,10 @@ class RunRulesDialog(NoteSettingsDialogBase):
                 current_count = error_counts.get(error, 0)
                 error_counts[error] = current_count + 1
             errors_str = '<p><b>Errors</b>: ' + ', '.join([f'{key} ({value} times)' for key, value in error_counts.items()]) + '</p>'
-        completion_message = f"Generated data for <b>{len(self.note_id_list)}</b> notes. Success: <b>{self.success_count}</b> out of <b>{self.attempt_count}</b>.{errors_str}"
+        skipped_rules_str = gui_utils.get_skipped_rules_html(self.text_utils, self.skipped_counts_before)
+        completion_message = f"Generated data for <b>{len(self.note_id_list)}</b> notes. Success: <b>{self.success_count}</b> out of <b>{self.attempt_count}</b>.{errors_str}{skipped_rules_str}"
         self.close()
-        if len(errors_str) > 0:
+        if len(errors_str) > 0 or len(skipped_rules_str) > 0:
             aqt.utils.showWarning(completion_message, title=constants.ADDON_NAME, parent=self)
         else:
             aqt.utils.showInfo(completion_message, title=constants.ADDON_NAME, parent=self)        
@@ -893,6 +977,17 @@ def show_settings_dialog(languagetools, browser: aqt.browser.Browser, note_id_li
     dialog.exec_()
 
 
+def text_normalization_report(languagetools, browser: aqt.browser.Browser, note_id_list):
+    report = languagetools.measure_text_normalization(note_id_list)
+    rows = []
+    for field_name, result in report.items():
+        rows.append(f"<tr><td>{html.escape(field_name)}</td><td>{result['text_count']}</td><td>{result['distinct_count']}</td>"
+            f"<td>{result['distinct_normalized_count']}</td><td>{result['collapsed_count']}</td></tr>")
+    text = ('<p>Distinct texts (after text processing for Audio) which collapse under text normalization:</p>'
+        '<table cellpadding="4"><tr><th>Field</th><th>Notes</th><th>Distinct</th><th>Distinct Normalized</th><th>Collapsed</th></tr>'
+        + ''.join(rows) + '</table>')
+    aqt.utils.showInfo(text, title=constants.ADDON_NAME, parent=browser, textFormat='rich')
+
 def show_api_key_dialog(languagetools):
     dialog = dialog_apikey.prepare_api_key_dialog(languagetools)
     dialog.exec_()
\ No newline at end of file
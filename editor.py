@@ -10,12 +10,12 @@ import aqt.gui_hooks
 import aqt.editor
 import aqt.webview
 import aqt.addcards
+import aqt.browser
 import anki.notes
 import anki.models
 
 # addon imports
 # from .languagetools import LanguageTools, DeckNoteTypeField, build_deck_note_type, build_deck_note_type_from_note, build_deck_note_type_from_note_card, build_deck_note_type_from_addcard, LanguageToolsRequestError, AnkiNoteEditorError
-from . import constants
 from . import errors
 from . import deck_utils
 from .languagetools import LanguageTools
@@ -46,32 +46,18 @@ def init(languagetools):
         web_content.css.append(css_path)
 
     def loadNote(editor: aqt.editor.Editor):
-        note = editor.note
-        deck_note_type = languagetools.deck_utils.build_deck_note_type_from_editor(editor)
-
-        model = note.model()
-        fields = model['flds']
-        field_options = []
-        for index, field in enumerate(fields):
-            field_name = field['name']
-
-            field_type ='regular'
-            # is this field a sound field ?
-            dntf = languagetools.deck_utils.build_dntf_from_dnt(deck_note_type, field_name)
-            field_language = languagetools.get_language(dntf)
-            if field_language != None:
-                if languagetools.get_batch_translation_setting_field(dntf) != None:
-                    # add translation settings
-                    field_type = 'translation'
-                elif field_language == constants.SpecialLanguage.sound.name:
-                    # add_play_sound_collection(editor, index, field_name)
-                    field_type = 'sound'
-                elif field_language in languagetools.get_voice_selection_settings(): # is there a voice associated with this language ?
-                    # add_tts_speak(editor, index, field_name)
-                    field_type = 'language'
-            field_options.append(field_type)
+        field_options = editor_manager.get_field_options(editor)
         configure_editor_fields(editor, field_options)
-        
+        # the browser's row change hook already started prefetching for this note
+        editor_manager.prefetch_editor_audio(editor, new_generation=not isinstance(editor.parentWindow, aqt.browser.Browser))
+
+    def on_browser_did_change_row(browser: aqt.browser.Browser):
+        # fires before the browser's editor reports the note as loaded (that comes from a javascript callback),
+        # prefetch the current note and the ones after it
+        if not languagetools.get_audio_prefetch_enabled():
+            return
+        note_deck_id_list = languagetools.anki_utils.get_browser_next_note_deck_ids(browser, languagetools.get_audio_prefetch_next_notes())
+        editor_manager.prefetch_browser_audio(browser.editor, note_deck_id_list)
 
     def onBridge(handled, str, editor):
         # return handled # don't do anything for now
@@ -133,11 +119,13 @@ def init(languagetools):
                 def play_audio_done(future_result):
                     pass
 
-                aqt.mw.taskman.run_in_background(lambda: play_audio(languagetools, source_text, voice), lambda x: play_audio_done(x))
+                languagetools.anki_utils.run_in_background(lambda: play_audio(languagetools, source_text, voice), lambda x: play_audio_done(x))
 
             except errors.AnkiNoteEditorError as e:
                 # logging.error('Could not speak', exc_info=True)
                 aqt.utils.showCritical(repr(e))
+            except errors.LanguageToolsNotReadyError as e:
+                languagetools.anki_utils.tooltip_message(str(e))
 
             return handled
 
@@ -149,10 +137,17 @@ def init(languagetools):
             # user updated field, see if we need to do any transformations
             editor_manager.process_field_update(editor, str)
 
+        if str.startswith("blur:"):
+            # user left the field, apply pending updates right away
+            editor_manager.process_field_blur(editor, str)
+
 
         return handled
 
 
     aqt.gui_hooks.webview_will_set_content.append(on_webview_will_set_content)
     aqt.gui_hooks.editor_did_load_note.append(loadNote)
+    # browser_did_change_row appeared in anki 2.1.45, without it audio only gets prefetched when the editor loads a note
+    if hasattr(aqt.gui_hooks, 'browser_did_change_row'):
+        aqt.gui_hooks.browser_did_change_row.append(on_browser_did_change_row)
     aqt.gui_hooks.webview_did_receive_js_message.append(onBridge)
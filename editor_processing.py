@@ -1,22 +1,43 @@
 import logging
 import sys
+import time
 
 if hasattr(sys, '_pytest_mode'):
     import constants
     import errors
     import dialog_choosetranslation
     import deck_utils
+    import task_scheduler
 else:
     from . import constants
     from . import errors
     from . import dialog_choosetranslation
     from . import deck_utils
+    from . import task_scheduler
 
 class FieldChangeTimer():
     def __init__(self, delay_ms):
         self.delay_ms = delay_ms
         self.timer_obj = None
 
+class FieldDebounceTimer(FieldChangeTimer):
+    # one per source field, keeps track of how fast the user edits that field
+    def __init__(self, delay_ms):
+        FieldChangeTimer.__init__(self, delay_ms)
+        self.last_change_time = None
+        self.typing_interval_ms = None
+
+    def record_change(self, change_time, max_interval_ms):
+        if self.last_change_time != None:
+            interval_ms = (change_time - self.last_change_time) * 1000.0
+            # a longer pause means the user started editing again, it doesn't say anything about the cadence
+            if interval_ms <= max_interval_ms:
+                if self.typing_interval_ms == None:
+                    self.typing_interval_ms = interval_ms
+                else:
+                    self.typing_interval_ms += constants.LIVE_UPDATE_SMOOTHING * (interval_ms - self.typing_interval_ms)
+        self.last_change_time = change_time
+
 class FieldChange():
     def __init__(self, editor, deck_note_type, from_deck_note_type_field, note_id, field_value):
         self.editor = editor
@@ -29,7 +50,102 @@ class EditorManager():
     def __init__(self, languagetools):
         self.languagetools = languagetools
         self.buffered_field_changes = {}
-        self.field_change_timer = FieldChangeTimer(languagetools.config.get(constants.CONFIG_LIVE_UPDATE_DELAY, 2500))
+        self.max_field_change_delay_ms = languagetools.config.get(constants.CONFIG_LIVE_UPDATE_DELAY, constants.LIVE_UPDATE_DELAY_DEFAULT_MS)
+        # source field -> FieldDebounceTimer
+        self.field_change_timers = {}
+        # smoothed time between sending a live update request and getting the result
+        self.service_latency_ms = None
+        # field options for each (deck_id, model_id), valid for a given config and metadata version
+        self.field_options_cache = {}
+        self.field_options_cache_version = self.get_field_options_cache_version()
+        # target field -> cancellation token of the request in flight, superseded when the source field changes again
+        self.transformation_cancellation_tokens = {}
+
+    def clear_field_options_cache(self):
+        self.field_options_cache = {}
+
+    def get_field_options_cache_version(self):
+        return (self.languagetools.config_version, self.languagetools.metadata_version)
+
+    def get_field_options(self, editor):
+        # called every time the editor loads a note, only recompute when the deck / note type or config changed
+        deck_id, model_id = self.languagetools.deck_utils.editor_get_deck_id_model_id(editor)
+        return self.get_deck_note_type_field_options(deck_id, model_id)
+
+    def get_deck_note_type_field_options(self, deck_id, model_id):
+        # also used by audio prefetch, which can run before the editor loads the note
+        cache_version = self.get_field_options_cache_version()
+        if self.field_options_cache_version != cache_version:
+            self.clear_field_options_cache()
+            self.field_options_cache_version = cache_version
+        key = (deck_id, model_id)
+        field_options = self.field_options_cache.get(key, None)
+        if field_options == None:
+            deck_note_type = self.languagetools.deck_utils.build_deck_note_type(*key)
+            field_options = self.compute_field_options(deck_note_type)
+            self.field_options_cache[key] = field_options
+        return field_options
+
+    def get_audio_prefetcher(self):
+        return self.languagetools.get_audio_prefetcher()
+
+    def prefetch_editor_audio(self, editor, new_generation=True):
+        # the note just loaded, queued requests for the previous note aren't needed anymore. in the browser,
+        # the row change gets reported first, and the requests for the following notes are part of this generation.
+        if not self.languagetools.get_audio_prefetch_enabled():
+            return
+        if new_generation:
+            self.get_audio_prefetcher().new_generation()
+        deck_id, model_id = self.languagetools.deck_utils.editor_get_deck_id_model_id(editor)
+        self.prefetch_note_audio(editor.note, deck_id, model_id)
+
+    def prefetch_browser_audio(self, editor, note_deck_id_list):
+        # the browser changed rows, before its editor reports the note as loaded. the note in the editor comes first,
+        # then (note_id, deck_id) for the notes following it
+        if not self.languagetools.get_audio_prefetch_enabled():
+            return
+        self.get_audio_prefetcher().new_generation()
+        if editor.note != None:
+            deck_id, model_id = self.languagetools.deck_utils.editor_get_deck_id_model_id(editor)
+            self.prefetch_note_audio(editor.note, deck_id, model_id)
+        for note_id, deck_id in note_deck_id_list:
+            try:
+                note = self.languagetools.anki_utils.get_note_by_id(note_id)
+                self.prefetch_note_audio(note, deck_id, note.mid)
+            except errors.AnkiItemNotFoundError as e:
+                logging.warning(f'could not prefetch audio for note {note_id}: {e}')
+
+    def prefetch_note_audio(self, note, deck_id, model_id):
+        # fields which get a speak button in the editor
+        field_options = self.get_deck_note_type_field_options(deck_id, model_id)
+        deck_note_type = self.languagetools.deck_utils.build_deck_note_type(deck_id, model_id)
+        voice_selection_settings = self.languagetools.get_voice_selection_settings()
+        for field_index, field_type in enumerate(field_options):
+            if field_type == 'language':
+                dntf = self.languagetools.deck_utils.get_dntf_from_fieldindex(deck_note_type, field_index)
+                voice = voice_selection_settings.get(self.languagetools.get_language(dntf), None)
+                if voice == None:
+                    # no voice selected for this language anymore
+                    continue
+                self.get_audio_prefetcher().prefetch(note[dntf.field_name], voice)
+
+    def compute_field_options(self, deck_note_type):
+        voice_selection_settings = self.languagetools.get_voice_selection_settings()
+        field_options = []
+        for field_name in self.languagetools.deck_utils.get_field_names(deck_note_type):
+            field_type = 'regular'
+            dntf = self.languagetools.deck_utils.build_dntf_from_dnt(deck_note_type, field_name)
+            field_language = self.languagetools.get_language(dntf)
+            if field_language != None:
+                if self.languagetools.get_batch_translation_setting_field(dntf) != None:
+                    # add translation settings
+                    field_type = 'translation'
+                elif field_language == constants.SpecialLanguage.sound.name:
+                    field_type = 'sound'
+                elif field_language in voice_selection_settings: # is there a voice associated with this language ?
+                    field_type = 'language'
+            field_options.append(field_type)
+        return field_options
 
     def process_choosetranslation(self, editor, str):
         try:
@@ -81,12 +197,33 @@ class EditorManager():
         except Exception as e:
             self.languagetools.anki_utils.critical_message(str(e), None)
 
-    def process_all_field_changes(self):
-        logging.info('processing all field changes')
-        for dntf, field_change in self.buffered_field_changes.items():
-            logging.info(f'processing field change on {dntf}')
+    def get_field_change_timer(self, from_deck_note_type_field):
+        timer = self.field_change_timers.get(from_deck_note_type_field, None)
+        if timer == None:
+            timer = FieldDebounceTimer(self.max_field_change_delay_ms)
+            self.field_change_timers[from_deck_note_type_field] = timer
+        return timer
+
+    def get_field_change_delay_ms(self, timer):
+        if timer.typing_interval_ms == None:
+            # nothing known about this field yet
+            return self.max_field_change_delay_ms
+        delay_ms = constants.LIVE_UPDATE_TYPING_INTERVAL_FACTOR * timer.typing_interval_ms
+        if self.service_latency_ms != None:
+            delay_ms += constants.LIVE_UPDATE_SERVICE_LATENCY_FACTOR * self.service_latency_ms
+        return round(min(max(delay_ms, constants.LIVE_UPDATE_MIN_DELAY_MS), self.max_field_change_delay_ms))
+
+    def record_service_latency(self, latency_ms):
+        if self.service_latency_ms == None:
+            self.service_latency_ms = latency_ms
+        else:
+            self.service_latency_ms += constants.LIVE_UPDATE_SMOOTHING * (latency_ms - self.service_latency_ms)
+
+    def process_buffered_field_change(self, from_deck_note_type_field):
+        field_change = self.buffered_field_changes.pop(from_deck_note_type_field, None)
+        if field_change != None:
+            logging.info(f'processing field change on {from_deck_note_type_field}')
             self.process_field_change(field_change)
-        self.buffered_field_changes = {}
 
     def process_field_change(self, field_change):
         deck_note_type = field_change.deck_note_type
@@ -124,7 +261,8 @@ class EditorManager():
                     voice = voice_settings[from_language]
                     self.load_audio(editor, note_id, field_value, to_deck_note_type_field, voice)        
 
-    def process_field_update(self, editor, str):
+    def get_field_change(self, editor, str):
+        # key:<field index>:<note id>:<field value>, same format for blur. returns None when the field is unchanged
         components = str.split(':')
         if len(components) >= 4:
             field_index_str = components[1]
@@ -144,23 +282,58 @@ class EditorManager():
 
             if field_value != original_field_value:
                 # only do something if the field has changed
+                return FieldChange(editor, deck_note_type, from_deck_note_type_field, note_id, field_value)
+        return None
 
-                field_change = FieldChange(editor, deck_note_type, from_deck_note_type_field, note_id, field_value)
-                self.buffered_field_changes[from_deck_note_type_field] = field_change
-                self.languagetools.anki_utils.call_on_timer_expire(self.field_change_timer, self.process_all_field_changes)
+    def process_field_update(self, editor, str):
+        field_change = self.get_field_change(editor, str)
+        if field_change != None:
+            from_deck_note_type_field = field_change.from_deck_note_type_field
+            self.buffered_field_changes[from_deck_note_type_field] = field_change
+            # only this field's timer restarts, pending updates of other fields aren't delayed
+            timer = self.get_field_change_timer(from_deck_note_type_field)
+            timer.record_change(time.time(), self.max_field_change_delay_ms)
+            timer.delay_ms = self.get_field_change_delay_ms(timer)
+            self.languagetools.anki_utils.call_on_timer_expire(timer, lambda: self.process_buffered_field_change(from_deck_note_type_field))
+
+    def process_field_blur(self, editor, str):
+        # the user left the field, don't wait for the timer
+        components = str.split(':')
+        if len(components) < 4:
+            return
+        from_deck_note_type_field = self.languagetools.deck_utils.editor_get_dntf(editor, int(components[1]))
+        field_change = self.get_field_change(editor, str)
+        if field_change != None:
+            self.buffered_field_changes[from_deck_note_type_field] = field_change
+        if from_deck_note_type_field in self.buffered_field_changes:
+            timer = self.field_change_timers.get(from_deck_note_type_field, None)
+            if timer != None:
+                self.languagetools.anki_utils.stop_timer(timer)
+            self.process_buffered_field_change(from_deck_note_type_field)
 
 
     # generic function to load a transformation asynchronously (translation / transliteration / audio)
     def load_transformation(self, editor, original_note_id, field_value: str, to_deck_note_type_field: deck_utils.DeckNoteTypeField, request_transformation_fn, interpret_response_fn):
         field_index = self.languagetools.deck_utils.get_field_id(to_deck_note_type_field)
 
+        # an older request for this field would overwrite the result
+        previous_cancellation_token = self.transformation_cancellation_tokens.get(to_deck_note_type_field, None)
+        if previous_cancellation_token != None:
+            previous_cancellation_token.cancel()
+        cancellation_token = task_scheduler.CancellationToken()
+        self.transformation_cancellation_tokens[to_deck_note_type_field] = cancellation_token
+
         # is the source field empty ?
         if self.languagetools.text_utils.is_empty(field_value):
+            # a cancelled request doesn't call back, it won't hide the loading indicator
+            self.languagetools.anki_utils.hide_loading_indicator(editor, field_index, field_value)
             self.languagetools.anki_utils.editor_set_field_value(editor, field_index, '')
             return
 
         def get_apply_transformation_lambda(languagetools, editor, field_index, original_note_id, original_field_value, interpret_response_fn):
+            request_time = time.time()
             def apply_transformation(future_result):
+                self.record_service_latency((time.time() - request_time) * 1000.0)
                 if editor.note == None:
                     # user has left the editor
                     return
@@ -181,7 +354,8 @@ class EditorManager():
         self.languagetools.anki_utils.show_loading_indicator(editor, field_index)
 
         self.languagetools.anki_utils.run_in_background(request_transformation_fn, 
-                                        get_apply_transformation_lambda(self.languagetools, editor, field_index, original_note_id, field_value, interpret_response_fn))
+                                        get_apply_transformation_lambda(self.languagetools, editor, field_index, original_note_id, field_value, interpret_response_fn),
+                                        cancellation_token=cancellation_token)
 
 
     def load_translation(self, editor, original_note_id, field_value: str, to_deck_note_type_field: deck_utils.DeckNoteTypeField, translation_option):
@@ -24,9 +24,22 @@ class LanguageToolsRequestError(Exception):
     pass
 
 class AudioLanguageToolsRequestError(LanguageToolsRequestError):
-    pass
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
 
 class VoiceListRequestError(LanguageToolsRequestError):
     pass
 
+# language lists haven't been retrieved yet, see LanguageTools.wait_for_initialization
+class LanguageToolsNotReadyError(Exception):
+    def __init__(self):
+        super().__init__(f'{constants.ADDON_NAME} is still retrieving the list of languages, please try again in a few seconds.')
 
+# audio returned by the service couldn't be parsed, for example when joining chunks of long text
+class AudioFormatError(Exception):
+    pass
+
+# replay transport was asked for a request which isn't in the cassette
+class ReplayCassetteMissError(LanguageToolsRequestError):
+    pass
@@ -17,6 +17,7 @@ from . import dialogs
 from . import deck_utils
 from . import dialog_voiceselection
 from . import dialog_textprocessing
+from . import dialog_performancestats
 
 
 def init(languagetools):
@@ -42,6 +43,9 @@ def init(languagetools):
     def show_api_key_dialog():
         dialogs.show_api_key_dialog(languagetools)
 
+    def show_performance_stats():
+        dialog_performancestats.performance_stats_dialog(languagetools)
+
     def show_change_language(deck_note_type_field: deck_utils.DeckNoteTypeField):
         current_language = languagetools.get_language(deck_note_type_field)
 
@@ -151,7 +155,7 @@ def init(languagetools):
                         menu_text = f'To {languagetools.get_language_name(wanted_language)}'
                         def get_translate_lambda(selected_text, language, wanted_language):
                             def translate():
-                                show_translation(selected_text, language, wanted_language)
+                                languagetools.run_when_ready(show_translation, selected_text, language, wanted_language)
                             return translate
                         submenu.addAction(menu_text, get_translate_lambda(selected_text, language, wanted_language))
                 menu.addMenu(submenu)
@@ -191,7 +195,7 @@ def init(languagetools):
             menu_text = f'Change Language'
             def get_change_language_lambda(deck_note_type_field):
                 def change_language():
-                    show_change_language(deck_note_type_field)
+                    languagetools.run_when_ready(show_change_language, deck_note_type_field)
                 return change_language
             submenu.addAction(menu_text, get_change_language_lambda(deck_note_type_field))
 
@@ -206,35 +210,50 @@ def init(languagetools):
     aqt.mw.form.menuTools.addAction(action)
 
     action = aqt.qt.QAction(f"{constants.MENU_PREFIX} Language Mapping", aqt.mw)
-    action.triggered.connect(show_language_mapping)
+    action.triggered.connect(lambda: languagetools.run_when_ready(show_language_mapping))
     aqt.mw.form.menuTools.addAction(action)
 
     action = aqt.qt.QAction(f"{constants.MENU_PREFIX} Voice Selection", aqt.mw)
-    action.triggered.connect(show_voice_selection)
+    action.triggered.connect(lambda: languagetools.run_when_ready(show_voice_selection))
     aqt.mw.form.menuTools.addAction(action)
 
     action = aqt.qt.QAction(f"{constants.MENU_PREFIX} Text Processing", aqt.mw)
-    action.triggered.connect(show_text_processing)
+    action.triggered.connect(lambda: languagetools.run_when_ready(show_text_processing))
     aqt.mw.form.menuTools.addAction(action)
 
     action = aqt.qt.QAction(f"{constants.MENU_PREFIX} Verify API Key && Account Info", aqt.mw)
-    action.triggered.connect(show_api_key_dialog)
+    action.triggered.connect(lambda: languagetools.run_when_ready(show_api_key_dialog))
     aqt.mw.form.menuTools.addAction(action)    
 
     action = aqt.qt.QAction(f"{constants.MENU_PREFIX} Yomichan Integration", aqt.mw)
-    action.triggered.connect(show_yomichan_integration)
+    action.triggered.connect(lambda: languagetools.run_when_ready(show_yomichan_integration))
     aqt.mw.form.menuTools.addAction(action)        
 
+    action = aqt.qt.QAction(f"{constants.MENU_PREFIX} Performance Stats", aqt.mw)
+    action.triggered.connect(lambda: languagetools.run_when_ready(show_performance_stats))
+    aqt.mw.form.menuTools.addAction(action)
+
     action = aqt.qt.QAction(f"{constants.MENU_PREFIX} About", aqt.mw)
     action.triggered.connect(languagetools.show_about)
     aqt.mw.form.menuTools.addAction(action)
 
     # right click menu
-    aqt.gui_hooks.editor_will_show_context_menu.append(on_context_menu)
+    aqt.gui_hooks.editor_will_show_context_menu.append(lambda web_view, menu: languagetools.run_when_ready(on_context_menu, web_view, menu))
 
     def collectionDidLoad(col: anki.collection.Collection):
+        languagetools.clear_collection_caches()
         languagetools.setCollectionLoaded()
 
+    def operationDidExecute(changes, handler):
+        if changes.card or changes.note:
+            languagetools.populated_set_changed()
+        # cached note type fields and deck / note type names, and the editor field options derived from them
+        if changes.notetype or changes.deck:
+            languagetools.clear_metadata_cache()
+
+    def syncDidFinish():
+        languagetools.clear_collection_caches()
+
     def mainWindowInit():
         languagetools.setMainWindowInit()
     
@@ -245,30 +264,38 @@ def init(languagetools):
     aqt.gui_hooks.collection_did_load.append(collectionDidLoad)
     aqt.gui_hooks.main_window_did_init.append(mainWindowInit)
     aqt.gui_hooks.deck_browser_did_render.append(deckBrowserDidRender)
+    # operation_did_execute appeared in anki 2.1.45
+    if hasattr(aqt.gui_hooks, 'operation_did_execute'):
+        aqt.gui_hooks.operation_did_execute.append(operationDidExecute)
+    aqt.gui_hooks.sync_did_finish.append(syncDidFinish)
 
     def browerMenusInit(browser: aqt.browser.Browser):
         menu = aqt.qt.QMenu(constants.ADDON_NAME, browser.form.menubar)
         browser.form.menubar.addMenu(menu)
 
         action = aqt.qt.QAction(f'Add Translation To Selected Notes...', browser)
-        action.triggered.connect(lambda: dialogs.add_translation_dialog(languagetools, browser, browser.selectedNotes()))
+        action.triggered.connect(lambda: languagetools.run_when_ready(dialogs.add_translation_dialog, languagetools, browser, browser.selectedNotes()))
         menu.addAction(action)
 
         action = aqt.qt.QAction(f'Add Transliteration To Selected Notes...', browser)
-        action.triggered.connect(lambda: dialogs.add_transliteration_dialog(languagetools, browser, browser.selectedNotes()))
+        action.triggered.connect(lambda: languagetools.run_when_ready(dialogs.add_transliteration_dialog, languagetools, browser, browser.selectedNotes()))
         menu.addAction(action)
 
         action = aqt.qt.QAction(f'Add Audio To Selected Notes...', browser)
-        action.triggered.connect(lambda: dialogs.add_audio_dialog(languagetools, browser, browser.selectedNotes()))
+        action.triggered.connect(lambda: languagetools.run_when_ready(dialogs.add_audio_dialog, languagetools, browser, browser.selectedNotes()))
         menu.addAction(action)        
 
         action = aqt.qt.QAction(f'Run Rules for Selected Notes...', browser)
-        action.triggered.connect(lambda: dialogs.run_rules_dialog(languagetools, browser, browser.selectedNotes()))
+        action.triggered.connect(lambda: languagetools.run_when_ready(dialogs.run_rules_dialog, languagetools, browser, browser.selectedNotes()))
         menu.addAction(action)                
 
         action = aqt.qt.QAction(f'Show Rules for Selected Notes...', browser)
-        action.triggered.connect(lambda: dialogs.show_settings_dialog(languagetools, browser, browser.selectedNotes()))
+        action.triggered.connect(lambda: languagetools.run_when_ready(dialogs.show_settings_dialog, languagetools, browser, browser.selectedNotes()))
         menu.addAction(action)                
 
+        action = aqt.qt.QAction('Measure Text Normalization for Selected Notes...', browser)
+        action.triggered.connect(lambda: languagetools.run_when_ready(dialogs.text_normalization_report, languagetools, browser, browser.selectedNotes()))
+        menu.addAction(action)
+
     # browser menus
     aqt.gui_hooks.browser_menus_did_init.append(browerMenusInit)
\ No newline at end of file
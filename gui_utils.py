@@ -1,3 +1,4 @@
+import html
 import PyQt5
 
 def get_header_label(text):
@@ -18,4 +19,13 @@ def get_medium_label(text):
         font.setBold(True)
         font.setPointSize(label_font_size)
         label.setFont(font)
-        return label
\ No newline at end of file
+        return label
+
+def get_skipped_rules_html(text_utils, skipped_counts_before):
+        # text replacement rules which weren't applied during a batch run, see TextReplacement.is_blocked
+        skipped_replacements = text_utils.get_skipped_replacements(skipped_counts_before)
+        if len(skipped_replacements) == 0:
+            return ''
+        rules_str = ', '.join([f'{html.escape(str(replacement.pattern))} ({skipped_count} times)' for replacement, skipped_count in skipped_replacements])
+        return ('<p><b>Text replacement rules not applied</b>, their pattern can be very slow, '
+            f'confirm them in the Text Processing settings: {rules_str}</p>')
@@ -0,0 +1,218 @@
+import sys
+import os
+import re
+import json
+import bisect
+import collections
+
+if hasattr(sys, '_pytest_mode'):
+    import constants
+else:
+    from . import constants
+
+# offline language pre-detection. field samples whose script settles the language (hangul, kana, thai ...),
+# or which are written in one of the latin-script languages covered by the character trigram model
+# with a clear margin, are decided locally. everything else goes to the cloud /detect endpoint.
+
+SCRIPT_LATIN = 'latin'
+SCRIPT_HAN = 'han'
+SCRIPT_KANA = 'kana'
+SCRIPT_HANGUL = 'hangul'
+SCRIPT_OTHER = 'other'
+
+# (first codepoint, last codepoint, script), sorted
+SCRIPT_RANGES = [
+    (0x0041, 0x024F, SCRIPT_LATIN),
+    (0x0370, 0x03FF, 'greek'),
+    (0x0400, 0x052F, 'cyrillic'),
+    (0x0530, 0x058F, 'armenian'),
+    (0x0590, 0x05FF, 'hebrew'),
+    (0x0600, 0x06FF, 'arabic'),
+    (0x0750, 0x077F, 'arabic'),
+    (0x0900, 0x097F, 'devanagari'),
+    (0x0980, 0x09FF, 'bengali'),
+    (0x0A00, 0x0A7F, 'gurmukhi'),
+    (0x0A80, 0x0AFF, 'gujarati'),
+    (0x0B80, 0x0BFF, 'tamil'),
+    (0x0C00, 0x0C7F, 'telugu'),
+    (0x0C80, 0x0CFF, 'kannada'),
+    (0x0D00, 0x0D7F, 'malayalam'),
+    (0x0D80, 0x0DFF, 'sinhala'),
+    (0x0E00, 0x0E7F, 'thai'),
+    (0x0E80, 0x0EFF, 'lao'),
+    (0x1000, 0x109F, 'myanmar'),
+    (0x10A0, 0x10FF, 'georgian'),
+    (0x1100, 0x11FF, SCRIPT_HANGUL),
+    (0x1780, 0x17FF, 'khmer'),
+    (0x1E00, 0x1EFF, SCRIPT_LATIN),
+    (0x1F00, 0x1FFF, 'greek'),
+    (0x3040, 0x30FF, SCRIPT_KANA),
+    (0x3130, 0x318F, SCRIPT_HANGUL),
+    (0x31F0, 0x31FF, SCRIPT_KANA),
+    (0x3400, 0x4DBF, SCRIPT_HAN),
+    (0x4E00, 0x9FFF, SCRIPT_HAN),
+    (0xAC00, 0xD7AF, SCRIPT_HANGUL),
+    (0xF900, 0xFAFF, SCRIPT_HAN),
+    (0xFF66, 0xFF9F, SCRIPT_KANA),
+    (0x20000, 0x2FA1F, SCRIPT_HAN),
+]
+SCRIPT_RANGE_STARTS = [x[0] for x in SCRIPT_RANGES]
+
+# scripts which are only used by one language (in practice, for anki decks)
+SCRIPT_LANGUAGE = {
+    SCRIPT_HANGUL: 'ko',
+    SCRIPT_KANA: 'ja',
+    'thai': 'th',
+    'devanagari': 'hi',
+    'greek': 'el',
+    'hebrew': 'he',
+    'georgian': 'ka',
+    'armenian': 'hy',
+    'khmer': 'km',
+    'lao': 'lo',
+    'myanmar': 'my',
+    'sinhala': 'si',
+    'tamil': 'ta',
+    'telugu': 'te',
+    'kannada': 'kn',
+    'malayalam': 'ml',
+    'gujarati': 'gu',
+    'gurmukhi': 'pa',
+}
+
+WORD_RE = re.compile(r'[^\W\d_]+')
+
+def get_script(char):
+    codepoint = ord(char)
+    index = bisect.bisect_right(SCRIPT_RANGE_STARTS, codepoint) - 1
+    if index >= 0 and codepoint <= SCRIPT_RANGES[index][1]:
+        return SCRIPT_RANGES[index][2]
+    return SCRIPT_OTHER
+
+def get_script_histogram(texts):
+    # letters only, digits / punctuation / whitespace don't say anything about the language
+    histogram = collections.Counter()
+    for text in texts:
+        for char in text:
+            if char.isalpha():
+                histogram[get_script(char)] += 1
+    return histogram
+
+def get_trigrams(texts):
+    trigrams = collections.Counter()
+    for text in texts:
+        for word in WORD_RE.findall(text.lower()):
+            padded = f' {word} '
+            for i in range(len(padded) - 2):
+                trigrams[padded[i:i+3]] += 1
+    return trigrams
+
+
+class LocalDetectionResult():
+    def __init__(self, decided, language, reason):
+        # decided == False means the cloud should be asked
+        self.decided = decided
+        self.language = language
+        self.reason = reason
+
+    def __str__(self):
+        return f'decided: {self.decided} language: {self.language} ({self.reason})'
+
+
+class ContentSketch():
+    # cheap summary of a field sample: share of each script, and the closest trigram profile for latin script text.
+    # used to tell whether a deck's content looks like the pooled content of its note type
+    def __init__(self, script_ratios, trigram_language):
+        self.script_ratios = script_ratios
+        self.trigram_language = trigram_language
+
+    def matches(self, other):
+        # trigram languages are only compared when both samples were large enough to get one
+        if self.trigram_language != None and other.trigram_language != None and self.trigram_language != other.trigram_language:
+            return False
+        scripts = set(self.script_ratios.keys()) | set(other.script_ratios.keys())
+        distance = sum([abs(self.script_ratios.get(script, 0.0) - other.script_ratios.get(script, 0.0)) for script in scripts]) / 2.0
+        return distance <= constants.LANGUAGE_DETECTION_SKETCH_MAX_DISTANCE
+
+    def __str__(self):
+        script_ratios = ', '.join([f'{script}: {ratio:.2f}' for script, ratio in self.script_ratios.items()])
+        return f'scripts: {script_ratios} trigram language: {self.trigram_language}'
+
+
+class LocalLanguageDetector():
+    def __init__(self, ngram_model_path=None):
+        if ngram_model_path == None:
+            ngram_model_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), constants.LANGUAGE_DETECTION_NGRAM_MODEL_FILENAME)
+        with open(ngram_model_path, 'r', encoding='utf-8') as f:
+            # language -> trigram -> log probability
+            self.ngram_model = json.load(f)
+        # log probability used for trigrams which aren't in a language's profile
+        self.unseen_logprob = {language: min(profile.values()) - 1.0 for language, profile in self.ngram_model.items()}
+
+    def score_trigrams(self, trigrams):
+        # average log probability per trigram, for each language
+        total = sum(trigrams.values())
+        scores = {}
+        for language, profile in self.ngram_model.items():
+            unseen_logprob = self.unseen_logprob[language]
+            score = 0.0
+            for trigram, count in trigrams.items():
+                score += count * profile.get(trigram, unseen_logprob)
+            scores[language] = score / total
+        return scores
+
+    def detect_latin(self, texts):
+        trigrams = get_trigrams(texts)
+        trigram_count = sum(trigrams.values())
+        if trigram_count < constants.LANGUAGE_DETECTION_MIN_TRIGRAMS:
+            return LocalDetectionResult(False, None, f'only {trigram_count} trigrams')
+        scores = sorted(self.score_trigrams(trigrams).items(), key=lambda x: x[1], reverse=True)
+        best_language, best_score = scores[0]
+        second_score = scores[1][1]
+        if best_score < constants.LANGUAGE_DETECTION_MIN_SCORE:
+            # most likely a language the model doesn't know about
+            return LocalDetectionResult(False, None, f'low trigram score {best_score:.2f} for {best_language}')
+        if best_score - second_score < constants.LANGUAGE_DETECTION_MIN_MARGIN:
+            return LocalDetectionResult(False, None, f'ambiguous trigram scores {best_language}: {best_score:.2f} {scores[1][0]}: {second_score:.2f}')
+        return LocalDetectionResult(True, best_language, f'trigram score {best_score:.2f}, margin {best_score - second_score:.2f}')
+
+    def get_sketch(self, texts):
+        histogram = get_script_histogram(texts)
+        letter_count = sum(histogram.values())
+        script_ratios = {script: count / letter_count for script, count in histogram.items()}
+        trigram_language = None
+        if script_ratios.get(SCRIPT_LATIN, 0.0) >= constants.LANGUAGE_DETECTION_DOMINANT_SCRIPT_RATIO:
+            trigrams = get_trigrams(texts)
+            if sum(trigrams.values()) >= constants.LANGUAGE_DETECTION_SKETCH_MIN_TRIGRAMS:
+                scores = sorted(self.score_trigrams(trigrams).items(), key=lambda x: x[1], reverse=True)
+                # only when the best profile stands out, otherwise two samples of the same language could disagree
+                if scores[0][1] - scores[1][1] >= constants.LANGUAGE_DETECTION_MIN_MARGIN:
+                    trigram_language = scores[0][0]
+        return ContentSketch(script_ratios, trigram_language)
+
+    def detect(self, texts, available_languages):
+        histogram = get_script_histogram(texts)
+        letter_count = sum(histogram.values())
+        if letter_count == 0:
+            # only numbers, punctuation, symbols
+            return LocalDetectionResult(True, None, 'no letters')
+
+        result = None
+        if histogram[SCRIPT_KANA] >= constants.LANGUAGE_DETECTION_KANA_MIN_RATIO * letter_count and \
+            histogram[SCRIPT_KANA] + histogram[SCRIPT_HAN] >= constants.LANGUAGE_DETECTION_DOMINANT_SCRIPT_RATIO * letter_count:
+            # chinese never contains kana
+            result = LocalDetectionResult(True, SCRIPT_LANGUAGE[SCRIPT_KANA], 'kana')
+        else:
+            script, script_count = histogram.most_common(1)[0]
+            if script_count < constants.LANGUAGE_DETECTION_DOMINANT_SCRIPT_RATIO * letter_count:
+                result = LocalDetectionResult(False, None, 'mixed scripts')
+            elif script in SCRIPT_LANGUAGE:
+                result = LocalDetectionResult(True, SCRIPT_LANGUAGE[script], script)
+            elif script == SCRIPT_LATIN:
+                result = self.detect_latin(texts)
+            else:
+                result = LocalDetectionResult(False, None, f'{script} script')
+
+        if result.language != None and result.language not in available_languages:
+            return LocalDetectionResult(False, None, f'{result.language} not available')
+        return result
@@ -2,22 +2,23 @@
 import sys
 import os
 import glob
-import re
 import random
+import math
 import requests
 import json
 import tempfile
 import logging
 from typing import List, Dict
 import hashlib
+import time
+import threading
+import concurrent.futures
 import anki.utils
 
 # anki imports
 import aqt
 import aqt.progress
 import aqt.addcards
-import anki.notes
-import anki.cards
 
 if hasattr(sys, '_pytest_mode'):
     import constants
@@ -25,22 +26,45 @@ if hasattr(sys, '_pytest_mode'):
     import errors
     import deck_utils
     import text_utils
+    import perf_stats
+    import language_detection
+    import audio_utils
+    import audio_prefetch
 else:
     from . import constants
     from . import version
     from . import errors
     from . import deck_utils
     from . import text_utils
+    from . import perf_stats
+    from . import language_detection
+    from . import audio_utils
+    from . import audio_prefetch
 
 
 class LanguageTools():
 
-    def __init__(self, anki_utils, deck_utils, cloud_language_tools):
+    def __init__(self, anki_utils, deck_utils, cloud_language_tools, performance_stats=None):
         self.anki_utils = anki_utils
         self.deck_utils = deck_utils
         self.cloud_language_tools = cloud_language_tools
+        self.performance_stats = performance_stats
+        if self.performance_stats == None:
+            self.performance_stats = perf_stats.PerformanceStats()
         self.config = self.anki_utils.get_config()
-        self.text_utils = text_utils.TextUtils(self.get_text_processing_settings())
+        # incremented every time the config is written, lets callers invalidate anything derived from the config
+        self.config_version = 0
+        # incremented every time the cached note type / deck metadata is cleared, same idea as config_version
+        self.metadata_version = 0
+        self.html_to_text_cache = text_utils.HtmlToTextCache(constants.HTML_TO_TEXT_CACHE_SIZE, self.performance_stats)
+        self.text_utils = text_utils.TextUtils(self.get_text_processing_settings(), self.html_to_text_cache)
+        self.local_language_detector = language_detection.LocalLanguageDetector()
+        self.language_detection_cache = None
+        self.language_detection_cache_dirty = False
+        self.voice_list = None
+        self.voice_list_time = None
+        # shared by the editor and the voice selection dialog, created on first use
+        self.audio_prefetcher = None
 
         self.collectionLoaded = False
         self.mainWindowInitialized = False
@@ -48,6 +72,14 @@ class LanguageTools():
         self.initDone = False
 
         self.api_key_checked = False
+        # (deck_id, model_id) pairs which have notes, see get_populated_deckid_modelid_pairs
+        self.populated_deckid_modelid_pairs = None
+        self.populated_refresh_time = None
+        self.populated_dirty = False
+        # resolved once the language lists have been retrieved
+        self.initialization_future = concurrent.futures.Future()
+        # initialization can be started from the main thread at startup and retried from any thread
+        self.initialization_lock = threading.Lock()
 
     def setCollectionLoaded(self):
         self.collectionLoaded = True
@@ -62,32 +94,135 @@ class LanguageTools():
         self.checkInitialize()
 
     def checkInitialize(self):
-        if self.collectionLoaded and self.mainWindowInitialized and self.deckBrowserRendered and self.initDone == False:
-            aqt.mw.taskman.run_in_background(self.initialize, self.initializeDone)
+        if self.collectionLoaded and self.mainWindowInitialized and self.deckBrowserRendered:
+            self.start_initialization()
+
+    def start_initialization(self):
+        # at most one initialization in progress
+        with self.initialization_lock:
+            if self.initDone:
+                return
+            self.initDone = True
+        self.anki_utils.run_in_background(self.initialize, self.initializeDone)
 
     def initialize(self):
         self.initDone = True
 
-        # get language lists
-        self.language_list = self.cloud_language_tools.get_language_list()
-        self.translation_language_list = self.cloud_language_tools.get_translation_language_list()
-        self.transliteration_language_list = self.cloud_language_tools.get_transliteration_language_list()
+        try:
+            start_time = time.time()
+            api_key = self.config['api_key']
+
+            # the language lists and the api key validation don't depend on each other, retrieve them in parallel
+            with concurrent.futures.ThreadPoolExecutor(max_workers=constants.INITIALIZATION_MAX_WORKERS) as executor:
+                language_list_future = executor.submit(self.timed_initialization_step, 'language_list', self.cloud_language_tools.get_language_list)
+                translation_language_list_future = executor.submit(self.timed_initialization_step, 'translation_language_list', self.cloud_language_tools.get_translation_language_list)
+                transliteration_language_list_future = executor.submit(self.timed_initialization_step, 'transliteration_language_list', self.cloud_language_tools.get_transliteration_language_list)
+                # do we have an API key in the config ?
+                api_key_valid_future = None
+                if len(api_key) > 0:
+                    api_key_valid_future = executor.submit(self.timed_initialization_step, 'api_key_validation', self.validate_api_key_cached, api_key)
+
+                self.language_list = language_list_future.result()
+                self.translation_language_list = translation_language_list_future.result()
+                self.transliteration_language_list = transliteration_language_list_future.result()
+                if api_key_valid_future != None and api_key_valid_future.result() == True:
+                    self.api_key_checked = True
+
+            logging.info(f'initialization done, critical path: {time.time() - start_time:.3f}s')
+            self.initialization_future.set_result(True)
+        except Exception as e:
+            logging.exception('could not initialize')
+            self.initialization_future.set_exception(e)
+            raise
+
+    def timed_initialization_step(self, name, step_fn, *args):
+        start_time = time.time()
+        result = step_fn(*args)
+        logging.info(f'initialization step {name}: {time.time() - start_time:.3f}s')
+        return result
+
+    def wait_for_initialization(self):
+        # language lists are retrieved in the background at startup. the network requests never run on the main
+        # thread, and the main thread doesn't wait for them: until they're available, callers get an error
+        with self.initialization_lock:
+            initialization_future = self.initialization_future
+            if initialization_future.done() and initialization_future.exception() == None:
+                return
+            if initialization_future.done():
+                # previous attempt failed (network down at startup for example), retry
+                logging.warning('previous initialization failed, retrying')
+                self.initialization_future = concurrent.futures.Future()
+                self.initDone = False
+        self.start_initialization()
+        timeout = constants.INITIALIZATION_TIMEOUT_SECONDS
+        if threading.current_thread() is threading.main_thread():
+            # background initialization may have completed right away
+            timeout = 0
+        try:
+            self.initialization_future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            raise errors.LanguageToolsNotReadyError()
+
+    def run_when_ready(self, fn, *args):
+        # for UI entry points (menu actions, context menu, dialogs opened from the browser), which run while the
+        # language lists may still be loading at startup: tell the user rather than raising out of a Qt callback
+        try:
+            return fn(*args)
+        except errors.LanguageToolsNotReadyError as e:
+            self.anki_utils.tooltip_message(str(e))
+
+    def get_api_key_validation_cache_filename(self):
+        return os.path.join(self.get_user_files_dir(), constants.API_KEY_VALIDATION_CACHE_FILENAME)
+
+    def get_api_key_hash(self, api_key):
+        # don't store the api key itself in the cache
+        return hashlib.sha224(api_key.encode('utf-8')).hexdigest()
+
+    def validate_api_key_cached(self, api_key):
+        # a successful validation is remembered for a while, so that we don't hit the server on every startup.
+        # only the startup check uses this, the api key dialog always verifies with the server.
+        cache_filename = self.get_api_key_validation_cache_filename()
+        api_key_hash = self.get_api_key_hash(api_key)
+        cache = {}
+        try:
+            if os.path.isfile(cache_filename):
+                with open(cache_filename, 'r') as f:
+                    cache = json.load(f)
+        except Exception as e:
+            logging.warning(f'could not read api key validation cache: {e}')
+            cache = {}
+
+        validated_time = cache.get(api_key_hash, None)
+        if validated_time != None and time.time() - validated_time < constants.API_KEY_VALIDATION_TTL_SECONDS:
+            logging.info('api key validation: using cached result')
+            return True
 
-        # do we have an API key in the config ?
-        if len(self.config['api_key']) > 0:
-            validation_result = self.cloud_language_tools.api_key_validate_query(self.config['api_key'])
-            if validation_result['key_valid'] == True:
-                self.api_key_checked = True
+        validation_result = self.cloud_language_tools.api_key_validate_query(api_key)
+        if validation_result['key_valid'] != True:
+            return False
+
+        # only keep the current api key
+        cache = {api_key_hash: time.time()}
+        try:
+            with open(cache_filename, 'w') as f:
+                json.dump(cache, f)
+        except Exception as e:
+            logging.warning(f'could not write api key validation cache: {e}')
+        return True
 
     def initializeDone(self, future):
         pass
 
+    def write_config(self):
+        self.config_version += 1
+        self.anki_utils.write_config(self.config)
+
     def get_config_api_key(self):
         return self.config['api_key']
 
     def set_config_api_key(self, api_key):
         self.config['api_key'] = api_key
-        self.anki_utils.write_config(self.config)
+        self.write_config()
         self.api_key_checked = True
 
     def verify_api_key(self, api_key):
@@ -121,6 +256,7 @@ class LanguageTools():
             return 'Transliteration'
         if language == constants.SpecialLanguage.sound.name:
             return 'Sound'
+        self.wait_for_initialization()
         return self.language_list[language]
 
     def language_available_for_translation(self, language):
@@ -133,6 +269,7 @@ class LanguageTools():
         return True
 
     def get_all_languages(self):
+        self.wait_for_initialization()
         return self.language_list
 
     def get_all_language_arrays(self):
@@ -172,8 +309,45 @@ class LanguageTools():
                 'language_code_list': language_code_list
         }        
 
+    def get_populated_deckid_modelid_pairs(self):
+        # the full query is a group by over all cards, only run it once, then refresh incrementally
+        if self.populated_deckid_modelid_pairs == None:
+            refresh_time = int(time.time())
+            self.populated_deckid_modelid_pairs = [tuple(entry) for entry in self.anki_utils.get_deckid_modelid_pairs()]
+            self.populated_refresh_time = refresh_time
+            self.populated_dirty = False
+        elif self.populated_dirty:
+            refresh_time = int(time.time())
+            self.populated_dirty = False
+            # pairs which are still populated, plus pairs for any cards / notes added or moved since the last refresh
+            pairs = [entry for entry in self.populated_deckid_modelid_pairs if self.anki_utils.deckid_modelid_pair_exists(entry[0], entry[1])]
+            for entry in self.anki_utils.get_deckid_modelid_pairs_modified_since(self.populated_refresh_time):
+                entry = tuple(entry)
+                if entry not in pairs:
+                    pairs.append(entry)
+            self.populated_deckid_modelid_pairs = pairs
+            self.populated_refresh_time = refresh_time
+        return self.populated_deckid_modelid_pairs
+
+    def populated_set_changed(self):
+        # cards / notes were added, moved or deleted
+        self.populated_dirty = True
+
+    def clear_populated_set(self):
+        self.populated_deckid_modelid_pairs = None
+
+    def clear_metadata_cache(self):
+        # note types / decks were modified or renamed
+        self.deck_utils.clear_metadata_cache()
+        self.metadata_version += 1
+
+    def clear_collection_caches(self):
+        # the collection got loaded (profile switch) or synced, nothing derived from the previous state can be trusted
+        self.clear_populated_set()
+        self.clear_metadata_cache()
+
     def get_populated_dntf(self) -> List[deck_utils.DeckNoteTypeField]:
-        populated_set = self.anki_utils.get_deckid_modelid_pairs()
+        populated_set = self.get_populated_deckid_modelid_pairs()
         
         result: List[deck_utils.DeckNoteTypeField] = []
 
@@ -181,10 +355,7 @@ class LanguageTools():
             deck_id = entry[0]
             model_id = entry[1]
             deck_note_type = self.deck_utils.build_deck_note_type(deck_id, model_id)
-            model = self.anki_utils.get_model(model_id)
-            fields = model['flds']
-            for field in fields:
-                field_name = field['name']
+            for field_name in self.deck_utils.get_field_names(deck_note_type):
                 deck_note_type_field = self.deck_utils.build_dntf_from_dnt(deck_note_type, field_name)
                 result.append(deck_note_type_field)
 
@@ -209,16 +380,13 @@ class LanguageTools():
     def get_field_samples(self, deck_note_type_field: deck_utils.DeckNoteTypeField, sample_size: int) -> List[str]:
         note_ids = self.get_noteids_for_deck_note_type(deck_note_type_field.deck_note_type, sample_size)
 
-        stripImagesRe = re.compile("(?i)<img[^>]+src=[\"']?([^\"'>]+)[\"']?[^>]*>")
-        
         def process_field_value(note_id, field_name):
             note = self.anki_utils.get_note_by_id(note_id)
             if field_name not in note:
                 # field was removed
                 raise errors.AnkiItemNotFoundError(f'field {field_name} not found')
             original_field_value = note[field_name]
-            field_value = stripImagesRe.sub('', original_field_value)
-            field_value = anki.utils.htmlToTextLine(field_value)
+            field_value = self.html_to_text_cache.html_to_text_without_images(original_field_value)
             max_len = 200 # restrict to 200 characters
             if len(original_field_value) > max_len:
                 field_value = original_field_value[:max_len]
@@ -234,6 +402,27 @@ class LanguageTools():
 
         return field_sample
 
+    def get_text_processing_profile_samples(self, sample_size_per_field, max_field_count):
+        # field samples used to profile text replacement rules. only fields with a language mapped get processed,
+        # and at most max_field_count of them get sampled, each sample is a query on the collection.
+        dntf_list = []
+        for model_name, model_data in self.config.get(constants.CONFIG_DECK_LANGUAGES, {}).items():
+            for deck_name, deck_data in model_data.items():
+                for field_name in deck_data.keys():
+                    dntf_list.append((deck_name, model_name, field_name))
+        if len(dntf_list) > max_field_count:
+            dntf_list = random.sample(dntf_list, max_field_count)
+
+        samples = []
+        for deck_name, model_name, field_name in dntf_list:
+            try:
+                deck_note_type_field = self.deck_utils.build_deck_note_type_field_from_names(deck_name, model_name, field_name)
+                samples.extend(self.get_field_samples(deck_note_type_field, sample_size_per_field))
+            except errors.AnkiItemNotFoundError:
+                # deck, note type or field deleted since the mapping was stored
+                pass
+        return samples
+
     def get_field_samples_for_language(self, language_code, sample_size):
         # self.config[constants.CONFIG_DECK_LANGUAGES][model_name][deck_name][field_name] = language
 
@@ -269,14 +458,157 @@ class LanguageTools():
 
 
     def perform_language_detection_deck_note_type_field(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
+        language, detection_method = self.detect_field_language(deck_note_type_field)
+        return language
+
+    def detect_field_language(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
+        # returns (language, constants.LanguageDetectionMethod)
+        signature = self.get_language_detection_signature(deck_note_type_field)
+        cache_entry = self.get_language_detection_cache_entry(deck_note_type_field, signature)
+        if cache_entry != None:
+            self.performance_stats.increment('language_detection.cached')
+            return cache_entry['language'], constants.LanguageDetectionMethod.cached
+        return self.detect_field_language_uncached(deck_note_type_field, signature)
+
+    def detect_field_language_uncached(self, deck_note_type_field: deck_utils.DeckNoteTypeField, signature):
         # get a random sample of data within this field
-
         sample_size = 100 # max supported by azure
         field_sample = self.get_field_samples(deck_note_type_field, sample_size)
         if len(field_sample) == 0:
-            return None
+            language = None
+            detection_method = constants.LanguageDetectionMethod.local
+        else:
+            language, detection_method = self.detect_field_sample_language(deck_note_type_field, field_sample)
+            if language == None and detection_method == constants.LanguageDetectionMethod.cloud:
+                # could be a transient error, ask again next time
+                return language, detection_method
+
+        self.store_language_detection_cache_entry(deck_note_type_field, signature, language)
+        return language, detection_method
+
+    def detect_field_languages(self, dntf_list: List[deck_utils.DeckNoteTypeField]):
+        # yields (deck_note_type_field, language, constants.LanguageDetectionMethod)
+        # decks sharing a note type get detected together, so that the cost scales with the number of note types
+        groups = {}
+        for dntf in dntf_list:
+            groups.setdefault((dntf.deck_note_type.model_id, dntf.field_name), []).append(dntf)
+        # (deck_id, model_id) -> signature, the fields of a deck / note type share it
+        signatures = {}
+        for group in groups.values():
+            yield from self.detect_field_language_group(group, signatures)
+
+    def detect_field_language_group(self, dntf_list: List[deck_utils.DeckNoteTypeField], signatures):
+        uncached = []
+        for dntf in dntf_list:
+            signature = self.get_language_detection_signature(dntf, signatures)
+            cache_entry = self.get_language_detection_cache_entry(dntf, signature)
+            if cache_entry != None:
+                self.performance_stats.increment('language_detection.cached')
+                yield dntf, cache_entry['language'], constants.LanguageDetectionMethod.cached
+            else:
+                uncached.append((dntf, signature))
+
+        if len(uncached) < 2:
+            for dntf, signature in uncached:
+                yield (dntf, *self.detect_field_language_uncached(dntf, signature))
+            return
+
+        # each deck contributes to the pooled sample, and its own samples are used for the content sketch
+        sample_size = 100 # max supported by azure
+        deck_sample_size = max(constants.LANGUAGE_DETECTION_SKETCH_SAMPLE_SIZE, math.ceil(sample_size / len(uncached)))
+        deck_samples = [(dntf, signature, self.get_field_samples(dntf, deck_sample_size)) for dntf, signature in uncached]
+        pooled_sample = [sample for dntf, signature, field_sample in deck_samples for sample in field_sample]
+        if len(pooled_sample) > sample_size:
+            pooled_sample = random.sample(pooled_sample, sample_size)
+
+        if len(pooled_sample) == 0:
+            pooled_language, pooled_method = None, constants.LanguageDetectionMethod.local
+        else:
+            pooled_language, pooled_method = self.detect_field_sample_language(dntf_list[0], pooled_sample)
+        pooled_sketch = self.local_language_detector.get_sketch(pooled_sample)
+
+        for dntf, signature, field_sample in deck_samples:
+            if pooled_language == None and pooled_method == constants.LanguageDetectionMethod.cloud:
+                # cloud request failed, nothing to share
+                yield (dntf, *self.detect_field_language_uncached(dntf, signature))
+                continue
+            sketch = self.local_language_detector.get_sketch(field_sample)
+            if not sketch.matches(pooled_sketch):
+                logging.debug(f'{dntf} content ({sketch}) differs from the pooled content ({pooled_sketch})')
+                yield (dntf, *self.detect_field_language_uncached(dntf, signature))
+                continue
+            self.store_language_detection_cache_entry(dntf, signature, pooled_language)
+            # the first deck accounts for the pooled detection
+            detection_method = pooled_method
+            pooled_method = constants.LanguageDetectionMethod.shared
+            if detection_method == constants.LanguageDetectionMethod.shared:
+                self.performance_stats.increment('language_detection.shared')
+            yield dntf, pooled_language, detection_method
+
+    def detect_field_sample_language(self, deck_note_type_field: deck_utils.DeckNoteTypeField, field_sample):
+        # clear cut cases (script, or a well known latin script language) don't need a request
+        local_result = self.local_language_detector.detect(field_sample, self.get_all_languages())
+        logging.debug(f'local language detection for {deck_note_type_field}: {local_result}')
+        if local_result.decided:
+            self.performance_stats.increment('language_detection.local')
+            return local_result.language, constants.LanguageDetectionMethod.local
+
+        self.performance_stats.increment('language_detection.cloud')
+        return self.cloud_language_tools.language_detection(self.config['api_key'], field_sample), constants.LanguageDetectionMethod.cloud
+
+    def get_language_detection_cache_filename(self):
+        return os.path.join(self.get_user_files_dir(), constants.LANGUAGE_DETECTION_CACHE_FILENAME)
+
+    def get_language_detection_cache_key(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
+        deck_note_type = deck_note_type_field.deck_note_type
+        return f'{deck_note_type.deck_id}:{deck_note_type.model_id}:{deck_note_type_field.field_name}'
+
+    def get_language_detection_signature(self, deck_note_type_field: deck_utils.DeckNoteTypeField, signatures=None):
+        # samples are random, so the fingerprint covers all the notes of the deck / note type instead
+        deck_note_type = deck_note_type_field.deck_note_type
+        key = (deck_note_type.deck_id, deck_note_type.model_id)
+        if signatures != None and key in signatures:
+            return signatures[key]
+        signature = list(self.anki_utils.get_deck_note_type_signature(*key))
+        if signatures != None:
+            signatures[key] = signature
+        return signature
+
+    def get_language_detection_cache_entry(self, deck_note_type_field: deck_utils.DeckNoteTypeField, signature):
+        cache_entry = self.get_language_detection_cache().get(self.get_language_detection_cache_key(deck_note_type_field), None)
+        if cache_entry != None and cache_entry['signature'] == signature:
+            return cache_entry
+        return None
+
+    def store_language_detection_cache_entry(self, deck_note_type_field: deck_utils.DeckNoteTypeField, signature, language):
+        self.get_language_detection_cache()[self.get_language_detection_cache_key(deck_note_type_field)] = {
+            'signature': signature,
+            'language': language
+        }
+        self.language_detection_cache_dirty = True
 
-        return self.cloud_language_tools.language_detection(self.config['api_key'], field_sample)
+    def get_language_detection_cache(self):
+        # field key -> {signature, language}, loaded on first use
+        if self.language_detection_cache == None:
+            cache_filename = self.get_language_detection_cache_filename()
+            self.language_detection_cache = {}
+            try:
+                if os.path.isfile(cache_filename):
+                    with open(cache_filename, 'r') as f:
+                        self.language_detection_cache = json.load(f)
+            except Exception as e:
+                logging.warning(f'could not read language detection cache: {e}')
+        return self.language_detection_cache
+
+    def save_language_detection_cache(self):
+        if self.language_detection_cache == None or self.language_detection_cache_dirty == False:
+            return
+        try:
+            with open(self.get_language_detection_cache_filename(), 'w') as f:
+                json.dump(self.language_detection_cache, f)
+            self.language_detection_cache_dirty = False
+        except Exception as e:
+            logging.warning(f'could not write language detection cache: {e}')
 
 
     def guess_language(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
@@ -304,7 +636,7 @@ class LanguageTools():
                 self.config[constants.CONFIG_WANTED_LANGUAGES] = {}
             self.config[constants.CONFIG_WANTED_LANGUAGES][language] = True
 
-        self.anki_utils.write_config(self.config)
+        self.write_config()
 
     def store_batch_translation_setting(self, deck_note_type_field: deck_utils.DeckNoteTypeField, source_field: str, translation_option):
         model_name = deck_note_type_field.get_model_name()
@@ -321,14 +653,14 @@ class LanguageTools():
             'from_field': source_field,
             'translation_option': translation_option
         }
-        self.anki_utils.write_config(self.config)
+        self.write_config()
 
     def remove_translation_setting(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
         model_name = deck_note_type_field.get_model_name()
         deck_name = deck_note_type_field.get_deck_name()
         field_name = deck_note_type_field.field_name        
         del self.config[constants.CONFIG_BATCH_TRANSLATION][model_name][deck_name][field_name]
-        aqt.mw.addonManager.writeConfig(__name__, self.config)
+        self.write_config()
 
     def store_batch_transliteration_setting(self, deck_note_type_field: deck_utils.DeckNoteTypeField, source_field: str, transliteration_option):
         model_name = deck_note_type_field.get_model_name()
@@ -345,7 +677,7 @@ class LanguageTools():
             'from_field': source_field,
             'transliteration_option': transliteration_option
         }
-        self.anki_utils.write_config(self.config)
+        self.write_config()
 
         # the language for the target field should be set to transliteration
         self.store_language_detection_result(deck_note_type_field, constants.SpecialLanguage.transliteration.name)
@@ -355,7 +687,7 @@ class LanguageTools():
         deck_name = deck_note_type_field.get_deck_name()
         field_name = deck_note_type_field.field_name        
         del self.config[constants.CONFIG_BATCH_TRANSLITERATION][model_name][deck_name][field_name]
-        aqt.mw.addonManager.writeConfig(__name__, self.config)
+        self.write_config()
 
     def get_batch_translation_settings(self, deck_note_type: deck_utils.DeckNoteType):
         model_name = deck_note_type.model_name
@@ -384,7 +716,7 @@ class LanguageTools():
         if deck_name not in self.config[constants.CONFIG_BATCH_AUDIO][model_name]:
             self.config[constants.CONFIG_BATCH_AUDIO][model_name][deck_name] = {}
         self.config[constants.CONFIG_BATCH_AUDIO][model_name][deck_name][field_name] = source_field
-        aqt.mw.addonManager.writeConfig(__name__, self.config)
+        self.write_config()
 
         # the language for the target field should be set to sound
         self.store_language_detection_result(deck_note_type_field, constants.SpecialLanguage.sound.name)
@@ -394,7 +726,7 @@ class LanguageTools():
         deck_name = deck_note_type_field.get_deck_name()
         field_name = deck_note_type_field.field_name        
         del self.config[constants.CONFIG_BATCH_AUDIO][model_name][deck_name][field_name]
-        aqt.mw.addonManager.writeConfig(__name__, self.config)
+        self.write_config()
 
     def get_batch_audio_settings(self, deck_note_type: deck_utils.DeckNoteType):
         model_name = deck_note_type.model_name
@@ -409,12 +741,12 @@ class LanguageTools():
 
     def store_text_processing_settings(self, settings):
         self.config[constants.CONFIG_TEXT_PROCESSING] = settings
-        self.anki_utils.write_config(self.config)
-        self.text_utils = text_utils.TextUtils(settings)
+        self.write_config()
+        self.text_utils = text_utils.TextUtils(settings, self.html_to_text_cache)
 
     def store_voice_selection(self, language_code, voice_mapping):
         self.config[constants.CONFIG_VOICE_SELECTION][language_code] = voice_mapping
-        self.anki_utils.write_config(self.config)
+        self.write_config()
 
     def get_voice_selection_settings(self):
         return self.config.get(constants.CONFIG_VOICE_SELECTION, {})
@@ -424,7 +756,22 @@ class LanguageTools():
 
     def set_apply_updates_automatically(self, value):
         self.config[constants.CONFIG_APPLY_UPDATES_AUTOMATICALLY] = value
-        aqt.mw.addonManager.writeConfig(__name__, self.config)
+        self.write_config()
+
+    def get_audio_prefetch_enabled(self):
+        return self.config.get(constants.CONFIG_AUDIO_PREFETCH, False)
+
+    def set_audio_prefetch_enabled(self, value):
+        self.config[constants.CONFIG_AUDIO_PREFETCH] = value
+        self.write_config()
+
+    def get_audio_prefetch_next_notes(self):
+        return self.config.get(constants.CONFIG_AUDIO_PREFETCH_NEXT_NOTES, constants.AUDIO_PREFETCH_NEXT_NOTES_DEFAULT)
+
+    def get_audio_prefetcher(self):
+        if self.audio_prefetcher == None:
+            self.audio_prefetcher = audio_prefetch.AudioPrefetcher(self)
+        return self.audio_prefetcher
 
     def get_language(self, deck_note_type_field: deck_utils.DeckNoteTypeField):
         """will return None if no language is associated with this field"""
@@ -436,9 +783,12 @@ class LanguageTools():
     def get_wanted_languages(self):
         return self.config[constants.CONFIG_WANTED_LANGUAGES].keys()
 
-    def get_translation_async(self, source_text, translation_option):
-        processed_text = self.text_utils.process(source_text, constants.TransformationType.Translation)
-        logging.info(f'before text processing: [{source_text}], after text processing: [{processed_text}]')
+    def get_translation_async(self, source_text, translation_option, processed_text=None):
+        # processed_text: when the caller already ran text processing (batch operations, with process_many)
+        if processed_text == None:
+            with self.performance_stats.timer('text_processing'):
+                processed_text = self.text_utils.process(source_text, constants.TransformationType.Translation)
+            logging.info(f'before text processing: [{source_text}], after text processing: [{processed_text}]')
         return self.cloud_language_tools.get_translation(self.config['api_key'], processed_text, translation_option)
 
     def interpret_translation_response_async(self, response):
@@ -456,15 +806,17 @@ class LanguageTools():
         error_text = f"Could not load translation: {response.text}"
         raise errors.LanguageToolsRequestError(error_text)
 
-    def get_translation(self, source_text, translation_option):
-        return self.interpret_translation_response_async(self.get_translation_async(source_text, translation_option))
+    def get_translation(self, source_text, translation_option, processed_text=None):
+        return self.interpret_translation_response_async(self.get_translation_async(source_text, translation_option, processed_text=processed_text))
 
     def get_translation_all(self, source_text, from_language, to_language):
         return self.cloud_language_tools.get_translation_all(self.config['api_key'], source_text, from_language, to_language)
     
-    def get_transliteration_async(self, source_text, transliteration_option):
-        processed_text = self.text_utils.process(source_text, constants.TransformationType.Transliteration)
-        logging.info(f'before text processing: [{source_text}], after text processing: [{processed_text}]')
+    def get_transliteration_async(self, source_text, transliteration_option, processed_text=None):
+        if processed_text == None:
+            with self.performance_stats.timer('text_processing'):
+                processed_text = self.text_utils.process(source_text, constants.TransformationType.Transliteration)
+            logging.info(f'before text processing: [{source_text}], after text processing: [{processed_text}]')
         return self.cloud_language_tools.get_transliteration(self.config['api_key'], processed_text, transliteration_option)
 
     def interpret_transliteration_response_async(self, response):
@@ -482,31 +834,43 @@ class LanguageTools():
         error_text = f"Could not load transliteration: {response.text}"
         raise errors.LanguageToolsRequestError(error_text)
 
-    def get_transliteration(self, source_text, transliteration_option):
-        return self.interpret_transliteration_response_async(self.get_transliteration_async(source_text, transliteration_option))
+    def get_transliteration(self, source_text, transliteration_option, processed_text=None):
+        return self.interpret_transliteration_response_async(self.get_transliteration_async(source_text, transliteration_option, processed_text=processed_text))
 
-    def generate_audio_for_field(self, note_id, from_field, to_field, voice):
-        note = self.anki_utils.get_note_by_id(note_id)
+    def generate_audio_for_field(self, note_id, from_field, to_field, voice, media_batch=None):
+        with self.performance_stats.timer('anki_get_note'):
+            note = self.anki_utils.get_note_by_id(note_id)
         source_text = note[from_field]
         if self.text_utils.is_empty(source_text):
             return False
+
+        if media_batch != None:
+            # bulk run, the audio gets registered and the note saved along with the rest of its group
+            generated_filename = self.get_tts_audio(source_text, voice['service'], voice['language_code'], voice['voice_key'], {})
+            if generated_filename == None:
+                return False
+            media_batch.add_audio(note, to_field, generated_filename)
+            media_batch.add_note(note)
+            return True
         
         response = self.generate_audio_tag_collection(source_text, voice)
         sound_tag = response['sound_tag']
         if sound_tag != None:
             # write to note
             note[to_field] = sound_tag
-            note.flush()
+            with self.performance_stats.timer('anki_note_flush'):
+                note.flush()
             return True # success
 
         return False # failure
 
-    def generate_audio_tag_collection(self, source_text, voice):
+    def generate_audio_tag_collection(self, source_text, voice, processed_text=None):
         result = {'sound_tag': None,
                   'full_filename': None}
-        generated_filename = self.get_tts_audio(source_text, voice['service'], voice['language_code'], voice['voice_key'], {})
+        generated_filename = self.get_tts_audio(source_text, voice['service'], voice['language_code'], voice['voice_key'], {}, processed_text=processed_text)
         if generated_filename != None:
-            full_filename = self.anki_utils.media_add_file(generated_filename)
+            with self.performance_stats.timer('anki_media_add_file'):
+                full_filename = self.anki_utils.media_add_file(generated_filename)
             collection_filename = os.path.basename(full_filename)
             sound_tag = f'[sound:{collection_filename}]'
             result['sound_tag'] = sound_tag
@@ -522,7 +886,7 @@ class LanguageTools():
 
     def get_hash_for_audio_request(self, source_text, service, voice_key, options):
         combined_data = {
-            'source_text': source_text,
+            'source_text': self.text_utils.normalize(source_text),
             'service': service,
             'voice_key': voice_key,
             'options': options
@@ -546,27 +910,93 @@ class LanguageTools():
         filename = f'languagetools-{hash_str}.mp3'
         return os.path.join(user_files_dir, filename)
 
-    def get_tts_audio(self, source_text, service, language_code, voice_key, options):
-        processed_text = self.text_utils.process(source_text, constants.TransformationType.Audio)
-        logging.info(f'before text processing: [{source_text}], after text processing: [{processed_text}]')
+    def get_tts_audio(self, source_text, service, language_code, voice_key, options, processed_text=None):
+        if processed_text == None:
+            with self.performance_stats.timer('text_processing'):
+                processed_text = self.text_utils.process(source_text, constants.TransformationType.Audio)
+            logging.info(f'before text processing: [{source_text}], after text processing: [{processed_text}]')
         filename = self.get_audio_filename(processed_text, service, voice_key, options)
         if os.path.isfile(filename):
             return filename
-        audio_content = self.cloud_language_tools.get_tts_audio(self.config['api_key'], processed_text, service, language_code, voice_key, options)
-        with open(filename, 'wb') as f:
-            f.write(audio_content)
-        f.close()
+        audio_content = None
+        if len(processed_text) >= constants.TTS_LONG_TEXT_MIN_LENGTH:
+            audio_content = self.get_tts_audio_long_text(processed_text, service, language_code, voice_key, options)
+        if audio_content == None:
+            audio_content = self.cloud_language_tools.get_tts_audio(self.config['api_key'], processed_text, service, language_code, voice_key, options)
+        # the same file can be requested from several threads (sample prefetch), never expose a partially written file
+        temp_filename = f'{filename}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_filename, 'wb') as f:
+                f.write(audio_content)
+            os.replace(temp_filename, filename)
+        finally:
+            # only left behind when the write failed
+            if os.path.isfile(temp_filename):
+                os.remove(temp_filename)
         logging.info(f'wrote audio filename {filename}')
         return filename
 
+    def get_tts_audio_long_text(self, processed_text, service, language_code, voice_key, options):
+        # sentence chunks are synthesized concurrently, and cached individually so that editing one sentence
+        # only requires generating that chunk again. returns None when the text can't be split.
+        chunks = audio_utils.chunk_text(processed_text, constants.TTS_CHUNK_MIN_SENTENCE_LENGTH)
+        if len(chunks) < 2:
+            return None
+        with self.performance_stats.timer('tts_long_text'):
+            # chunk requests count against the concurrency limit of the calling task's priority class
+            chunk_filenames = self.anki_utils.map_in_task_class(
+                lambda chunk: self.get_tts_audio(chunk, service, language_code, voice_key, options, processed_text=chunk),
+                chunks, constants.TTS_CHUNK_MAX_WORKERS)
+            audio_content_list = []
+            for chunk_filename in chunk_filenames:
+                with open(chunk_filename, 'rb') as f:
+                    audio_content_list.append(f.read())
+            try:
+                return audio_utils.concatenate_mp3(audio_content_list)
+            except errors.AudioFormatError as e:
+                logging.warning(f'could not join audio chunks, requesting the whole text: {e}')
+                return None
+
+    def is_tts_audio_cached(self, source_text, service, voice_key, options):
+        processed_text = self.text_utils.process(source_text, constants.TransformationType.Audio)
+        return os.path.isfile(self.get_audio_filename(processed_text, service, voice_key, options))
+
     def play_tts_audio(self, source_text, service, language_code, voice_key, options):
         audio_filename = self.get_tts_audio(source_text, service, language_code, voice_key, options)
         self.anki_utils.play_sound(audio_filename)
 
+    def process_texts_for_batch(self, texts, transformation_type: constants.TransformationType):
+        # run text processing for a whole batch before sending any request
+        with self.performance_stats.timer('text_processing_batch'):
+            return self.text_utils.process_many(texts, transformation_type)
+
+    def measure_text_normalization(self, note_id_list, transformation_type=constants.TransformationType.Audio):
+        # for each field, how many distinct cache keys collapse under normalization
+        field_texts = {}
+        for note_id in note_id_list:
+            note = self.anki_utils.get_note_by_id(note_id)
+            for field_name in note.keys():
+                field_texts.setdefault(field_name, []).append(note[field_name])
+        return {field_name: self.text_utils.measure_normalization(texts, transformation_type) for field_name, texts in field_texts.items()}
+
+    def get_performance_stats(self):
+        return self.performance_stats.get_stats()
+
+    def reset_performance_stats(self):
+        self.performance_stats.reset()
+
     def get_tts_voice_list(self):
-        return self.cloud_language_tools.get_tts_voice_list(self.config['api_key'])
+        # the voice catalog rarely changes, don't download it every time the voice selection dialog opens
+        if self.voice_list != None and time.time() - self.voice_list_time < constants.VOICE_LIST_TTL_SECONDS:
+            self.performance_stats.increment('voice_list.hit')
+            return self.voice_list
+        self.performance_stats.increment('voice_list.miss')
+        self.voice_list = self.cloud_language_tools.get_tts_voice_list(self.config['api_key'])
+        self.voice_list_time = time.time()
+        return self.voice_list
 
     def get_transliteration_options(self, language):
+        self.wait_for_initialization()
         candidates = [x for x in self.transliteration_language_list if x['language_code'] == language]
         return candidates
 
@@ -580,6 +1010,7 @@ class LanguageTools():
 
     def get_translation_options(self, source_language: str, target_language: str):
         # get list of services which support source_language
+        self.wait_for_initialization()
         translation_options = []
         source_language_options = [x for x in self.translation_language_list if x['language_code'] == source_language]
         for source_language_option in source_language_options:
@@ -0,0 +1,53 @@
+import sys
+import os
+import time
+
+if hasattr(sys, '_pytest_mode'):
+    import constants
+else:
+    from . import constants
+
+# bulk audio runs (add audio dialog, run rules dialog) don't register each clip and save each note as soon as
+# its audio is ready. generated files are collected, and every group_size notes (or flush_interval_seconds,
+# whichever comes first) the files of the group get registered in the media folder, the sound tags are written
+# into the notes, and the notes are saved with a single call (one call per note before anki 2.1.45). anki has no
+# bulk api for the media database, files which can't be hard linked are still registered one at a time, see
+# AnkiUtils.media_add_files. callers flush in a finally block,
+# so that the notes of an incomplete group aren't lost when the run stops on an error.
+
+class MediaRegistrationBatch():
+    def __init__(self, languagetools, group_size=constants.MEDIA_REGISTRATION_GROUP_SIZE,
+            flush_interval_seconds=constants.MEDIA_REGISTRATION_FLUSH_INTERVAL_SECONDS):
+        self.languagetools = languagetools
+        self.group_size = group_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.last_flush_time = time.time()
+        # (note, field_name, generated_filename)
+        self.pending_audio = []
+        self.pending_notes = []
+        self.registered_count = 0
+        self.saved_note_count = 0
+
+    def add_audio(self, note, field_name, generated_filename):
+        self.pending_audio.append((note, field_name, generated_filename))
+
+    def add_note(self, note):
+        # all fields of the note are either set, or waiting for their audio to be registered
+        self.pending_notes.append(note)
+        if len(self.pending_notes) >= self.group_size or time.time() - self.last_flush_time > self.flush_interval_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush_time = time.time()
+        pending_audio, self.pending_audio = self.pending_audio, []
+        pending_notes, self.pending_notes = self.pending_notes, []
+        if len(pending_audio) > 0:
+            with self.languagetools.performance_stats.timer('anki_media_add_files'):
+                media_filenames = self.languagetools.anki_utils.media_add_files([x[2] for x in pending_audio])
+            for (note, field_name, generated_filename), media_filename in zip(pending_audio, media_filenames):
+                note[field_name] = f'[sound:{os.path.basename(media_filename)}]'
+            self.registered_count += len(pending_audio)
+        if len(pending_notes) > 0:
+            with self.languagetools.performance_stats.timer('anki_update_notes'):
+                self.languagetools.anki_utils.update_notes(pending_notes)
+            self.saved_note_count += len(pending_notes)
@@ -0,0 +1,142 @@
+import threading
+import time
+import json
+import math
+import contextlib
+
+# latency histograms are bucketed by powers of 2 milliseconds: <=1ms, <=2ms, <=4ms ... <=2^20ms
+HISTOGRAM_BUCKET_COUNT = 21
+
+class TimerContext():
+    def __init__(self):
+        self.response_bytes = 0
+        self.error = False
+
+class EndpointStats():
+    def __init__(self):
+        self.count = 0
+        self.error_count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.histogram = [0] * HISTOGRAM_BUCKET_COUNT
+
+    def record(self, elapsed_ms, request_bytes, response_bytes, error):
+        self.count += 1
+        if error:
+            self.error_count += 1
+        self.total_ms += elapsed_ms
+        if self.min_ms == None or elapsed_ms < self.min_ms:
+            self.min_ms = elapsed_ms
+        if self.max_ms == None or elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        self.histogram[get_bucket_index(elapsed_ms)] += 1
+
+    def percentile_ms(self, percentile):
+        # upper bound of the histogram bucket containing the percentile
+        if self.count == 0:
+            return None
+        threshold = self.count * percentile / 100.0
+        cumulative = 0
+        for i, bucket_count in enumerate(self.histogram):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return min(get_bucket_upper_ms(i), self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'error_count': self.error_count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count > 0 else None,
+            'min_ms': round(self.min_ms, 3) if self.min_ms != None else None,
+            'max_ms': round(self.max_ms, 3) if self.max_ms != None else None,
+            'p50_ms': self.percentile_ms(50),
+            'p90_ms': self.percentile_ms(90),
+            'p99_ms': self.percentile_ms(99),
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'histogram': {f'<={get_bucket_upper_ms(i)}ms': bucket_count for i, bucket_count in enumerate(self.histogram) if bucket_count > 0}
+        }
+
+def get_bucket_index(elapsed_ms):
+    if elapsed_ms <= 1:
+        return 0
+    return min(int(math.ceil(math.log2(elapsed_ms))), HISTOGRAM_BUCKET_COUNT - 1)
+
+def get_bucket_upper_ms(bucket_index):
+    return 2 ** bucket_index
+
+
+class PerformanceStats():
+    # latency / throughput counters, keyed by endpoint name (cloud endpoint url path, or a local operation)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+            self.counters = {}
+            self.start_time = time.time()
+
+    def record(self, name, elapsed_ms, request_bytes=0, response_bytes=0, error=False):
+        with self.lock:
+            if name not in self.endpoints:
+                self.endpoints[name] = EndpointStats()
+            self.endpoints[name].record(elapsed_ms, request_bytes, response_bytes, error)
+
+    @contextlib.contextmanager
+    def timer(self, name, request_bytes=0):
+        # with performance_stats.timer('/translate') as timer_context:
+        #     timer_context.response_bytes = ...
+        timer_context = TimerContext()
+        start_time = time.perf_counter()
+        try:
+            yield timer_context
+        except:
+            timer_context.error = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start_time) * 1000.0
+            self.record(name, elapsed_ms, request_bytes, timer_context.response_bytes, timer_context.error)
+
+    def increment(self, name, amount=1):
+        # plain counters, for things which aren't timed, like cache hits
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def update_max(self, name, value):
+        # counter holding the highest value seen, like a queue depth
+        with self.lock:
+            self.counters[name] = max(self.counters.get(name, 0), value)
+
+    def get_hit_rates(self):
+        # for counter pairs named <cache>.hit / <cache>.miss
+        hit_rates = {}
+        for name, hits in self.counters.items():
+            if name.endswith('.hit'):
+                cache_name = name[:-len('.hit')]
+                total = hits + self.counters.get(cache_name + '.miss', 0)
+                hit_rates[cache_name] = round(hits / total, 4)
+        for name in self.counters.keys():
+            if name.endswith('.miss') and name[:-len('.miss')] not in hit_rates:
+                hit_rates[name[:-len('.miss')]] = 0.0
+        return dict(sorted(hit_rates.items()))
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'elapsed_s': round(time.time() - self.start_time, 3),
+                'endpoints': {name: stats.to_dict() for name, stats in sorted(self.endpoints.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'hit_rates': self.get_hit_rates()
+            }
+
+    def to_json(self):
+        return json.dumps(self.get_stats(), indent=4)
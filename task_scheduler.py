@@ -0,0 +1,135 @@
+import sys
+import time
+import collections
+import threading
+import concurrent.futures
+
+if hasattr(sys, '_pytest_mode'):
+    import constants
+    import perf_stats
+else:
+    from . import constants
+    from . import perf_stats
+
+# add-on level scheduler for background work. tasks are queued per priority class, and each class has its own
+# limit on running tasks, so that an editor translation doesn't wait behind a bulk audio run. like anki's
+# taskman.run_in_background, the done callback receives the future and runs on the main thread.
+
+class CancellationToken():
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        # a queued task won't start, a running task finishes but its done callback isn't called
+        self.cancelled = True
+
+
+class ScheduledTask():
+    def __init__(self, task_fn, task_done_fn, priority, cancellation_token):
+        self.task_fn = task_fn
+        self.task_done_fn = task_done_fn
+        self.priority = priority
+        self.cancellation_token = cancellation_token
+        self.queued_time = time.perf_counter()
+
+
+class TaskScheduler():
+    def __init__(self, run_on_main_fn, performance_stats=None, max_running=None):
+        self.run_on_main_fn = run_on_main_fn
+        self.performance_stats = performance_stats
+        if self.performance_stats == None:
+            self.performance_stats = perf_stats.PerformanceStats()
+        self.max_running = max_running
+        if self.max_running == None:
+            self.max_running = {
+                constants.TaskPriority.interactive: constants.TASK_SCHEDULER_MAX_RUNNING_INTERACTIVE,
+                constants.TaskPriority.prefetch: constants.TASK_SCHEDULER_MAX_RUNNING_PREFETCH,
+                constants.TaskPriority.batch: constants.TASK_SCHEDULER_MAX_RUNNING_BATCH
+            }
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=sum(self.max_running.values()))
+        self.lock = threading.Lock()
+        self.queues = {priority: collections.deque() for priority in constants.TaskPriority}
+        self.running = {priority: 0 for priority in constants.TaskPriority}
+        # priority class of the task running on the current worker thread
+        self.current_task = threading.local()
+
+    def submit(self, task_fn, task_done_fn, priority=constants.TaskPriority.interactive, cancellation_token=None):
+        if cancellation_token == None:
+            cancellation_token = CancellationToken()
+        task = ScheduledTask(task_fn, task_done_fn, priority, cancellation_token)
+        with self.lock:
+            queue = self.queues[priority]
+            queue.append(task)
+            self.performance_stats.update_max(f'scheduler.{priority.name}.max_queue_depth', len(queue))
+        self.start_tasks()
+        return cancellation_token
+
+    def start_tasks(self):
+        tasks = []
+        with self.lock:
+            # classes are visited in priority order, each one only up to its own limit
+            for priority in constants.TaskPriority:
+                queue = self.queues[priority]
+                while len(queue) > 0 and self.running[priority] < self.max_running[priority]:
+                    task = queue.popleft()
+                    if task.cancellation_token.cancelled:
+                        self.performance_stats.increment(f'scheduler.{priority.name}.cancelled')
+                        continue
+                    self.running[priority] += 1
+                    tasks.append(task)
+        # outside of the lock, the done callback of a task which completed already runs right away
+        for task in tasks:
+            self.performance_stats.record(f'scheduler_wait:{task.priority.name}', (time.perf_counter() - task.queued_time) * 1000.0)
+            future = self.executor.submit(self.run_task, task)
+            future.add_done_callback(lambda future, task=task: self.task_done(task, future))
+
+    def run_task(self, task):
+        self.current_task.priority = task.priority
+        try:
+            with self.performance_stats.timer(f'scheduler_run:{task.priority.name}'):
+                return task.task_fn()
+        finally:
+            self.current_task.priority = None
+
+    def map_in_task_class(self, fn, items, max_workers):
+        # runs fn on every item, concurrently when the priority class of the calling task has free slots. the calling
+        # task already holds one slot, the extra workers take free slots of the same class, so a batch task can't go
+        # over the batch limit by fanning out. outside of a scheduled task, only free interactive slots are used.
+        priority = getattr(self.current_task, 'priority', None)
+        held_count = 1
+        if priority == None:
+            priority = constants.TaskPriority.interactive
+            held_count = 0
+        with self.lock:
+            free_count = self.max_running[priority] - self.running[priority]
+            extra_count = max(0, min(max_workers - held_count, len(items) - held_count, free_count))
+            self.running[priority] += extra_count
+        try:
+            worker_count = held_count + extra_count
+            if worker_count <= 1:
+                return [fn(item) for item in items]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+                return list(executor.map(fn, items))
+        finally:
+            if extra_count > 0:
+                with self.lock:
+                    self.running[priority] -= extra_count
+                self.start_tasks()
+
+    def task_done(self, task, future):
+        with self.lock:
+            self.running[task.priority] -= 1
+        self.start_tasks()
+        if task.cancellation_token.cancelled:
+            self.performance_stats.increment(f'scheduler.{task.priority.name}.cancelled')
+            return
+        if task.task_done_fn != None:
+            self.run_on_main_fn(lambda: task.task_done_fn(future))
+
+    def get_queue_depths(self):
+        with self.lock:
+            return {priority.name: len(queue) for priority, queue in self.queues.items()}
+
+    def get_running_counts(self):
+        with self.lock:
+            return {priority.name: count for priority, count in self.running.items()}
@@ -0,0 +1,126 @@
+import os
+import pytest
+import audio_utils
+import errors
+
+# mpeg 1 layer III, 128kbps, 44100hz, no padding: 417 bytes per frame
+MPEG1_HEADER = b'\xff\xfb\x90\x00'
+MPEG1_FRAME_LENGTH = 417
+# mpeg 2 layer III, 64kbps, 24000hz, padding: 193 bytes per frame
+MPEG2_HEADER = b'\xff\xf3\x86\x00'
+MPEG2_FRAME_LENGTH = 193
+
+def build_frame(header, frame_length, payload_byte):
+    return header + bytes([payload_byte]) * (frame_length - len(header))
+
+def build_mp3(payload_bytes, header=MPEG1_HEADER, frame_length=MPEG1_FRAME_LENGTH):
+    return b''.join([build_frame(header, frame_length, payload_byte) for payload_byte in payload_bytes])
+
+def test_chunk_text(qtbot):
+    # pytest test_audio_utils.py -rPP -k test_chunk_text
+    text = 'The first sentence. Is this the second one? Yes! Pi is 3.14, not a sentence end.'
+    assert audio_utils.split_sentences(text) == ['The first sentence. ', 'Is this the second one? ', 'Yes! ', 'Pi is 3.14, not a sentence end.']
+    assert ''.join(audio_utils.split_sentences(text)) == text
+    assert audio_utils.split_sentences('你好。我是老人家！谢谢') == ['你好。', '我是老人家！', '谢谢']
+
+    # short sentences are joined to the following one
+    assert audio_utils.chunk_text(text, 10) == ['The first sentence.', 'Is this the second one?', 'Yes! Pi is 3.14, not a sentence end.']
+    assert audio_utils.chunk_text(text, 1) == ['The first sentence.', 'Is this the second one?', 'Yes!', 'Pi is 3.14, not a sentence end.']
+    # a short last sentence still gets its chunk
+    assert audio_utils.chunk_text('The first sentence. Yes!', 10) == ['The first sentence.', 'Yes!']
+    assert audio_utils.chunk_text('   ', 10) == []
+
+    # editing or inserting a sentence in the middle leaves the other chunks as they were
+    sentences = [f'This is sentence number {i} of a long reading passage.' for i in range(10)]
+    chunks = audio_utils.chunk_text(' '.join(sentences), 20)
+    edited_sentences = sentences[:4] + ['This sentence was edited, and it is quite a bit longer than it used to be.'] + sentences[5:]
+    edited_chunks = audio_utils.chunk_text(' '.join(edited_sentences), 20)
+    assert [i for i, (a, b) in enumerate(zip(chunks, edited_chunks)) if a != b] == [4]
+    inserted_sentences = sentences[:4] + ['An inserted sentence.'] + sentences[4:]
+    inserted_chunks = audio_utils.chunk_text(' '.join(inserted_sentences), 20)
+    assert inserted_chunks == chunks[:4] + ['An inserted sentence.'] + chunks[4:]
+
+def test_concatenate_mp3(qtbot):
+    # pytest test_audio_utils.py -rPP -k test_concatenate_mp3
+    assert audio_utils.get_frame_length(MPEG1_HEADER) == MPEG1_FRAME_LENGTH
+    assert audio_utils.get_frame_length(MPEG2_HEADER) == MPEG2_FRAME_LENGTH
+    assert audio_utils.get_frame_length(b'ID3\x04') == 0
+
+    mp3_1 = build_mp3([1, 2, 3])
+    mp3_2 = build_mp3([4, 5])
+    assert audio_utils.concatenate_mp3([mp3_1, mp3_2]) == build_mp3([1, 2, 3, 4, 5])
+
+    # id3v2 / id3v1 tags and the xing frame are dropped
+    id3v2_tag = b'ID3\x04\x00\x00\x00\x00\x00\x05' + b'\x00' * 5
+    xing_frame = MPEG1_HEADER + b'\x00' * 32 + b'Xing' + b'\x00' * (MPEG1_FRAME_LENGTH - 40)
+    id3v1_tag = b'TAG' + b'\x00' * 125
+    tagged_mp3 = id3v2_tag + xing_frame + build_mp3([6, 7]) + id3v1_tag
+    assert audio_utils.get_mp3_frames(tagged_mp3) == [build_frame(MPEG1_HEADER, MPEG1_FRAME_LENGTH, 6), build_frame(MPEG1_HEADER, MPEG1_FRAME_LENGTH, 7)]
+    assert audio_utils.concatenate_mp3([mp3_1, tagged_mp3]) == build_mp3([1, 2, 3, 6, 7])
+
+    # junk between frames is skipped
+    mp3_3 = build_mp3([8], MPEG2_HEADER, MPEG2_FRAME_LENGTH) + b'\x00\xff\x00' + build_mp3([9], MPEG2_HEADER, MPEG2_FRAME_LENGTH)
+    assert len(audio_utils.get_mp3_frames(mp3_3)) == 2
+
+    with pytest.raises(errors.AudioFormatError):
+        audio_utils.concatenate_mp3([mp3_1, b'{"text": "not audio"}'])
+
+def test_link_media_file(qtbot, tmp_path):
+    # pytest test_audio_utils.py -rPP -k test_link_media_file
+    user_files_dir = tmp_path / 'user_files'
+    media_dir = tmp_path / 'collection.media'
+    user_files_dir.mkdir()
+    media_dir.mkdir()
+
+    source_path = user_files_dir / 'languagetools-1.mp3'
+    source_path.write_bytes(build_mp3([1, 2]))
+    assert audio_utils.link_media_file(str(source_path), str(media_dir)) == 'languagetools-1.mp3'
+    # stored once
+    assert os.path.samefile(source_path, media_dir / 'languagetools-1.mp3')
+    assert os.stat(source_path).st_nlink == 2
+    # registering again is a no-op
+    assert audio_utils.link_media_file(str(source_path), str(media_dir)) == 'languagetools-1.mp3'
+
+    # same contents already in the media folder
+    source_path = user_files_dir / 'languagetools-2.mp3'
+    source_path.write_bytes(build_mp3([3]))
+    (media_dir / 'languagetools-2.mp3').write_bytes(build_mp3([3]))
+    assert audio_utils.link_media_file(str(source_path), str(media_dir)) == 'languagetools-2.mp3'
+
+    # different contents, the caller has to copy under another name
+    (media_dir / 'languagetools-2.mp3').write_bytes(build_mp3([4]))
+    assert audio_utils.link_media_file(str(source_path), str(media_dir)) == None
+
+    # media folder which doesn't exist / other filesystem
+    assert audio_utils.link_media_file(str(source_path), str(tmp_path / 'missing')) == None
+
+def test_register_media_files(qtbot, tmp_path):
+    # pytest test_audio_utils.py -rPP -k test_register_media_files
+    user_files_dir = tmp_path / 'user_files'
+    media_dir = tmp_path / 'collection.media'
+    user_files_dir.mkdir()
+    media_dir.mkdir()
+
+    source_path_1 = str(user_files_dir / 'languagetools-1.mp3')
+    source_path_2 = str(user_files_dir / 'languagetools-2.mp3')
+    (user_files_dir / 'languagetools-1.mp3').write_bytes(build_mp3([1]))
+    (user_files_dir / 'languagetools-2.mp3').write_bytes(build_mp3([2]))
+    # can't be linked, different contents already in the media folder
+    (media_dir / 'languagetools-2.mp3').write_bytes(build_mp3([3]))
+
+    added_files = []
+    def add_file(source_path):
+        added_files.append(source_path)
+        return 'copy-' + os.path.basename(source_path)
+
+    source_paths = [source_path_1, source_path_2, source_path_1, source_path_2]
+    assert audio_utils.register_media_files(source_paths, str(media_dir), add_file) == \
+        ['languagetools-1.mp3', 'copy-languagetools-2.mp3', 'languagetools-1.mp3', 'copy-languagetools-2.mp3']
+    # each distinct file is copied once
+    assert added_files == [source_path_2]
+
+    # no media folder, everything gets copied
+    added_files.clear()
+    assert audio_utils.register_media_files(source_paths, None, add_file) == \
+        ['copy-languagetools-1.mp3', 'copy-languagetools-2.mp3', 'copy-languagetools-1.mp3', 'copy-languagetools-2.mp3']
+    assert added_files == [source_path_1, source_path_2]
@@ -1,4 +1,6 @@
 import unittest
+import os
+import json
 import pytest
 import pprint
 import logging
@@ -11,6 +13,8 @@ import dialog_choosetranslation
 import dialog_batchtransformation
 import dialog_apikey
 import dialog_textprocessing
+import dialog_performancestats
+import text_utils
 import languagetools
 import constants
 import testing_utils
@@ -106,38 +110,54 @@ def test_language_mapping(qtbot):
     mock_language_tools = config_gen.build_languagetools_instance('no_language_mapping')
 
     mapping_dialog = dialog_languagemapping.prepare_language_mapping_dialogue(mock_language_tools)
-    
+    tree_model = mapping_dialog.ui.tree_model
+
+    def get_field_index(field_name, column):
+        deck_index = tree_model.index(0, 0)
+        note_type_index = tree_model.index(0, 0, deck_index)
+        row = config_gen.all_fields.index(field_name)
+        return tree_model.index(row, column, note_type_index)
+
+    def set_field_language(field_name, language_name):
+        # edit through the combobox delegate, moving to another cell closes it
+        tree_view = mapping_dialog.ui.tree_view
+        field_language_index = get_field_index(field_name, dialog_languagemapping.COL_INDEX_LANGUAGE)
+        tree_view.setCurrentIndex(field_language_index)
+        tree_view.edit(field_language_index)
+        field_language_combobox = tree_view.indexWidget(field_language_index)
+        assert field_language_combobox.objectName() == 'field_language'
+        qtbot.keyClicks(field_language_combobox, language_name)
+        tree_view.setCurrentIndex(tree_model.index(0, 0))
+
     # assert deck name, note type, and 3 fields
-    deck_frame = mapping_dialog.findChild(PyQt5.QtWidgets.QFrame, f'frame_{config_gen.deck_name}')
-    assert deck_frame != None
-    deck_name_label = mapping_dialog.findChild(PyQt5.QtWidgets.QLabel, f'deck_name_{config_gen.deck_name}')
-    assert deck_name_label.text() == config_gen.deck_name
-    note_type_label = mapping_dialog.findChild(PyQt5.QtWidgets.QLabel, f'note_type_name_{config_gen.deck_name}_{config_gen.model_name}')
-    assert note_type_label.text() == config_gen.model_name
+    assert tree_model.rowCount() == 1
+    deck_index = tree_model.index(0, 0)
+    assert tree_model.data(deck_index, PyQt5.QtCore.Qt.DisplayRole) == config_gen.deck_name
+    assert tree_model.rowCount(deck_index) == 1
+    note_type_index = tree_model.index(0, 0, deck_index)
+    assert tree_model.data(note_type_index, PyQt5.QtCore.Qt.DisplayRole) == config_gen.model_name
+    assert mapping_dialog.ui.tree_view.isExpanded(deck_index)
+    assert mapping_dialog.ui.tree_view.isExpanded(note_type_index)
 
     # look for labels on all 3 fields
+    assert tree_model.rowCount(note_type_index) == len(config_gen.all_fields)
     for field_name in config_gen.all_fields:
-        field_label_obj_name = f'field_label_{config_gen.model_name} / {config_gen.deck_name} / {field_name}'
-        field_label = mapping_dialog.findChild(PyQt5.QtWidgets.QLabel, field_label_obj_name)
-        assert field_label.text() == field_name
+        field_index = get_field_index(field_name, dialog_languagemapping.COL_INDEX_NAME)
+        assert tree_model.data(field_index, PyQt5.QtCore.Qt.DisplayRole) == field_name
+        assert tree_model.parent(field_index) == note_type_index
 
     # none of the languages should be set
     for field_name in config_gen.all_fields:
-        field_language_obj_name = f'field_language_{config_gen.model_name} / {config_gen.deck_name} / {field_name}'
-        field_language = mapping_dialog.findChild(PyQt5.QtWidgets.QComboBox, field_language_obj_name)
-        assert field_language != None
+        field_language_index = get_field_index(field_name, dialog_languagemapping.COL_INDEX_LANGUAGE)
         # ensure the "not set" option is selected
-        assert field_language.currentText() == 'Not Set'
+        assert tree_model.data(field_language_index, PyQt5.QtCore.Qt.DisplayRole) == 'Not Set'
 
     # now, set languages manually
     # ---------------------------
 
-    field_language_obj_name = f'field_language_{config_gen.model_name} / {config_gen.deck_name} / {config_gen.field_chinese}'
-    field_language_combobox = mapping_dialog.findChild(PyQt5.QtWidgets.QComboBox, field_language_obj_name)
-    qtbot.keyClicks(field_language_combobox, 'Chinese')
-    field_language_obj_name = f'field_language_{config_gen.model_name} / {config_gen.deck_name} / {config_gen.field_english}'
-    field_language_combobox = mapping_dialog.findChild(PyQt5.QtWidgets.QComboBox, field_language_obj_name)
-    qtbot.keyClicks(field_language_combobox, 'English')
+    set_field_language(config_gen.field_chinese, 'Chinese')
+    set_field_language(config_gen.field_english, 'English')
+    assert tree_model.data(get_field_index(config_gen.field_chinese, dialog_languagemapping.COL_INDEX_LANGUAGE), PyQt5.QtCore.Qt.DisplayRole) == 'Chinese'
 
     apply_button = mapping_dialog.findChild(PyQt5.QtWidgets.QPushButton, 'apply')
     qtbot.mouseClick(apply_button, PyQt5.QtCore.Qt.LeftButton)
@@ -150,8 +170,13 @@ def test_language_mapping(qtbot):
 
     # run automatic detection
     # -----------------------
+
+    language_detection_cache_filename = mock_language_tools.get_language_detection_cache_filename()
+    if os.path.isfile(language_detection_cache_filename):
+        os.remove(language_detection_cache_filename)
     
     mapping_dialog = dialog_languagemapping.prepare_language_mapping_dialogue(mock_language_tools)
+    tree_model = mapping_dialog.ui.tree_model
     # apply button should be disabled
     apply_button = mapping_dialog.findChild(PyQt5.QtWidgets.QPushButton, 'apply')
     assert apply_button.isEnabled() == False
@@ -160,13 +185,23 @@ def test_language_mapping(qtbot):
     qtbot.mouseClick(autodetect_button, PyQt5.QtCore.Qt.LeftButton)
     
     # assert languages detected
-    field_language_obj_name = f'field_language_{config_gen.model_name} / {config_gen.deck_name} / {config_gen.field_chinese}'
-    field_language = mapping_dialog.findChild(PyQt5.QtWidgets.QComboBox, field_language_obj_name)
-    assert field_language.currentText() == 'Chinese'
+    field_language_index = get_field_index(config_gen.field_chinese, dialog_languagemapping.COL_INDEX_LANGUAGE)
+    assert tree_model.data(field_language_index, PyQt5.QtCore.Qt.DisplayRole) == 'Chinese'
+
+    field_language_index = get_field_index(config_gen.field_english, dialog_languagemapping.COL_INDEX_LANGUAGE)
+    assert tree_model.data(field_language_index, PyQt5.QtCore.Qt.DisplayRole) == 'English'
 
-    field_language_obj_name = f'field_language_{config_gen.model_name} / {config_gen.deck_name} / {config_gen.field_english}'
-    field_language = mapping_dialog.findChild(PyQt5.QtWidgets.QComboBox, field_language_obj_name)
-    assert field_language.currentText() == 'English'
+    # empty fields are settled locally, the chinese and english samples are too short
+    assert mapping_dialog.ui.autodetect_result_label.text() == '0 fields unchanged, 0 shared with other decks, 2 detected locally, 2 using the cloud service'
+    assert mock_language_tools.cloud_language_tools.language_detection_calls == 2
+    assert os.path.isfile(language_detection_cache_filename)
+
+    # notes haven't changed, detection results get reused
+    qtbot.mouseClick(autodetect_button, PyQt5.QtCore.Qt.LeftButton)
+    assert mapping_dialog.ui.autodetect_result_label.text() == '4 fields unchanged, 0 shared with other decks, 0 detected locally, 0 using the cloud service'
+    assert mock_language_tools.cloud_language_tools.language_detection_calls == 2
+    assert tree_model.data(field_language_index, PyQt5.QtCore.Qt.DisplayRole) == 'English'
+    os.remove(language_detection_cache_filename)
 
     # apply button should be enabled
     assert apply_button.isEnabled() == True
@@ -188,24 +223,19 @@ def test_language_mapping(qtbot):
     # reset this
     mock_language_tools.anki_utils.written_config = None
     mapping_dialog = dialog_languagemapping.prepare_language_mapping_dialogue(mock_language_tools)
+    tree_model = mapping_dialog.ui.tree_model
 
-    field_samples_button_obj_name = f'field_samples_{config_gen.model_name} / {config_gen.deck_name} / {config_gen.field_english}'
-    autodetect_button = mapping_dialog.findChild(PyQt5.QtWidgets.QPushButton, field_samples_button_obj_name)
-    qtbot.mouseClick(autodetect_button, PyQt5.QtCore.Qt.LeftButton)
+    mapping_dialog.ui.tree_view.clicked.emit(get_field_index(config_gen.field_english, dialog_languagemapping.COL_INDEX_SAMPLES))
 
     assert 'old people' in mock_language_tools.anki_utils.info_message_received
     assert 'hello' in mock_language_tools.anki_utils.info_message_received
 
-    field_samples_button_obj_name = f'field_samples_{config_gen.model_name} / {config_gen.deck_name} / {config_gen.field_sound}'
-    autodetect_button = mapping_dialog.findChild(PyQt5.QtWidgets.QPushButton, field_samples_button_obj_name)
-    qtbot.mouseClick(autodetect_button, PyQt5.QtCore.Qt.LeftButton)    
+    mapping_dialog.ui.tree_view.clicked.emit(get_field_index(config_gen.field_sound, dialog_languagemapping.COL_INDEX_SAMPLES))
 
     assert 'No usable field data found' in mock_language_tools.anki_utils.info_message_received
 
     # set one language manually
-    field_language_obj_name = f'field_language_{config_gen.model_name} / {config_gen.deck_name} / {config_gen.field_chinese}'
-    field_language_combobox = mapping_dialog.findChild(PyQt5.QtWidgets.QComboBox, field_language_obj_name)
-    qtbot.keyClicks(field_language_combobox, 'Sound')
+    set_field_language(config_gen.field_chinese, 'Sound')
 
     # hit cancel
     cancel_button = mapping_dialog.findChild(PyQt5.QtWidgets.QPushButton, 'cancel')
@@ -213,6 +243,72 @@ def test_language_mapping(qtbot):
     # there should not be any config change
     assert mock_language_tools.anki_utils.written_config == None
 
+    # filter decks
+    # ============
+
+    mapping_dialog = dialog_languagemapping.prepare_language_mapping_dialogue(mock_language_tools)
+    mapping_dialog.ui.filter_text_input.setText('unknown deck')
+    assert mapping_dialog.ui.tree_model.rowCount() == 0
+    assert mapping_dialog.ui.filter_result_label.text() == '0 / 1 decks'
+    mapping_dialog.ui.filter_text_input.setText(config_gen.deck_name[:3])
+    assert mapping_dialog.ui.tree_model.rowCount() == 1
+    assert mapping_dialog.ui.filter_result_label.text() == '1 / 1 decks'
+
+def test_language_mapping_many_decks(qtbot):
+    # pytest test_dialogs.py -rPP -k test_language_mapping_many_decks
+    import time
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('no_language_mapping')
+
+    deck_count = 1500
+    deck_map = {}
+    for i in range(deck_count):
+        deck_name = f'deck {i}'
+        deck = mock_language_tools.deck_utils.new_deck()
+        deck_note_type = deck_utils.DeckNoteType(i, deck_name, config_gen.model_id, config_gen.model_name)
+        for field_name in config_gen.all_fields:
+            deck.add_deck_note_type_field(deck_utils.DeckNoteTypeField(deck_note_type, field_name))
+        deck_map[deck_name] = deck
+
+    start_time = time.time()
+    mapping_dialog = PyQt5.QtWidgets.QDialog()
+    mapping_dialog.ui = dialog_languagemapping.LanguageMappingDialog_UI(mock_language_tools, mapping_dialog)
+    mapping_dialog.ui.setupUi(mapping_dialog, deck_map)
+    setup_time = time.time() - start_time
+
+    tree_model = mapping_dialog.ui.tree_model
+    assert tree_model.rowCount() == deck_count
+    # no note type / field rows created until decks get expanded
+    assert len(tree_model.field_node_map) == 0
+    assert len(mapping_dialog.findChildren(PyQt5.QtWidgets.QComboBox)) == 0
+
+    # realize the field rows of deck 0 and deck 1400
+    for deck_row in [0, 1400]:
+        tree_model.rowCount(tree_model.index(0, 0, tree_model.index(deck_row, 0)))
+
+    start_time = time.time()
+    mapping_dialog.ui.filter_text_input.setText('deck 14')
+    filter_time = time.time() - start_time
+    # deck 14, 140-149, 1400-1499
+    assert tree_model.rowCount() == 111
+    assert mapping_dialog.ui.filter_result_label.text() == f'111 / {deck_count} decks'
+
+    # language changes only notify the view about rows it can see
+    changed_indexes = []
+    tree_model.dataChanged.connect(lambda top_left, bottom_right: changed_indexes.append(top_left))
+    dntf_hidden = deck_map['deck 0'].note_type_map[config_gen.model_name][0]
+    mapping_dialog.ui.setFieldLanguage(dntf_hidden, 'zh_cn')
+    assert changed_indexes == []
+    dntf_visible = deck_map['deck 1400'].note_type_map[config_gen.model_name][0]
+    mapping_dialog.ui.setFieldLanguage(dntf_visible, 'zh_cn')
+    assert len(changed_indexes) == 1
+    deck_index = tree_model.parent(tree_model.parent(changed_indexes[0]))
+    assert tree_model.data(deck_index, PyQt5.QtCore.Qt.DisplayRole) == 'deck 1400'
+    assert changed_indexes[0] == tree_model.index(0, dialog_languagemapping.COL_INDEX_LANGUAGE, tree_model.index(0, 0, tree_model.index(11, 0)))
+
+    print(f'{deck_count} decks, setup: {setup_time:.3f}s filter: {filter_time:.3f}s')
+
 def test_voice_selection(qtbot):
     # pytest test_dialogs.py -rPP -k test_voice_selection
 
@@ -264,6 +360,17 @@ def test_voice_selection(qtbot):
     # check that sample has been played
     assert mock_language_tools.anki_utils.played_sound['text'] == 'old people'
     assert 'Guy' in mock_language_tools.anki_utils.played_sound['voice_key']['name']
+    # audio was prefetched when the voice got selected
+    assert mock_language_tools.performance_stats.counters['voice_sample_prefetch.hit'] == 1
+    assert 'voice_sample_prefetch.miss' not in mock_language_tools.performance_stats.counters
+    assert constants.TaskPriority.prefetch in mock_language_tools.anki_utils.run_in_background_priorities
+
+    # an outdated prefetch doesn't request anything
+    cancellation_token = voice_selection_dialog.prefetch_cancellation_token
+    voice_selection_dialog.cancel_prefetch()
+    mock_language_tools.cloud_language_tools.requested_audio = None
+    mock_language_tools.get_audio_prefetcher().prefetch('new sample', voice_selection_dialog.get_selected_voice(), cancellation_token=cancellation_token)
+    assert mock_language_tools.cloud_language_tools.requested_audio == None
 
     apply_button = voice_selection_dialog.findChild(PyQt5.QtWidgets.QPushButton, 'apply')
     qtbot.mouseClick(apply_button, PyQt5.QtCore.Qt.LeftButton)
@@ -301,6 +408,46 @@ def test_voice_selection(qtbot):
 
     # voice_selection_dialog.exec_()
 
+def test_voice_selection_prefetch_debounce(qtbot, monkeypatch):
+    # pytest test_dialogs.py -rPP -k test_voice_selection_prefetch_debounce
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    # keep the timer pending instead of firing right away
+    timer_tasks = []
+    monkeypatch.setattr(mock_language_tools.anki_utils, 'call_on_timer_expire', lambda timer, task: timer_tasks.append(task))
+    requested_audio = []
+    original_get_tts_audio = mock_language_tools.get_tts_audio
+    def get_tts_audio(source_text, service, language_code, voice_key, options):
+        requested_audio.append((source_text, voice_key['name']))
+        return original_get_tts_audio(source_text, service, language_code, voice_key, options)
+    monkeypatch.setattr(mock_language_tools, 'get_tts_audio', get_tts_audio)
+
+    voice_list = mock_language_tools.cloud_language_tools.get_tts_voice_list('yoyo')
+    voice_selection_dialog = dialog_voiceselection.prepare_voice_selection_dialog(mock_language_tools, voice_list)
+
+    # go through a few voices, nothing gets requested while the selection changes
+    languages_combobox = voice_selection_dialog.findChild(PyQt5.QtWidgets.QComboBox, 'languages_combobox')
+    voices_combobox = voice_selection_dialog.findChild(PyQt5.QtWidgets.QComboBox, 'voices_combobox')
+    qtbot.keyClicks(languages_combobox, 'English')
+    qtbot.keyClicks(voices_combobox, voices_combobox.itemText(1))
+    qtbot.keyClicks(voices_combobox, voices_combobox.itemText(0))
+    qtbot.keyClicks(voices_combobox, voices_combobox.itemText(1))
+    assert len(timer_tasks) > 1
+    assert requested_audio == []
+
+    # once the timer expires, only the samples of the final voice are prefetched
+    timer_tasks[-1]()
+    mock_language_tools.get_audio_prefetcher().wait()
+    assert [source_text for source_text, voice_name in requested_audio] == ['old people', 'hello']
+    assert all('GuyNeural' in voice_name for source_text, voice_name in requested_audio)
+    assert mock_language_tools.performance_stats.counters['audio_prefetch.done'] == 2
+
+    # closing the dialog drops queued samples
+    voice_selection_dialog.reject()
+    assert voice_selection_dialog.prefetch_cancellation_token.cancelled == True
+
 def test_voice_selection_no_voices(qtbot):
     # pytest test_dialogs.py -rPP -k test_voice_selection_no_voices
 
@@ -780,4 +927,107 @@ def test_dialog_textprocessing_simple(qtbot):
     # dialog.exec_()
 
     # verify preview
-    assert dialog.sample_text_transformed_label.text() == '<b>abdc1234rep</b>'
\ No newline at end of file
+    assert dialog.sample_text_transformed_label.text() == '<b>abdc1234rep</b>'
+
+    # profile rules
+    qtbot.mouseClick(dialog.add_replace_regex_button, PyQt5.QtCore.Qt.LeftButton)
+    row = 1
+    index_pattern = dialog.textReplacementTableModel.createIndex(row, dialog_textprocessing.COL_INDEX_PATTERN)
+    dialog.textReplacementTableModel.setData(index_pattern, '(a+)+b', PyQt5.QtCore.Qt.EditRole)
+    index_replacement = dialog.textReplacementTableModel.createIndex(row, dialog_textprocessing.COL_INDEX_REPLACEMENT)
+    dialog.textReplacementTableModel.setData(index_replacement, 'c', PyQt5.QtCore.Qt.EditRole)
+
+    qtbot.mouseClick(dialog.profile_rules_button, PyQt5.QtCore.Qt.LeftButton)
+    profile_text = dialog.profile_results_label.text()
+    assert 'field samples' in profile_text
+    assert '(a+)+b' in profile_text
+    assert 'nested quantifiers' in profile_text
+
+    # saving a pattern with nested quantifiers needs a confirmation
+    ask_user_messages = []
+    def ask_user(message, parent):
+        ask_user_messages.append(message)
+        return False
+    mock_language_tools.anki_utils.ask_user = ask_user
+    qtbot.mouseClick(dialog.applyButton, PyQt5.QtCore.Qt.LeftButton)
+    assert len(ask_user_messages) == 1
+    assert 'nested quantifiers' in ask_user_messages[0]
+    assert mock_language_tools.anki_utils.written_config == None
+
+    # invalid patterns can't be saved
+    dialog.textReplacementTableModel.setData(index_pattern, '(a', PyQt5.QtCore.Qt.EditRole)
+    qtbot.mouseClick(dialog.applyButton, PyQt5.QtCore.Qt.LeftButton)
+    assert 'invalid regular expression' in mock_language_tools.anki_utils.critical_message_received
+    assert mock_language_tools.anki_utils.written_config == None
+
+    dialog.textReplacementTableModel.setData(index_pattern, '(a+)+b', PyQt5.QtCore.Qt.EditRole)
+    mock_language_tools.anki_utils.ask_user = lambda message, parent: True
+    qtbot.mouseClick(dialog.applyButton, PyQt5.QtCore.Qt.LeftButton)
+    assert mock_language_tools.anki_utils.written_config[constants.CONFIG_TEXT_PROCESSING]['replacements'][1]['pattern'] == '(a+)+b'
+    # the confirmation is stored with the rule, it runs from now on
+    assert mock_language_tools.anki_utils.written_config[constants.CONFIG_TEXT_PROCESSING]['replacements'][1]['confirmed_pattern'] == '(a+)+b'
+
+def test_dialog_textprocessing_rule_status(qtbot):
+    # pytest test_dialogs.py -rPP -k test_dialog_textprocessing_rule_status
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    dialog = dialog_textprocessing.prepare_text_processing_dialog(mock_language_tools)
+    assert dialog.rule_status_label.text() == ''
+
+    mock_language_tools.text_utils = text_utils.TextUtils({'replacements': [
+        {'pattern': '(a+)+b', 'replace': 'c', 'replace_type': 'regex'},
+        {'pattern': 'a+', 'replace': 'd', 'replace_type': 'regex'}
+    ]})
+    mock_language_tools.text_utils.process('aab', constants.TransformationType.Audio)
+    dialog = dialog_textprocessing.prepare_text_processing_dialog(mock_language_tools)
+    assert '(a+)+b</b> (1 texts)' in dialog.rule_status_label.text()
+    assert 'not applied' in dialog.rule_status_label.text()
+
+    mock_language_tools.text_utils.replacements[1].slow_count = 2
+    dialog = dialog_textprocessing.prepare_text_processing_dialog(mock_language_tools)
+    assert 'a+</b> (2 texts)' in dialog.rule_status_label.text()
+    assert 'exceeded the time budget' in dialog.rule_status_label.text()
+
+def test_dialog_performancestats(qtbot, tmp_path):
+    # pytest test_dialogs.py -rPP -k test_dialog_performancestats
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    mock_language_tools.cloud_language_tools.translation_map = {
+        'old people': 'vieilles personnes'
+    }
+    mock_language_tools.get_translation('old people', {'translation_key': 'en to fr'})
+    mock_language_tools.performance_stats.record('/translate', 12.0, request_bytes=50, response_bytes=100)
+    mock_language_tools.performance_stats.record('/translate', 300.0, request_bytes=50, response_bytes=0, error=True)
+
+    stats = mock_language_tools.get_performance_stats()
+    assert stats['endpoints']['text_processing']['count'] == 1
+    translate_stats = stats['endpoints']['/translate']
+    assert translate_stats['count'] == 2
+    assert translate_stats['error_count'] == 1
+    assert translate_stats['request_bytes'] == 100
+    assert translate_stats['response_bytes'] == 100
+    # percentiles are approximated by histogram bucket upper bounds
+    assert translate_stats['p50_ms'] == 16
+    assert translate_stats['p99_ms'] == 300.0
+    assert translate_stats['histogram'] == {'<=16ms': 1, '<=512ms': 1}
+
+    dialog = dialog_performancestats.prepare_performance_stats_dialog(mock_language_tools)
+    assert dialog.stats_table.rowCount() == 2
+    assert dialog.stats_table.item(0, 0).text() == '/translate'
+    assert dialog.stats_table.item(0, 2).text() == '1'
+
+    # export
+    filename = str(tmp_path / 'stats.json')
+    dialog.export_json_file(filename)
+    with open(filename, 'r') as f:
+        exported_stats = json.load(f)
+    assert exported_stats['endpoints']['/translate']['count'] == 2
+
+    # reset
+    qtbot.mouseClick(dialog.reset_button, PyQt5.QtCore.Qt.LeftButton)
+    assert dialog.stats_table.rowCount() == 0
+    assert mock_language_tools.get_performance_stats()['endpoints'] == {}
@@ -1,5 +1,8 @@
+import constants
 import testing_utils
 import editor_processing
+import audio_prefetch
+import errors
 
 def test_process_choosetranslation(qtbot):
     # pytest test_editor.py -rPP -k test_process_choosetranslation
@@ -82,11 +85,14 @@ def test_editor_translation(qtbot):
 
     # empty input
     # -----------
+    mock_language_tools.anki_utils.hide_loading_indicator_called = None
     field_value = '' # empty
     bridge_str = f'key:{field_index}:{note_id}:{field_value}'
     editor_manager.process_field_update(editor, bridge_str)
 
     # verify outputs
+    # a request still in flight got cancelled, its loading indicator must go away
+    assert mock_language_tools.anki_utils.hide_loading_indicator_called == True
     assert len(mock_language_tools.anki_utils.editor_set_field_value_calls) == 2
     assert mock_language_tools.anki_utils.editor_set_field_value_calls[1]['field_index'] == 1
     assert mock_language_tools.anki_utils.editor_set_field_value_calls[1]['text'] == ''
@@ -153,4 +159,279 @@ def test_editor_audio(qtbot):
 
     assert len(mock_language_tools.anki_utils.editor_set_field_value_calls) == 1
     assert mock_language_tools.anki_utils.editor_set_field_value_calls[0]['field_index'] == 2 # sound
-    assert '.mp3' in mock_language_tools.anki_utils.editor_set_field_value_calls[0]['text']
\ No newline at end of file
+    assert '.mp3' in mock_language_tools.anki_utils.editor_set_field_value_calls[0]['text']
+
+def test_editor_field_options_cache(qtbot):
+    # pytest test_editor.py -rPP -k test_editor_field_options_cache
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('batch_translation')
+
+    get_model_calls = []
+    get_model = mock_language_tools.anki_utils.get_model
+    def counting_get_model(model_id):
+        get_model_calls.append(model_id)
+        return get_model(model_id)
+    mock_language_tools.anki_utils.get_model = counting_get_model
+
+    editor_manager = editor_processing.EditorManager(mock_language_tools)
+
+    editor = config_gen.get_mock_editor_with_note(config_gen.note_id_1)
+    assert editor_manager.get_field_options(editor) == ['language', 'translation', 'sound', 'regular']
+    model_call_count = len(get_model_calls)
+    assert model_call_count > 0
+
+    # switching to another note with the same deck / note type doesn't recompute anything
+    editor = config_gen.get_mock_editor_with_note(config_gen.note_id_2)
+    assert editor_manager.get_field_options(editor) == ['language', 'translation', 'sound', 'regular']
+    assert len(get_model_calls) == model_call_count
+
+    # config change invalidates
+    dntf = mock_language_tools.deck_utils.build_deck_note_type_field(config_gen.deck_id, config_gen.model_id, config_gen.field_english)
+    mock_language_tools.remove_translation_setting(dntf)
+    assert editor_manager.get_field_options(editor) == ['language', 'regular', 'sound', 'regular']
+
+    # note type change invalidates
+    model_call_count = len(get_model_calls)
+    mock_language_tools.clear_metadata_cache()
+    assert editor_manager.get_field_options(editor) == ['language', 'regular', 'sound', 'regular']
+    assert len(get_model_calls) > model_call_count
+
+    # after a sync, a field got renamed
+    model_call_count = len(get_model_calls)
+    model = mock_language_tools.anki_utils.get_model(config_gen.model_id)
+    model['flds'][1]['name'] = 'English Renamed'
+    mock_language_tools.clear_collection_caches()
+    assert editor_manager.get_field_options(editor) == ['language', 'regular', 'sound', 'regular']
+    assert len(get_model_calls) > model_call_count
+    assert mock_language_tools.deck_utils.get_model_metadata(config_gen.model_id).field_names[1] == 'English Renamed'
+    assert mock_language_tools.populated_deckid_modelid_pairs == None
+
+def test_editor_audio_prefetch(qtbot):
+    # pytest test_editor.py -rPP -k test_editor_audio_prefetch
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('batch_translation')
+
+    requested_texts = []
+    get_tts_audio = mock_language_tools.cloud_language_tools.get_tts_audio
+    def recording_get_tts_audio(api_key, source_text, service, language_code, voice_key, options):
+        requested_texts.append(source_text)
+        return get_tts_audio(api_key, source_text, service, language_code, voice_key, options)
+    mock_language_tools.cloud_language_tools.get_tts_audio = recording_get_tts_audio
+
+    editor_manager = editor_processing.EditorManager(mock_language_tools)
+    editor = config_gen.get_mock_editor_with_note(config_gen.note_id_1)
+
+    # disabled by default
+    editor_manager.prefetch_editor_audio(editor)
+    assert mock_language_tools.audio_prefetcher == None
+
+    # only the chinese field has a voice
+    mock_language_tools.set_audio_prefetch_enabled(True)
+    editor_manager.prefetch_editor_audio(editor)
+    mock_language_tools.audio_prefetcher.wait()
+    assert requested_texts == ['老人家']
+    assert mock_language_tools.is_tts_audio_cached('老人家', 'Azure', config_gen.chinese_voice_key, {})
+    assert mock_language_tools.anki_utils.run_in_background_priorities[-1] == constants.TaskPriority.prefetch
+
+    # already cached
+    editor_manager.prefetch_editor_audio(editor)
+    mock_language_tools.audio_prefetcher.wait()
+    assert requested_texts == ['老人家']
+
+    # next notes in the browser
+    editor_manager.prefetch_browser_audio(editor, [(config_gen.note_id_2, config_gen.deck_id)])
+    mock_language_tools.audio_prefetcher.wait()
+    assert requested_texts == ['老人家', '你好']
+    assert mock_language_tools.performance_stats.counters['audio_prefetch.done'] == 2
+
+    # requests for a previous note are dropped
+    audio_prefetcher = audio_prefetch.AudioPrefetcher(mock_language_tools, character_budget=5)
+    voice = mock_language_tools.get_voice_selection_settings()['zh_cn']
+    cancellation_token = audio_prefetcher.cancellation_token
+    audio_prefetcher.new_generation()
+    audio_prefetcher.prefetch_task(('再见', 'voice'), cancellation_token, '再见', voice)
+    assert mock_language_tools.performance_stats.counters['audio_prefetch.cancelled'] == 1
+
+    # budget
+    audio_prefetcher.prefetch('再见', voice)
+    audio_prefetcher.prefetch('老人家老人家', voice)
+    audio_prefetcher.wait()
+    assert requested_texts == ['老人家', '你好', '再见']
+    assert mock_language_tools.performance_stats.counters['audio_prefetch.over_budget'] == 1
+    assert audio_prefetcher.characters_used == 2
+
+    # fields with nothing to speak aren't queued
+    audio_prefetcher.prefetch('&nbsp;<img src="image.jpg">', voice)
+    assert audio_prefetcher.pending == {}
+    # the budget is charged with the processed text
+    audio_prefetcher.prefetch('<b>你</b>', voice)
+    audio_prefetcher.wait()
+    assert requested_texts == ['老人家', '你好', '再见', '你']
+    assert audio_prefetcher.characters_used == 3
+
+    # an error about the text itself doesn't stop prefetching
+    def unsupported_get_tts_audio(api_key, source_text, service, language_code, voice_key, options):
+        raise errors.AudioLanguageToolsRequestError('text not supported', status_code=400)
+    mock_language_tools.cloud_language_tools.get_tts_audio = unsupported_get_tts_audio
+    audio_prefetcher.prefetch('好', voice)
+    audio_prefetcher.wait()
+    assert audio_prefetcher.suspended == False
+
+    # quota errors suspend prefetching until the next budget window
+    def failing_get_tts_audio(api_key, source_text, service, language_code, voice_key, options):
+        raise errors.AudioLanguageToolsRequestError('quota exceeded', status_code=429)
+    mock_language_tools.cloud_language_tools.get_tts_audio = failing_get_tts_audio
+    audio_prefetcher.prefetch('谢谢', voice)
+    audio_prefetcher.wait()
+    assert audio_prefetcher.suspended == True
+    assert audio_prefetcher.reserve_budget(1) == False
+    audio_prefetcher.budget_window_start -= audio_prefetcher.budget_window_seconds + 1
+    assert audio_prefetcher.reserve_budget(1) == True
+
+def test_editor_audio_prefetch_browser(qtbot, monkeypatch):
+    # pytest test_editor.py -rPP -k test_editor_audio_prefetch_browser
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('batch_translation')
+    mock_language_tools.set_audio_prefetch_enabled(True)
+
+    requested_texts = []
+    get_tts_audio = mock_language_tools.cloud_language_tools.get_tts_audio
+    def recording_get_tts_audio(api_key, source_text, service, language_code, voice_key, options):
+        requested_texts.append(source_text)
+        return get_tts_audio(api_key, source_text, service, language_code, voice_key, options)
+    mock_language_tools.cloud_language_tools.get_tts_audio = recording_get_tts_audio
+
+    # prefetch tasks stay queued, like behind a busy scheduler
+    queued_tasks = []
+    def queueing_run_in_background(task_fn, task_done_fn, priority=constants.TaskPriority.interactive, cancellation_token=None):
+        queued_tasks.append((task_fn, cancellation_token))
+        return cancellation_token
+    monkeypatch.setattr(mock_language_tools.anki_utils, 'run_in_background', queueing_run_in_background)
+
+    editor_manager = editor_processing.EditorManager(mock_language_tools)
+    editor = config_gen.get_mock_editor_with_note(config_gen.note_id_1)
+
+    # anki reports the browser row change first, then the note loaded in the browser's editor
+    editor_manager.prefetch_browser_audio(editor, [(config_gen.note_id_2, config_gen.deck_id)])
+    editor_manager.prefetch_editor_audio(editor, new_generation=False)
+    for task_fn, cancellation_token in queued_tasks:
+        if not cancellation_token.cancelled:
+            task_fn()
+    # the next note's request wasn't cancelled, the current note's fields were only requested once
+    assert requested_texts == ['老人家', '你好']
+
+    # the language mapping changed to a language without a voice, the field options computed above are stale
+    queued_tasks.clear()
+    dntf = mock_language_tools.deck_utils.build_dntf_from_dnt(mock_language_tools.deck_utils.build_deck_note_type(config_gen.deck_id, config_gen.model_id), config_gen.field_chinese)
+    mock_language_tools.store_language_detection_result(dntf, 'mg')
+    editor_manager.prefetch_browser_audio(editor, [(config_gen.note_id_2, config_gen.deck_id)])
+    assert queued_tasks == []
+
+def test_editor_keystroke_benchmark(qtbot):
+    # pytest test_editor.py -rPP -k test_editor_keystroke_benchmark
+    import time
+    import copy
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('batch_translation')
+    mock_language_tools.cloud_language_tools.translation_map = {
+        '老人0': 'old people 0',
+        '老人1': 'old people 1'
+    }
+
+    # anki deserializes the note type / deck from the backend on every lookup
+    get_model = mock_language_tools.anki_utils.get_model
+    get_deck = mock_language_tools.anki_utils.get_deck
+    mock_language_tools.anki_utils.get_model = lambda model_id: copy.deepcopy(get_model(model_id))
+    mock_language_tools.anki_utils.get_deck = lambda deck_id: copy.deepcopy(get_deck(deck_id))
+
+    editor = config_gen.get_mock_editor_with_note(config_gen.note_id_1)
+    editor_manager = editor_processing.EditorManager(mock_language_tools)
+    keystroke_count = 2000
+
+    def run_keystrokes(clear_cache):
+        start_time = time.time()
+        for i in range(keystroke_count):
+            if clear_cache:
+                mock_language_tools.deck_utils.clear_metadata_cache()
+            editor_manager.process_field_update(editor, f'key:0:{config_gen.note_id_1}:老人{i % 2}')
+        return (time.time() - start_time) / keystroke_count * 1000000
+
+    uncached_us = run_keystrokes(True)
+    cached_us = run_keystrokes(False)
+
+    assert len(mock_language_tools.anki_utils.editor_set_field_value_calls) == keystroke_count * 2
+    print(f'per keystroke overhead: uncached metadata: {uncached_us:.1f}us cached metadata: {cached_us:.1f}us')
+
+def test_editor_field_debounce(qtbot, monkeypatch):
+    # pytest test_editor.py -rPP -k test_editor_field_debounce
+    import constants
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('batch_translation')
+    mock_language_tools.cloud_language_tools.translation_map = {
+        '老人': 'old people (short)'
+    }
+
+    # timers fire when the test says so
+    armed_timers = {}
+    def call_on_timer_expire(timer, task):
+        armed_timers[id(timer)] = (timer, task)
+    def stop_timer(timer):
+        armed_timers.pop(id(timer), None)
+    mock_language_tools.anki_utils.call_on_timer_expire = call_on_timer_expire
+    mock_language_tools.anki_utils.stop_timer = stop_timer
+
+    current_time = [1000.0]
+    monkeypatch.setattr(editor_processing.time, 'time', lambda: current_time[0])
+
+    editor = config_gen.get_mock_editor_with_note(config_gen.note_id_1)
+    editor_manager = editor_processing.EditorManager(mock_language_tools)
+    max_delay_ms = constants.LIVE_UPDATE_DELAY_DEFAULT_MS
+    chinese_dntf = mock_language_tools.deck_utils.editor_get_dntf(editor, 0)
+    english_dntf = mock_language_tools.deck_utils.editor_get_dntf(editor, 1)
+
+    # nothing known about the field yet
+    editor_manager.process_field_update(editor, f'key:0:{config_gen.note_id_1}:老')
+    chinese_timer = editor_manager.field_change_timers[chinese_dntf]
+    assert chinese_timer.delay_ms == max_delay_ms
+    assert len(mock_language_tools.anki_utils.editor_set_field_value_calls) == 0
+
+    # fast typing shortens the delay, down to the minimum
+    for i in range(5):
+        current_time[0] += 0.15
+        editor_manager.process_field_update(editor, f'key:0:{config_gen.note_id_1}:老{i}')
+    assert round(chinese_timer.typing_interval_ms) == 150
+    assert chinese_timer.delay_ms == constants.LIVE_UPDATE_MIN_DELAY_MS
+
+    # slow service, waiting a bit longer saves requests
+    editor_manager.record_service_latency(1000)
+    current_time[0] += 0.15
+    editor_manager.process_field_update(editor, f'key:0:{config_gen.note_id_1}:老人人')
+    assert chinese_timer.delay_ms == 725
+
+    # a long pause doesn't count as typing cadence
+    current_time[0] += 60
+    editor_manager.process_field_update(editor, f'key:0:{config_gen.note_id_1}:老人人人')
+    assert round(chinese_timer.typing_interval_ms) == 150
+
+    # typing in another field doesn't restart this field's timer
+    editor_manager.process_field_update(editor, f'key:1:{config_gen.note_id_1}:old')
+    assert editor_manager.field_change_timers[english_dntf] is not chinese_timer
+    assert armed_timers[id(chinese_timer)][0].delay_ms == 725
+    assert len(armed_timers) == 2
+
+    # leaving the field applies the update without waiting for the timer
+    editor_manager.process_field_blur(editor, f'blur:0:{config_gen.note_id_1}:老人')
+    assert id(chinese_timer) not in armed_timers
+    assert chinese_dntf not in editor_manager.buffered_field_changes
+    assert len(mock_language_tools.anki_utils.editor_set_field_value_calls) == 1
+    assert mock_language_tools.anki_utils.editor_set_field_value_calls[0]['text'] == 'old people (short)'
+
+    # the other field's update is still pending, its timer fires
+    timer, task = armed_timers[id(editor_manager.field_change_timers[english_dntf])]
+    task()
+    assert english_dntf not in editor_manager.buffered_field_changes
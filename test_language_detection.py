@@ -0,0 +1,54 @@
+import language_detection
+
+AVAILABLE_LANGUAGES = ['en', 'fr', 'de', 'es', 'zh_cn', 'ja', 'ko', 'th', 'hi']
+
+def test_detect_script(qtbot):
+    # pytest test_language_detection.py -rPP -k test_detect_script
+    detector = language_detection.LocalLanguageDetector()
+
+    def detect(texts):
+        return detector.detect(texts, AVAILABLE_LANGUAGES)
+
+    result = detect(['안녕하세요', '감사합니다'])
+    assert result.decided == True
+    assert result.language == 'ko'
+    assert detect(['ありがとう', '日本語を勉強しています']).language == 'ja'
+    assert detect(['สวัสดีครับ', 'ขอบคุณ']).language == 'th'
+    assert detect(['नमस्ते', 'धन्यवाद']).language == 'hi'
+
+    # numbers, punctuation only
+    result = detect(['123', '4.5', '(1)'])
+    assert result.decided == True
+    assert result.language == None
+
+    # han alone could be chinese, japanese, cantonese
+    assert detect(['老人家', '你好']).decided == False
+    # mixed scripts
+    assert detect(['hello 你好', '老人家 old people']).decided == False
+    # greek isn't an available language
+    assert detect(['καλημέρα', 'ευχαριστώ']).decided == False
+
+def test_detect_latin(qtbot):
+    # pytest test_language_detection.py -rPP -k test_detect_latin
+    detector = language_detection.LocalLanguageDetector()
+
+    def detect(texts):
+        return detector.detect(texts, AVAILABLE_LANGUAGES)
+
+    english = ['I would like to buy a ticket to the city', 'She has been working here for three years', 'What time does the train leave tomorrow morning?']
+    french = ['Je voudrais acheter un billet pour la ville', 'Elle travaille ici depuis trois ans', 'À quelle heure part le train demain matin ?']
+    german = ['Ich möchte eine Fahrkarte in die Stadt kaufen', 'Sie arbeitet seit drei Jahren hier', 'Wann fährt der Zug morgen früh ab?']
+    spanish = ['Me gustaría comprar un billete para la ciudad', 'Ella trabaja aquí desde hace tres años', '¿A qué hora sale el tren mañana por la mañana?']
+    assert detect(english).language == 'en'
+    assert detect(french).language == 'fr'
+    assert detect(german).language == 'de'
+    assert detect(spanish).language == 'es'
+
+    # too little text
+    assert detect(['old people', 'hello']).decided == False
+    # languages the trigram model doesn't know about go to the cloud
+    assert detect(['Saya ingin membeli tiket ke kota', 'Dia sudah bekerja di sini selama tiga tahun', 'Jam berapa kereta berangkat besok pagi?']).decided == False
+    assert detect(['Jag skulle vilja köpa en biljett till staden', 'Hon har arbetat här i tre år', 'När går tåget i morgon bitti?']).decided == False
+    assert detect(['wǒ xiǎng mǎi yī zhāng piào', 'tā zài zhè lǐ gōng zuò sān nián le', 'míng tiān zǎo shang huǒ chē jǐ diǎn kāi', 'jīn tiān tiān qì hěn hǎo']).decided == False
+    # detected, but not an available language
+    assert detector.detect(english, ['fr']).decided == False
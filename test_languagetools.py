@@ -1,5 +1,16 @@
 import json
+import pytest
+import os
+import time
+import threading
+import tracemalloc
 import testing_utils
+import constants
+import languagetools
+import errors
+import deck_utils
+import audio_utils
+import media_batch
 
 class EmptyFieldConfigGenerator(testing_utils.TestConfigGenerator):
     def __init__(self):
@@ -64,6 +75,39 @@ def test_generate_audio_for_field(qtbot):
     assert mock_language_tools.anki_utils.added_media_file != None
     assert 'languagetools-' in mock_language_tools.anki_utils.added_media_file
 
+    # bulk run
+    # ========
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    registration_batch = media_batch.MediaRegistrationBatch(mock_language_tools, group_size=2)
+
+    result = mock_language_tools.generate_audio_for_field(note_id, from_field, to_field, voice, media_batch=registration_batch)
+    assert result == True
+    note = config_gen.notes_by_id[config_gen.note_id_1]
+    # registered and saved with the rest of the group
+    assert config_gen.field_sound not in note.set_values
+    assert mock_language_tools.anki_utils.media_add_files_calls == []
+
+    result = mock_language_tools.generate_audio_for_field(config_gen.note_id_2, from_field, to_field, voice, media_batch=registration_batch)
+    assert result == True
+    assert 'sound:languagetools-' in note.set_values[config_gen.field_sound]
+    assert len(mock_language_tools.anki_utils.media_add_files_calls) == 1
+    assert len(mock_language_tools.anki_utils.media_add_files_calls[0]) == 2
+    assert mock_language_tools.anki_utils.update_notes_calls == [[note, config_gen.notes_by_id[config_gen.note_id_2]]]
+    assert note.flush_called == False
+    assert mock_language_tools.anki_utils.added_media_file == None
+
+    # slow bulk run, the group gets saved once the flush interval has elapsed
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    registration_batch = media_batch.MediaRegistrationBatch(mock_language_tools, group_size=50, flush_interval_seconds=10)
+    registration_batch.last_flush_time -= 11
+    result = mock_language_tools.generate_audio_for_field(note_id, from_field, to_field, voice, media_batch=registration_batch)
+    assert result == True
+    assert len(mock_language_tools.anki_utils.media_add_files_calls) == 1
+    assert mock_language_tools.anki_utils.update_notes_calls == [[config_gen.notes_by_id[config_gen.note_id_1]]]
+
     # empty field
     # ===========
 
@@ -117,6 +161,95 @@ def test_get_tts_audio(qtbot):
     assert data['voice_key'] == {'name': 'voice1'}
     assert data['options'] == {}
 
+def test_get_tts_audio_write_failure(qtbot, monkeypatch):
+    # pytest test_languagetools.py -k test_get_tts_audio_write_failure
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    def replace(source, destination):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'replace', replace)
+
+    filename = mock_language_tools.get_audio_filename('write failure', 'Azure', {'name': 'voice1'}, {})
+    with pytest.raises(OSError):
+        mock_language_tools.get_tts_audio('write failure', 'Azure', 'en_US', {'name': 'voice1'}, {})
+    # no partial file left in the user files directory
+    assert not os.path.isfile(filename)
+    assert [f for f in os.listdir(os.path.dirname(filename)) if f.endswith('.tmp')] == []
+
+def test_get_tts_audio_long_text(qtbot):
+    # pytest test_languagetools.py -rPP -k test_get_tts_audio_long_text
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    # one mpeg 1 layer III frame per request, carrying the length of the text
+    latency_s = 0.2
+    requested_texts = []
+    def get_tts_audio(api_key, source_text, service, language_code, voice_key, options):
+        requested_texts.append(source_text)
+        time.sleep(latency_s)
+        return b'\xff\xfb\x90\x00' + bytes([len(source_text)]) * 413
+    mock_language_tools.cloud_language_tools.get_tts_audio = get_tts_audio
+
+    sentences = [f'This is sentence number {i} of a long reading passage, with a few extra words.' for i in range(8)]
+    source_text = ' '.join(sentences)
+    assert len(source_text) >= constants.TTS_LONG_TEXT_MIN_LENGTH
+
+    start_time = time.time()
+    filename = mock_language_tools.get_tts_audio(source_text, 'Azure', 'en_US', {'name': 'voice1'}, {})
+    elapsed_s = time.time() - start_time
+    chunks = audio_utils.chunk_text(source_text, constants.TTS_CHUNK_MIN_SENTENCE_LENGTH)
+    chunk_count = len(chunks)
+    assert chunk_count >= 3
+    assert ' '.join(chunks) == source_text
+    assert sorted(requested_texts) == sorted(chunks)
+    # chunks are synthesized concurrently
+    assert elapsed_s < latency_s * chunk_count * 0.75
+    print(f'{chunk_count} chunks, {elapsed_s:.3f}s')
+
+    with open(filename, 'rb') as f:
+        audio_content = f.read()
+    assert len(audio_content) == 417 * chunk_count
+    # chunks are joined in order
+    assert [audio_content[i * 417 + 4] for i in range(chunk_count)] == [len(chunk) for chunk in chunks]
+
+    # editing a sentence in the middle, the other chunks keep their cache keys
+    chunk_filenames = [mock_language_tools.get_audio_filename(chunk, 'Azure', {'name': 'voice1'}, {}) for chunk in chunks]
+    requested_texts.clear()
+    sentences[3] = 'The sentence in the middle was edited, it is now a bit longer than it was.'
+    edited_chunks = audio_utils.chunk_text(' '.join(sentences), constants.TTS_CHUNK_MIN_SENTENCE_LENGTH)
+    edited_chunk_filenames = [mock_language_tools.get_audio_filename(chunk, 'Azure', {'name': 'voice1'}, {}) for chunk in edited_chunks]
+    assert [i for i, (a, b) in enumerate(zip(chunk_filenames, edited_chunk_filenames)) if a != b] == [3]
+    mock_language_tools.get_tts_audio(' '.join(sentences), 'Azure', 'en_US', {'name': 'voice1'}, {})
+    assert requested_texts == [sentences[3]]
+
+    # only the edited chunk gets synthesized again
+    requested_texts.clear()
+    sentences[-1] = 'The last sentence was edited.'
+    mock_language_tools.get_tts_audio(' '.join(sentences), 'Azure', 'en_US', {'name': 'voice1'}, {})
+    assert len(requested_texts) == 1
+    assert requested_texts[0].endswith('The last sentence was edited.')
+
+    # short texts are sent in one request
+    requested_texts.clear()
+    mock_language_tools.get_tts_audio(sentences[0], 'Azure', 'en_US', {'name': 'voice1'}, {})
+    assert requested_texts == [sentences[0]]
+
+def test_get_tts_voice_list(qtbot):
+    # pytest test_languagetools.py -rPP -k test_get_tts_voice_list
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    voice_list = mock_language_tools.get_tts_voice_list()
+    assert mock_language_tools.get_tts_voice_list() == voice_list
+    assert mock_language_tools.performance_stats.counters['voice_list.miss'] == 1
+    assert mock_language_tools.performance_stats.counters['voice_list.hit'] == 1
+
+    # expired
+    mock_language_tools.voice_list_time -= constants.VOICE_LIST_TTL_SECONDS
+    mock_language_tools.get_tts_voice_list()
+    assert mock_language_tools.performance_stats.counters['voice_list.miss'] == 2
 
 def test_get_translation(qtbot):
     # pytest test_languagetools.py -k test_get_translation
@@ -144,4 +277,443 @@ def test_get_transliteration(qtbot):
     }
 
     transliterated_text = mock_language_tools.get_transliteration(source_text, {'transliteration_key': 'de to en'})
-    assert transliterated_text == 'ˈʊntɐ ˈɛtvas'
\ No newline at end of file
+    assert transliterated_text == 'ˈʊntɐ ˈɛtvas'
+
+def test_initialize_api_key_validation_cache(qtbot):
+    # pytest test_languagetools.py -k test_initialize_api_key_validation_cache
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    # language lists are available after initialization
+    assert mock_language_tools.initialization_future.done()
+    assert mock_language_tools.get_language_name('zh_cn') == 'Chinese'
+
+    cache_filename = mock_language_tools.get_api_key_validation_cache_filename()
+    if os.path.isfile(cache_filename):
+        os.remove(cache_filename)
+
+    # no cached result, the server gets queried
+    mock_cloudlanguagetools = mock_language_tools.cloud_language_tools
+    mock_language_tools = languagetools.LanguageTools(mock_language_tools.anki_utils, mock_language_tools.deck_utils, mock_cloudlanguagetools)
+    mock_language_tools.initialize()
+    assert mock_cloudlanguagetools.verify_api_key_called == True
+    assert mock_language_tools.api_key_checked == True
+    assert os.path.isfile(cache_filename)
+    with open(cache_filename, 'r') as f:
+        assert 'yoyo' not in f.read()
+
+    # validation result is cached
+    mock_cloudlanguagetools.verify_api_key_called = False
+    mock_language_tools = languagetools.LanguageTools(mock_language_tools.anki_utils, mock_language_tools.deck_utils, mock_cloudlanguagetools)
+    mock_language_tools.initialize()
+    assert mock_cloudlanguagetools.verify_api_key_called == False
+    assert mock_language_tools.api_key_checked == True
+
+    # expired entries get validated again
+    api_key_hash = mock_language_tools.get_api_key_hash('yoyo')
+    with open(cache_filename, 'w') as f:
+        json.dump({api_key_hash: time.time() - constants.API_KEY_VALIDATION_TTL_SECONDS - 1}, f)
+    mock_cloudlanguagetools.verify_api_key_is_valid = False
+    mock_language_tools = languagetools.LanguageTools(mock_language_tools.anki_utils, mock_language_tools.deck_utils, mock_cloudlanguagetools)
+    mock_language_tools.initialize()
+    assert mock_cloudlanguagetools.verify_api_key_called == True
+    assert mock_language_tools.api_key_checked == False
+
+    os.remove(cache_filename)
+
+def test_wait_for_initialization(qtbot):
+    # pytest test_languagetools.py -k test_wait_for_initialization
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    # language lists requested before background initialization ran
+    mock_language_tools = languagetools.LanguageTools(mock_language_tools.anki_utils, mock_language_tools.deck_utils, mock_language_tools.cloud_language_tools)
+    assert mock_language_tools.initDone == False
+    assert mock_language_tools.get_all_languages()['mg'] == 'Malagasy'
+    assert mock_language_tools.initDone == True
+
+def test_wait_for_initialization_not_ready(qtbot, monkeypatch):
+    # pytest test_languagetools.py -k test_wait_for_initialization_not_ready
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    mock_language_tools = languagetools.LanguageTools(mock_language_tools.anki_utils, mock_language_tools.deck_utils, mock_language_tools.cloud_language_tools)
+
+    # background tasks don't run until released
+    background_tasks = []
+    monkeypatch.setattr(mock_language_tools.anki_utils, 'run_in_background', lambda task_fn, task_done_fn, **kwargs: background_tasks.append(task_fn))
+
+    # the main thread doesn't wait, and doesn't initialize by itself
+    with pytest.raises(errors.LanguageToolsNotReadyError):
+        mock_language_tools.get_all_languages()
+    assert len(background_tasks) == 1
+    # already in progress
+    with pytest.raises(errors.LanguageToolsNotReadyError):
+        mock_language_tools.get_all_languages()
+    assert len(background_tasks) == 1
+
+    # the first attempt fails, the next call retries in the background
+    def failing_get_language_list():
+        raise errors.LanguageToolsRequestError('network down')
+    mock_language_tools.cloud_language_tools.get_language_list = failing_get_language_list
+    with pytest.raises(errors.LanguageToolsRequestError):
+        background_tasks.pop()()
+    with pytest.raises(errors.LanguageToolsNotReadyError):
+        mock_language_tools.get_all_languages()
+    assert len(background_tasks) == 1
+
+    del mock_language_tools.cloud_language_tools.get_language_list
+    background_tasks.pop()()
+    assert mock_language_tools.get_all_languages()['mg'] == 'Malagasy'
+
+def test_wait_for_initialization_concurrent(qtbot, monkeypatch):
+    # pytest test_languagetools.py -k test_wait_for_initialization_concurrent
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    mock_language_tools = languagetools.LanguageTools(mock_language_tools.anki_utils, mock_language_tools.deck_utils, mock_language_tools.cloud_language_tools)
+
+    background_tasks = []
+    monkeypatch.setattr(mock_language_tools.anki_utils, 'run_in_background', lambda task_fn, task_done_fn, **kwargs: background_tasks.append(task_fn))
+    monkeypatch.setattr(constants, 'INITIALIZATION_TIMEOUT_SECONDS', 0.05)
+
+    # several background callers at once start a single initialization
+    def wait():
+        with pytest.raises(errors.LanguageToolsNotReadyError):
+            mock_language_tools.wait_for_initialization()
+    threads = [threading.Thread(target=wait) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(background_tasks) == 1
+
+    # ui entry points tell the user instead of raising
+    assert mock_language_tools.run_when_ready(mock_language_tools.get_all_languages) == None
+    assert 'still retrieving' in mock_language_tools.anki_utils.tooltip_message_received
+
+    background_tasks.pop()()
+    assert mock_language_tools.run_when_ready(mock_language_tools.get_all_languages)['mg'] == 'Malagasy'
+
+def test_audio_cache_key_normalization(qtbot):
+    # pytest test_languagetools.py -k test_audio_cache_key_normalization
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    voice_key = {'name': 'voice1'}
+    filename = mock_language_tools.get_audio_filename('Café', 'Azure', voice_key, {})
+    assert mock_language_tools.get_audio_filename('Cafe\u0301', 'Azure', voice_key, {}) == filename
+    assert mock_language_tools.get_audio_filename('Café\u200b ', 'Azure', voice_key, {}) == filename
+    assert mock_language_tools.get_audio_filename('Cafe', 'Azure', voice_key, {}) != filename
+    # a literal &lt; typed by the user (already decoded from &amp;lt;) isn't the same text as <
+    assert mock_language_tools.get_audio_filename('&lt;', 'Azure', voice_key, {}) != mock_language_tools.get_audio_filename('<', 'Azure', voice_key, {})
+
+    report = mock_language_tools.measure_text_normalization(config_gen.get_note_id_list())
+    assert report[config_gen.field_chinese]['collapsed_count'] == 0
+
+
+def test_interned_deck_note_type_field(qtbot):
+    # pytest test_languagetools.py -rPP -k test_interned_deck_note_type_field
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    utils = mock_language_tools.deck_utils
+
+    dnt_1 = utils.build_deck_note_type(config_gen.deck_id, config_gen.model_id)
+    dnt_2 = utils.build_deck_note_type(config_gen.deck_id, config_gen.model_id)
+    assert dnt_1 is dnt_2
+    dntf_1 = utils.build_deck_note_type_field(config_gen.deck_id, config_gen.model_id, config_gen.field_chinese)
+    dntf_2 = utils.build_dntf_from_dnt(dnt_1, config_gen.field_chinese)
+    assert dntf_1 is dntf_2
+    assert dntf_1 is utils.get_dntf_from_fieldindex(dnt_2, 0)
+    assert dntf_1 != utils.build_dntf_from_dnt(dnt_1, config_gen.field_english)
+
+    # instances built outside of DeckUtils still compare / hash equal
+    dnt_3 = deck_utils.DeckNoteType(config_gen.deck_id, config_gen.deck_name, config_gen.model_id, config_gen.model_name)
+    dntf_3 = deck_utils.DeckNoteTypeField(dnt_3, config_gen.field_chinese)
+    assert dnt_3 is not dnt_1
+    assert dnt_3 == dnt_1
+    assert dntf_3 == dntf_1
+    assert {dntf_1: 'zh_cn'}[dntf_3] == 'zh_cn'
+
+    # renamed deck / note type get new instances
+    utils.clear_metadata_cache()
+    assert utils.build_deck_note_type(config_gen.deck_id, config_gen.model_id) is not dnt_1
+
+class PlainDeckNoteType():
+    # reference: DNT as a regular class, hashing / comparing tuples
+    def __init__(self, deck_id, deck_name, model_id, model_name):
+        self.deck_id = deck_id
+        self.deck_name = deck_name
+        self.model_id = model_id
+        self.model_name = model_name
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self.deck_id == other.deck_id and self.model_id == other.model_id
+        return False
+    def __hash__(self):
+        return hash((self.deck_id, self.model_id))
+
+class PlainDeckNoteTypeField():
+    def __init__(self, deck_note_type, field_name):
+        self.deck_note_type = deck_note_type
+        self.field_name = field_name
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self.deck_note_type == other.deck_note_type and self.field_name == other.field_name
+        return False
+    def __hash__(self):
+        return hash((self.deck_note_type, self.field_name))
+
+def test_deck_note_type_field_benchmark(qtbot):
+    # pytest test_languagetools.py -rPP -k test_deck_note_type_field_benchmark
+    dnt_count = 10000
+    field_names = [f'Field {i}' for i in range(10)]
+    models = {model_id: {'name': f'model {model_id}', 'flds': [{'name': field_name} for field_name in field_names]} for model_id in range(dnt_count)}
+    decks = {1: {'name': 'deck'}}
+
+    class BenchmarkAnkiUtils():
+        def get_model(self, model_id):
+            return models[model_id]
+        def get_deck(self, deck_id):
+            return decks[deck_id]
+
+    def build_plain():
+        return [PlainDeckNoteTypeField(PlainDeckNoteType(1, 'deck', model_id, f'model {model_id}'), field_name) for model_id in range(dnt_count) for field_name in field_names]
+
+    def build_interned(utils):
+        result = []
+        for model_id in range(dnt_count):
+            deck_note_type = utils.build_deck_note_type(1, model_id)
+            for field_name in field_names:
+                result.append(utils.build_dntf_from_dnt(deck_note_type, field_name))
+        return result
+
+    def measure(build_fn):
+        tracemalloc.start()
+        start_time = time.time()
+        dntf_list = build_fn()
+        build_time = time.time() - start_time
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # typical usage: config lookups and sets keyed by DNTF
+        start_time = time.time()
+        dntf_map = {dntf: True for dntf in dntf_list}
+        found = sum(1 for dntf in dntf_list if dntf in dntf_map)
+        lookup_time = time.time() - start_time
+        assert found == len(dntf_list) == dnt_count * len(field_names)
+        return dntf_list, build_time, memory, lookup_time
+
+    plain_list, plain_build, plain_memory, plain_lookup = measure(build_plain)
+    utils = deck_utils.DeckUtils(BenchmarkAnkiUtils())
+    interned_list, interned_build, interned_memory, interned_lookup = measure(lambda: build_interned(utils))
+    # a second pass reuses the interned instances
+    second_list = build_interned(utils)
+    assert all(a is b for a, b in zip(interned_list, second_list))
+
+    print(f'{len(plain_list)} DNTFs, plain: {plain_memory / 1048576:.1f}MB build {plain_build:.3f}s lookup {plain_lookup:.3f}s '
+          f'interned: {interned_memory / 1048576:.1f}MB build {interned_build:.3f}s lookup {interned_lookup:.3f}s')
+
+def test_media_registration_batch_benchmark(qtbot, tmp_path):
+    # pytest test_languagetools.py -rPP -k test_media_registration_batch_benchmark
+    clip_count = 10000
+    distinct_clip_count = 1000
+    user_files_dir = tmp_path / 'user_files'
+    user_files_dir.mkdir()
+    generated_filenames = []
+    for i in range(distinct_clip_count):
+        path = user_files_dir / f'languagetools-{i}.mp3'
+        path.write_bytes(bytes([i % 256]) * 4096)
+        generated_filenames.append(str(path))
+
+    class BenchmarkAnkiUtils():
+        # registers files the way anki's media manager does when a file can't be linked: a copy per call
+        def __init__(self, media_dir):
+            self.media_dir = media_dir
+            self.media_dir.mkdir()
+            self.update_notes_calls = 0
+        def media_add_file(self, filename):
+            media_filename = os.path.basename(filename)
+            with open(filename, 'rb') as source_file, open(self.media_dir / media_filename, 'wb') as media_file:
+                media_file.write(source_file.read())
+            return media_filename
+        def media_add_files(self, filenames):
+            # same registration path as AnkiUtils.media_add_files
+            return audio_utils.register_media_files(filenames, str(self.media_dir), self.media_add_file)
+        def update_notes(self, notes):
+            self.update_notes_calls += 1
+
+    class BenchmarkNote(dict):
+        def __init__(self):
+            self.flush_count = 0
+        def flush(self):
+            self.flush_count += 1
+
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+
+    # one clip at a time: register, write the sound tag, flush the note
+    mock_language_tools.anki_utils = BenchmarkAnkiUtils(tmp_path / 'media_single')
+    single_notes = [BenchmarkNote() for i in range(clip_count)]
+    start_time = time.time()
+    for i, note in enumerate(single_notes):
+        media_filename = mock_language_tools.anki_utils.media_add_file(generated_filenames[i % distinct_clip_count])
+        note['Sound'] = f'[sound:{media_filename}]'
+        note.flush()
+    single_time = time.time() - start_time
+
+    # grouped
+    mock_language_tools.anki_utils = BenchmarkAnkiUtils(tmp_path / 'media_batch')
+    batch_notes = [BenchmarkNote() for i in range(clip_count)]
+    registration_batch = media_batch.MediaRegistrationBatch(mock_language_tools)
+    start_time = time.time()
+    for i, note in enumerate(batch_notes):
+        registration_batch.add_audio(note, 'Sound', generated_filenames[i % distinct_clip_count])
+        registration_batch.add_note(note)
+    registration_batch.flush()
+    batch_time = time.time() - start_time
+
+    assert [dict(note) for note in batch_notes] == [dict(note) for note in single_notes]
+    assert registration_batch.registered_count == clip_count
+    assert registration_batch.saved_note_count == clip_count
+    assert mock_language_tools.anki_utils.update_notes_calls == clip_count / constants.MEDIA_REGISTRATION_GROUP_SIZE
+    assert sum([note.flush_count for note in batch_notes]) == 0
+    # each distinct clip is stored once, shared with user_files
+    assert len(os.listdir(tmp_path / 'media_batch')) == distinct_clip_count
+    assert os.stat(generated_filenames[0]).st_nlink == 2
+
+    print(f'{clip_count} clips, one at a time: {single_time:.3f}s, in groups of {constants.MEDIA_REGISTRATION_GROUP_SIZE}: {batch_time:.3f}s')
+
+def test_populated_set_cache(qtbot):
+    # pytest test_languagetools.py -rPP -k test_populated_set_cache
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    anki_utils = mock_language_tools.anki_utils
+
+    dntf_list = mock_language_tools.get_populated_dntf()
+    assert len(dntf_list) == len(config_gen.all_fields)
+    assert mock_language_tools.get_populated_dntf() == dntf_list
+    assert anki_utils.get_deckid_modelid_pairs_calls == 1
+
+    # a note got added to another deck
+    other_deck_id = 42002
+    anki_utils.decks[other_deck_id] = {'name': 'deck 2'}
+    anki_utils.deckid_modelid_pairs.append([other_deck_id, config_gen.model_id])
+    anki_utils.modified_deckid_modelid_pairs = [[other_deck_id, config_gen.model_id]]
+    mock_language_tools.populated_set_changed()
+    assert mock_language_tools.get_populated_deckid_modelid_pairs() == [(config_gen.deck_id, config_gen.model_id), (other_deck_id, config_gen.model_id)]
+
+    # all the notes in the original deck got deleted
+    anki_utils.deckid_modelid_pairs.remove([config_gen.deck_id, config_gen.model_id])
+    anki_utils.modified_deckid_modelid_pairs = []
+    mock_language_tools.populated_set_changed()
+    assert mock_language_tools.get_populated_deckid_modelid_pairs() == [(other_deck_id, config_gen.model_id)]
+    assert anki_utils.get_deckid_modelid_pairs_calls == 1
+
+    # collection reloaded
+    mock_language_tools.clear_populated_set()
+    assert mock_language_tools.get_populated_deckid_modelid_pairs() == [(other_deck_id, config_gen.model_id)]
+    assert anki_utils.get_deckid_modelid_pairs_calls == 2
+
+def test_language_detection_cache(qtbot):
+    # pytest test_languagetools.py -rPP -k test_language_detection_cache
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    anki_utils = mock_language_tools.anki_utils
+    mock_cloudlanguagetools = mock_language_tools.cloud_language_tools
+
+    cache_filename = mock_language_tools.get_language_detection_cache_filename()
+    if os.path.isfile(cache_filename):
+        os.remove(cache_filename)
+
+    dntf = mock_language_tools.deck_utils.build_dntf_from_dnt(mock_language_tools.get_populated_dntf()[0].deck_note_type, config_gen.field_english)
+    assert mock_language_tools.detect_field_language(dntf) == ('en', constants.LanguageDetectionMethod.cloud)
+    assert mock_cloudlanguagetools.language_detection_calls == 1
+    mock_language_tools.save_language_detection_cache()
+
+    # unchanged notes, the result is persisted across restarts
+    mock_language_tools = languagetools.LanguageTools(anki_utils, mock_language_tools.deck_utils, mock_cloudlanguagetools)
+    assert mock_language_tools.detect_field_language(dntf) == ('en', constants.LanguageDetectionMethod.cached)
+    assert mock_cloudlanguagetools.language_detection_calls == 1
+
+    # a note got edited
+    anki_utils.notes_modified_time = 1
+    assert mock_language_tools.detect_field_language(dntf) == ('en', constants.LanguageDetectionMethod.cloud)
+    assert mock_cloudlanguagetools.language_detection_calls == 2
+    assert mock_language_tools.detect_field_language(dntf) == ('en', constants.LanguageDetectionMethod.cached)
+
+    # cloud failures aren't cached
+    anki_utils.notes_modified_time = 2
+    mock_cloudlanguagetools.language_detection_result = {}
+    mock_cloudlanguagetools.language_detection = lambda api_key, field_sample: None
+    assert mock_language_tools.detect_field_language(dntf) == (None, constants.LanguageDetectionMethod.cloud)
+    assert mock_language_tools.detect_field_language(dntf) == (None, constants.LanguageDetectionMethod.cloud)
+
+    os.remove(cache_filename)
+
+def test_language_detection_shared_note_type(qtbot):
+    # pytest test_languagetools.py -rPP -k test_language_detection_shared_note_type
+    config_gen = testing_utils.TestConfigGenerator()
+    mock_language_tools = config_gen.build_languagetools_instance('default')
+    anki_utils = mock_language_tools.anki_utils
+    mock_cloudlanguagetools = mock_language_tools.cloud_language_tools
+
+    cache_filename = mock_language_tools.get_language_detection_cache_filename()
+    if os.path.isfile(cache_filename):
+        os.remove(cache_filename)
+
+    # the note type is spread over 20 decks, the last one has japanese in the english field
+    deck_count = 20
+    original_notes = list(anki_utils.notes_by_id.values())
+    anki_utils.notes[config_gen.deck_id][config_gen.model_id] = {note.id: note for note in original_notes}
+    for i in range(1, deck_count):
+        deck_id = config_gen.deck_id + i
+        anki_utils.decks[deck_id] = {'name': f'deck {i + 1}'}
+        anki_utils.deckid_modelid_pairs.append([deck_id, config_gen.model_id])
+        anki_utils.notes[deck_id] = {config_gen.model_id: {}}
+        for original_note in original_notes:
+            note_id = original_note.id + i
+            field_values = {field_name: original_note[field_name] for field_name in config_gen.all_fields}
+            if i == deck_count - 1:
+                field_values[config_gen.field_english] = 'こんにちは'
+            note = testing_utils.MockNote(note_id, config_gen.model_id, field_values, config_gen.all_fields)
+            anki_utils.notes[deck_id][config_gen.model_id][note_id] = note
+            anki_utils.notes_by_id[note_id] = note
+    mock_cloudlanguagetools.language_detection_result['こんにちは'] = 'ja'
+
+    dntf_list = mock_language_tools.get_populated_dntf()
+    assert len(dntf_list) == deck_count * len(config_gen.all_fields)
+
+    signature_queries = []
+    get_deck_note_type_signature = anki_utils.get_deck_note_type_signature
+    def recording_get_deck_note_type_signature(deck_id, model_id):
+        signature_queries.append((deck_id, model_id))
+        return get_deck_note_type_signature(deck_id, model_id)
+    anki_utils.get_deck_note_type_signature = recording_get_deck_note_type_signature
+
+    results = list(mock_language_tools.detect_field_languages(dntf_list))
+    assert len(results) == len(dntf_list)
+    # one signature query per deck / note type, not per field
+    assert len(signature_queries) == deck_count
+    languages = {(dntf.deck_note_type.deck_id, dntf.field_name): language for dntf, language, detection_method in results}
+    for i in range(deck_count - 1):
+        assert languages[(config_gen.deck_id + i, config_gen.field_chinese)] == 'zh_cn'
+        assert languages[(config_gen.deck_id + i, config_gen.field_english)] == 'en'
+        assert languages[(config_gen.deck_id + i, config_gen.field_sound)] == None
+    assert languages[(config_gen.deck_id + deck_count - 1, config_gen.field_chinese)] == 'zh_cn'
+    assert languages[(config_gen.deck_id + deck_count - 1, config_gen.field_english)] == 'ja'
+
+    # one request for each field with content, plus the deck which doesn't look like the others
+    assert mock_cloudlanguagetools.language_detection_calls == 3
+    detection_methods = [detection_method for dntf, language, detection_method in results]
+    assert detection_methods.count(constants.LanguageDetectionMethod.cloud) == 3
+    assert detection_methods.count(constants.LanguageDetectionMethod.shared) == len(dntf_list) - 3 - 2
+
+    # per deck results got cached
+    mock_language_tools.save_language_detection_cache()
+    results = list(mock_language_tools.detect_field_languages(dntf_list))
+    assert [detection_method for dntf, language, detection_method in results] == [constants.LanguageDetectionMethod.cached] * len(dntf_list)
+    assert mock_cloudlanguagetools.language_detection_calls == 3
+
+    os.remove(cache_filename)
@@ -0,0 +1,138 @@
+import threading
+import time
+import constants
+import perf_stats
+import task_scheduler
+
+def build_scheduler(max_running):
+    performance_stats = perf_stats.PerformanceStats()
+    # done callbacks run right away on the worker thread, there is no main thread here
+    scheduler = task_scheduler.TaskScheduler(lambda fn: fn(), performance_stats, max_running=max_running)
+    return scheduler, performance_stats
+
+def test_interactive_not_blocked_by_batch(qtbot):
+    # pytest test_task_scheduler.py -rPP -k test_interactive_not_blocked_by_batch
+    scheduler, performance_stats = build_scheduler({
+        constants.TaskPriority.interactive: 1,
+        constants.TaskPriority.prefetch: 1,
+        constants.TaskPriority.batch: 1
+    })
+
+    release_batch = threading.Event()
+    batch_done = []
+    for i in range(4):
+        scheduler.submit(lambda: release_batch.wait(5), lambda future: batch_done.append(future.result()), priority=constants.TaskPriority.batch)
+    assert scheduler.get_running_counts()['batch'] == 1
+    assert scheduler.get_queue_depths()['batch'] == 3
+
+    interactive_done = threading.Event()
+    scheduler.submit(lambda: 'translation', lambda future: interactive_done.set())
+    # runs while the batch tasks are still waiting
+    assert interactive_done.wait(5)
+    assert len(batch_done) == 0
+
+    release_batch.set()
+    deadline = time.time() + 5
+    while len(batch_done) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert batch_done == [True] * 4
+
+    stats = performance_stats.get_stats()
+    assert stats['counters']['scheduler.batch.max_queue_depth'] == 3
+    assert stats['endpoints']['scheduler_wait:batch']['count'] == 4
+    assert stats['endpoints']['scheduler_wait:interactive']['count'] == 1
+    assert stats['endpoints']['scheduler_run:interactive']['count'] == 1
+
+def test_max_running(qtbot):
+    # pytest test_task_scheduler.py -rPP -k test_max_running
+    scheduler, performance_stats = build_scheduler({
+        constants.TaskPriority.interactive: 2,
+        constants.TaskPriority.prefetch: 1,
+        constants.TaskPriority.batch: 1
+    })
+
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+    def task():
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    done = []
+    for i in range(6):
+        scheduler.submit(task, lambda future: done.append(True))
+    deadline = time.time() + 5
+    while len(done) < 6 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(done) == 6
+    assert max_running[0] == 2
+
+def test_cancellation(qtbot):
+    # pytest test_task_scheduler.py -rPP -k test_cancellation
+    scheduler, performance_stats = build_scheduler({
+        constants.TaskPriority.interactive: 1,
+        constants.TaskPriority.prefetch: 1,
+        constants.TaskPriority.batch: 1
+    })
+
+    release = threading.Event()
+    started = []
+    done = []
+    running_token = scheduler.submit(lambda: started.append('running') or release.wait(5), lambda future: done.append('running'), priority=constants.TaskPriority.prefetch)
+    queued_token = task_scheduler.CancellationToken()
+    scheduler.submit(lambda: started.append('queued'), lambda future: done.append('queued'), priority=constants.TaskPriority.prefetch, cancellation_token=queued_token)
+
+    # a queued task doesn't start, a running task completes without calling back
+    queued_token.cancel()
+    running_token.cancel()
+    release.set()
+
+    final_done = threading.Event()
+    scheduler.submit(lambda: None, lambda future: final_done.set(), priority=constants.TaskPriority.prefetch)
+    assert final_done.wait(5)
+    assert started == ['running']
+    assert done == []
+    assert performance_stats.get_stats()['counters']['scheduler.prefetch.cancelled'] == 2
+
+def test_map_in_task_class(qtbot):
+    # pytest test_task_scheduler.py -rPP -k test_map_in_task_class
+    scheduler, performance_stats = build_scheduler({
+        constants.TaskPriority.interactive: 4,
+        constants.TaskPriority.prefetch: 1,
+        constants.TaskPriority.batch: 2
+    })
+
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+    def chunk(item):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return item * 2
+
+    # a batch task fanning out uses the free batch slot, never more than the batch limit
+    done = []
+    for i in range(2):
+        scheduler.submit(lambda: scheduler.map_in_task_class(chunk, list(range(8)), 4), lambda future: done.append(future.result()), priority=constants.TaskPriority.batch)
+    deadline = time.time() + 5
+    while len(done) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert done == [[item * 2 for item in range(8)]] * 2
+    assert max_running[0] <= 2
+    assert scheduler.get_running_counts()['batch'] == 0
+
+    # a single task gets the free slots of its class
+    max_running[0] = 0
+    done_event = threading.Event()
+    scheduler.submit(lambda: scheduler.map_in_task_class(chunk, list(range(8)), 4), lambda future: done_event.set(), priority=constants.TaskPriority.interactive)
+    assert done_event.wait(5)
+    assert max_running[0] == 4
+    assert scheduler.get_running_counts()['interactive'] == 0
@@ -1,5 +1,7 @@
+import time
 import text_utils
 import constants
+import anki.utils
 
 def test_is_empty(qtbot):
     utils = text_utils.TextUtils({})
@@ -118,4 +120,393 @@ def test_replacement_simple(qtbot):
     assert text_replacement.to_dict() == expected_dict
 
     text_replacement2 = text_utils.TextReplacement(expected_dict)
-    assert text_replacement2.process('yoyo)', constants.TransformationType.Audio) == 'rep'
\ No newline at end of file
+    assert text_replacement2.process('yoyo)', constants.TransformationType.Audio) == 'rep'
+
+def test_replacement_pattern_edited(qtbot):
+    text_replacement = text_utils.TextReplacement({
+        'pattern': 'a+',
+        'replace': 'b'
+    })
+    assert text_replacement.process('caat', constants.TransformationType.Audio) == 'cbt'
+    # the compiled regex must follow edits
+    text_replacement.pattern = 'c'
+    assert text_replacement.process('caat', constants.TransformationType.Audio) == 'baat'
+
+def build_benchmark_replacements(count):
+    replacements = []
+    for i in range(count):
+        transformation_types = {
+            'Audio': i % 2 == 0,
+            'Translation': i % 3 != 0,
+            'Transliteration': True
+        }
+        if i % 3 == 0:
+            replacement = {'pattern': f' / word{i} ', 'replace': ' ', 'replace_type': 'simple'}
+        else:
+            replacement = {'pattern': r'\(etw\s*\+' + str(i) + r'\)', 'replace': f'etwas {i}', 'replace_type': 'regex'}
+        replacement.update(transformation_types)
+        replacements.append(replacement)
+    return replacements
+
+def test_process_benchmark(qtbot):
+    # pytest test_text_utils.py -rPP -k test_process_benchmark
+    import time
+    import re
+    import anki.utils
+
+    replacements = build_benchmark_replacements(30)
+    utils = text_utils.TextUtils({'replacements': replacements})
+    texts = [f'<b>unter</b> (etw +{i % 40}) / word{i % 30} text {i}' for i in range(10000)]
+
+    def process_reference(text, transformation_type):
+        # dispatch on every call, like the original implementation
+        result = anki.utils.htmlToTextLine(text)
+        for replacement in replacements:
+            if replacement[transformation_type.name]:
+                if replacement['replace_type'] == 'regex':
+                    result = re.sub(replacement['pattern'], replacement['replace'], result)
+                else:
+                    result = result.replace(replacement['pattern'], replacement['replace'])
+        return result
+
+    for transformation_type in constants.TransformationType:
+        start_time = time.time()
+        expected = [process_reference(text, transformation_type) for text in texts]
+        reference_time = time.time() - start_time
+
+        start_time = time.time()
+        actual = [utils.process(text, transformation_type) for text in texts]
+        compiled_time = time.time() - start_time
+
+        assert actual == expected
+        print(f'{transformation_type.name}: {len(texts)} texts, {len(replacements)} rules, reference: {reference_time:.3f}s compiled: {compiled_time:.3f}s')
+
+def process_sequential_reference(replacements, text, transformation_type):
+    result = text
+    for replacement in replacements:
+        if replacement[transformation_type.name]:
+            result = result.replace(replacement['pattern'], replacement['replace'])
+    return result
+
+def test_multi_pattern_replacement_property(qtbot, monkeypatch):
+    # pytest test_text_utils.py -rPP -k test_multi_pattern_replacement_property
+    import random
+    # group as aggressively as possible
+    monkeypatch.setattr(constants, 'MULTI_PATTERN_MIN_GROUP_SIZE', 2)
+
+    rand = random.Random(42)
+    # small alphabet, so that patterns frequently overlap and replacements create new matches
+    alphabet = 'abcd[]. '
+    def random_string(min_length, max_length):
+        return ''.join(rand.choice(alphabet) for i in range(rand.randint(min_length, max_length)))
+
+    grouped_count = 0
+    grouped_deletion_count = 0
+    for iteration in range(600):
+        # the second half is mostly stripping rules, with short patterns so that deletions can be grouped
+        deletion_heavy = iteration >= 300
+        replacements = []
+        for i in range(rand.randint(1, 12)):
+            replacements.append({
+                'pattern': random_string(1, 2) if deletion_heavy else random_string(1, 4),
+                'replace': '' if deletion_heavy and rand.random() < 0.6 else random_string(0, 3),
+                'replace_type': 'simple',
+                'Audio': rand.random() < 0.8,
+                'Translation': True,
+                'Transliteration': True
+            })
+        utils = text_utils.TextUtils({'replacements': replacements})
+        groups = [x for x in utils.replacement_chains[constants.TransformationType.Audio] if 'simple replacements' in x[0]]
+        grouped_count += len(groups)
+        grouped_deletion_count += len([x for x in groups if '' in x[1].__self__.replacement_map.values()])
+        for text_index in range(20):
+            # no html special characters, so that htmlToTextLine leaves the text alone, except stripping
+            text = random_string(0, 30).strip()
+            for transformation_type in constants.TransformationType:
+                expected = process_sequential_reference(replacements, text, transformation_type)
+                assert utils.process(text, transformation_type) == expected, f'{replacements} {text}'
+    # make sure the single pass path got exercised, also with deletions
+    assert grouped_count > 50
+    assert grouped_deletion_count > 20
+
+    # deleting text can join the text around it into a new match of a later pattern, such a rule isn't grouped
+    replacements = [
+        {'pattern': 'b', 'replace': '', 'replace_type': 'simple', 'Audio': True, 'Translation': True, 'Transliteration': True},
+        {'pattern': 'ac', 'replace': 'x', 'replace_type': 'simple', 'Audio': True, 'Translation': True, 'Transliteration': True},
+        {'pattern': 'd', 'replace': '', 'replace_type': 'simple', 'Audio': True, 'Translation': True, 'Transliteration': True},
+        {'pattern': 'e', 'replace': 'y', 'replace_type': 'simple', 'Audio': True, 'Translation': True, 'Transliteration': True},
+    ]
+    utils = text_utils.TextUtils({'replacements': replacements})
+    assert [x[0] for x in utils.replacement_chains[constants.TransformationType.Audio]] == ['b / ', '3 simple replacements']
+    assert utils.process('abc dde', constants.TransformationType.Audio) == 'x y'
+
+def benchmark_replacements(replacements, rule_kind, texts):
+    start_time = time.time()
+    utils = text_utils.TextUtils({'replacements': replacements})
+    build_time = time.time() - start_time
+    assert len(utils.replacement_chains[constants.TransformationType.Audio]) == 1
+
+    start_time = time.time()
+    actual = [utils.process(text, constants.TransformationType.Audio) for text in texts]
+    single_pass_time = time.time() - start_time
+
+    start_time = time.time()
+    expected = [process_sequential_reference(replacements, anki.utils.htmlToTextLine(text), constants.TransformationType.Audio) for text in texts]
+    sequential_time = time.time() - start_time
+
+    assert actual == expected
+    print(f'{len(replacements)} {rule_kind} rules, {len(texts)} texts: build {build_time:.3f}s, single pass {single_pass_time:.3f}s, sequential {sequential_time:.3f}s')
+
+def test_multi_pattern_replacement_benchmark(qtbot):
+    # pytest test_text_utils.py -rPP -k test_multi_pattern_replacement_benchmark
+    import random
+
+    rand = random.Random(1)
+    texts = [' '.join(rand.choice(['hello', 'world', f'{{{rand.randrange(1000):04d}}}', 'furigana[ふり]', chr(0x4e00 + rand.randrange(1000))]) for i in range(12)) for j in range(2000)]
+    for rule_count in [10, 100, 1000]:
+        for rule_kind in ['replacement', 'stripping']:
+            if rule_kind == 'replacement':
+                replacements = [{'pattern': f'{{{i:04d}}}', 'replace': 'x' * (i % 5 + 1), 'replace_type': 'simple', 'Audio': True} for i in range(rule_count)]
+            else:
+                # deletions of single characters, after one multi character deletion
+                replacements = [{'pattern': '[ふり]', 'replace': '', 'replace_type': 'simple', 'Audio': True}] + \
+                    [{'pattern': chr(0x4e00 + i), 'replace': '', 'replace_type': 'simple', 'Audio': True} for i in range(rule_count - 1)]
+            benchmark_replacements(replacements, rule_kind, texts)
+
+def test_html_to_text_cache(qtbot):
+    # pytest test_text_utils.py -k test_html_to_text_cache
+    import perf_stats
+    performance_stats = perf_stats.PerformanceStats()
+    cache = text_utils.HtmlToTextCache(2, performance_stats)
+    utils = text_utils.TextUtils({}, cache)
+
+    assert utils.is_empty('<b>hello</b>') == False
+    assert utils.process('<b>hello</b>', constants.TransformationType.Audio) == 'hello'
+    assert performance_stats.get_stats()['counters'] == {'html_to_text_cache.hit': 1, 'html_to_text_cache.miss': 1}
+    assert performance_stats.get_stats()['hit_rates'] == {'html_to_text_cache': 0.5}
+
+    # separate namespace when stripping images
+    assert cache.html_to_text('<img src="a.jpg">hello') == 'a.jpg hello'
+    assert cache.html_to_text_without_images('<img src="a.jpg">hello') == 'hello'
+
+    # bounded, least recently used entry gets evicted
+    assert len(cache.entries) == 2
+    assert '<b>hello</b>' not in cache.entries
+
+HTML_TEST_CASES = [
+    '',
+    'hello world',
+    '  hello  ',
+    '<b>hello</b> world',
+    '<span style="color: var(--field-fg); background: var(--field-bg);">&nbsp;gerund</span>',
+    'line1<br>line2<br />line3<BR>line4',
+    '<div>one</div><div>two</div><DIV>three</DIV><div class="x">four</div>',
+    'first\nsecond',
+    '<ruby>漢<rt>かん</rt>字<rt>じ</rt></ruby>',
+    '<img src="image.jpg"> caption',
+    "<IMG SRC='image.png' width=100/>",
+    '<img alt="no source">text',
+    'word [sound:languagetools-1234.mp3]',
+    '[[type:Front]] answer',
+    '&lt;b&gt; &amp; &quot;quoted&quot; &#20320;&#x597D; &bogus; &#xZZ;',
+    '<!-- comment <b>bold</b> --> visible',
+    '<style>.card { color: red; }</style>styled',
+    '<SCRIPT type="text/javascript">alert(1)</SCRIPT>scripted',
+    'unclosed < tag',
+    'a <b',
+    '<span><span><span>nested</span></span></span>',
+    '<a href="https://example.com/?a=1&amp;b=2">link</a>',
+    '[sound:a.mp3][sound:b.mp3]',
+    '[not a sound tag]',
+    # overlapping markup, depends on the order of the passes
+    '<script>a<!--</script>-->b',
+    '<style><!-- .x { color: red; } --></style>after',
+    '<style>a<!--</style>b-->c',
+    '<!--<style>-->x</style>y',
+    '<!-- <script> -->x</script>y',
+    '<script>x<style></script>y</style>z',
+    '<style>x<script></style>y</script>z',
+    '<b <!-- x --> >c',
+    '<img src="a<!--.jpg"> x -->y',
+    # sound tags are removed before type tags
+    '[[type:x[sound:a]]',
+    '[[ty[sound:x]pe:y]]',
+]
+
+def test_html_to_text_line(qtbot):
+    # pytest test_text_utils.py -k test_html_to_text_line
+    for html in HTML_TEST_CASES:
+        assert text_utils.html_to_text_line(html) == anki.utils.htmlToTextLine(html), html
+
+def test_html_to_text_line_differential(qtbot):
+    # pytest test_text_utils.py -k test_html_to_text_line_differential
+    import random
+    fragments = ['<b>', '</b>', '<span style="color: red">', '</span>', '<ruby>', '<rt>', '</rt>', '</ruby>',
+        '<img src="a.jpg">', '<img src=b.png width="10">', '&nbsp;', '&amp;', '&#20320;', '&gt;', '&unknown;',
+        '[sound:x.mp3]', '[[type:Back]]', '<br>', '<br />', '<BR>', '<div>', '</div>', '\n', ' ', 'text', '你好',
+        '<!-- comment -->', '<style>.a{}</style>', '<script>x()</script>', '(etw +D)', ' / ', 'Übung']
+    rand = random.Random(7)
+    for i in range(5000):
+        html = ''.join(rand.choice(fragments) for j in range(rand.randint(0, 15)))
+        assert text_utils.html_to_text_line(html) == anki.utils.htmlToTextLine(html), html
+
+def test_html_to_text_line_overlapping_differential(qtbot):
+    # pytest test_text_utils.py -k test_html_to_text_line_overlapping_differential
+    # fragments of markup which can combine into overlapping tokens
+    import random
+    fragments = ['<', '>', '<b', '</b>', '<br>', '<br />', '<div>', '<!--', '-->', '<style>', '</style>', '<STYLE x>',
+        '<script>', '</SCRIPT>', '<img src="', '<img src=', '"', '.jpg', '[sound:', '[[type:', ']', ']]', '[',
+        '&am', 'p;', '&nbsp;', '&#', '20320;', '\n', ' ', 'a', '你']
+    rand = random.Random(11)
+    for i in range(20000):
+        html = ''.join(rand.choice(fragments) for j in range(rand.randint(0, 12)))
+        assert text_utils.html_to_text_line(html) == anki.utils.htmlToTextLine(html), html
+
+def test_html_to_text_line_benchmark(qtbot):
+    # pytest test_text_utils.py -rPP -k test_html_to_text_line_benchmark
+    import random
+    import time
+    rand = random.Random(3)
+    templates = [
+        'simple plain text {i}',
+        '<b>bold {i}</b> and <i>italic</i>',
+        '<span style="color: rgb(0, 0, 0);">例文 {i}</span><br><span style="font-size: 12px;">translation&nbsp;{i}</span>',
+        '<ruby>漢<rt>かん</rt></ruby><ruby>字<rt>じ</rt></ruby> {i} <img src="paste-{i}.jpg">',
+        '<div><div><span class="a"><span class="b">deeply nested {i}</span></span></div></div>[sound:languagetools-{i}.mp3]',
+    ]
+    corpus = [rand.choice(templates).format(i=i) * rand.randint(1, 4) for i in range(100000)]
+
+    start_time = time.time()
+    expected = [anki.utils.htmlToTextLine(html) for html in corpus]
+    anki_time = time.time() - start_time
+
+    start_time = time.time()
+    actual = [text_utils.html_to_text_line(html) for html in corpus]
+    stripper_time = time.time() - start_time
+
+    assert actual == expected
+    print(f'{len(corpus)} fields, htmlToTextLine: {anki_time:.3f}s html_to_text_line: {stripper_time:.3f}s')
+
+def test_process_many(qtbot):
+    # pytest test_text_utils.py -k test_process_many
+    replacements = build_benchmark_replacements(30)
+    utils = text_utils.TextUtils({'replacements': replacements})
+    texts = [f'<b>unter</b> (etw +{i % 40}) / word{i % 30} text {i % 50}' for i in range(500)]
+
+    for transformation_type in constants.TransformationType:
+        expected = [utils.process(text, transformation_type) for text in texts]
+        assert utils.process_many(texts, transformation_type) == expected
+
+def test_normalize(qtbot):
+    # pytest test_text_utils.py -k test_normalize
+    utils = text_utils.TextUtils({})
+
+    assert utils.normalize('Hello') == 'Hello'
+    assert utils.normalize('Hello ') == 'Hello'
+    assert utils.normalize('Hello\xa0') == 'Hello'
+    assert utils.normalize('Hello&nbsp;') == 'Hello'
+    # entities are only decoded once, by the html stripping
+    assert utils.normalize(utils.process('&amp;lt;b&amp;gt;', constants.TransformationType.Audio)) == '&lt;b&gt;'
+    assert utils.normalize(utils.process('&lt;b&gt;', constants.TransformationType.Audio)) == '<b>'
+    assert utils.normalize('Hello  world') == 'Hello world'
+    assert utils.normalize('Hel\u200blo') == 'Hello'
+    # zero width joiner is meaningful in some scripts
+    assert utils.normalize('क्\u200dष') == 'क्\u200dष'
+    # NFD -> NFC
+    assert utils.normalize('Cafe\u0301') == 'Café'
+
+    # configurable
+    utils = text_utils.TextUtils({'normalization': {
+        'unicode_nfc': False,
+        'collapse_whitespace': False,
+        'remove_zero_width': True,
+        'fold_entities': True
+    }})
+    assert utils.normalize('Cafe\u0301') == 'Cafe\u0301'
+    assert utils.normalize('Hello  world ') == 'Hello  world '
+    assert utils.normalize('Hel\u200blo') == 'Hello'
+
+def test_measure_normalization(qtbot):
+    # pytest test_text_utils.py -k test_measure_normalization
+    utils = text_utils.TextUtils({})
+    texts = ['Hello', 'Hello ', 'Hello&nbsp;', '<b>Hello</b>', 'Café', 'Cafe\u0301', 'Hel\u200blo', 'World']
+    result = utils.measure_normalization(texts, constants.TransformationType.Audio)
+    assert result == {
+        'text_count': 8,
+        'distinct_count': 5, # Hello, Café (NFC), Café (NFD), Hello with zero width space, World
+        'distinct_normalized_count': 3,
+        'collapsed_count': 2
+    }
+
+def test_regex_warning(qtbot):
+    assert text_utils.get_regex_warning(r'\(etw \+D\)') == None
+    assert text_utils.get_regex_warning(r'a+b*') == None
+    assert text_utils.get_regex_warning(r'(ab)+') == None
+    assert text_utils.get_regex_warning(r'(a+)+b') != None
+    assert text_utils.get_regex_warning(r'(?:x|.*)*y') != None
+    assert text_utils.get_regex_warning(r'(a') != None
+
+def test_replacement_blocked_pattern(qtbot):
+    # pytest test_text_utils.py -k test_replacement_blocked_pattern
+    utils = text_utils.TextUtils({'replacements': [
+        {'pattern': '(a+)+b', 'replace': 'c', 'replace_type': 'regex'},
+        {'pattern': 'a', 'replace': 'x', 'replace_type': 'simple'}
+    ]})
+    replacement = utils.replacements[0]
+    assert replacement.is_blocked() == True
+    skipped_counts_before = utils.get_skipped_counts()
+    # the suspicious pattern doesn't run until it's confirmed, other rules still apply
+    assert utils.process('aab', constants.TransformationType.Audio) == 'xxb'
+    assert utils.process('a' * 30, constants.TransformationType.Audio) == 'x' * 30
+    assert replacement.execution_count == 0
+    assert utils.get_skipped_replacements(skipped_counts_before) == [(replacement, 2)]
+    skipped_counts_before = utils.get_skipped_counts()
+    assert utils.get_skipped_replacements(skipped_counts_before) == []
+
+    # confirmed
+    utils = text_utils.TextUtils({'replacements': [
+        {'pattern': '(a+)+b', 'replace': 'c', 'replace_type': 'regex', 'confirmed_pattern': '(a+)+b'},
+        {'pattern': 'a', 'replace': 'x', 'replace_type': 'simple'}
+    ]})
+    assert utils.process('aab', constants.TransformationType.Audio) == 'c'
+    assert utils.get_skipped_replacements() == []
+    assert utils.replacements[0].to_dict()['confirmed_pattern'] == '(a+)+b'
+
+    # the confirmation was for another pattern
+    replacement = text_utils.TextReplacement({'pattern': '(b+)+c', 'replace': 'c', 'replace_type': 'regex', 'confirmed_pattern': '(a+)+b'})
+    assert replacement.is_blocked() == True
+    # patterns which aren't suspicious never need a confirmation
+    replacement = text_utils.TextReplacement({'pattern': 'a+b', 'replace': 'c', 'replace_type': 'regex'})
+    assert replacement.is_blocked() == False
+
+    # profiling stops before the text gets long enough to hang
+    utils = text_utils.TextUtils({'replacements': [
+        {'pattern': '(a+)+b', 'replace': 'c', 'replace_type': 'regex'},
+        {'pattern': 'a', 'replace': 'x', 'replace_type': 'simple'}
+    ]})
+    profile = utils.profile_replacements(['a' * 200, 'aab'])
+    assert profile[0]['warning'].startswith('exceeded time budget')
+    assert profile[1]['warning'] == None
+    assert profile[1]['changed_count'] == 2
+
+def test_replacement_slow_result_kept(qtbot, monkeypatch):
+    # pytest test_text_utils.py -k test_replacement_slow_result_kept
+    # every rule execution takes half a second of cpu time
+    clock = [0.0]
+    def fake_thread_time():
+        clock[0] += 0.5
+        return clock[0]
+    monkeypatch.setattr(time, 'thread_time', fake_thread_time)
+    utils = text_utils.TextUtils({'replacements': [
+        {'pattern': 'a+', 'replace': 'b', 'replace_type': 'regex'}
+    ]})
+    replacement = utils.replacements[0]
+    # the result doesn't depend on how long the rule took, it's always applied
+    for i in range(5):
+        assert utils.process(f'aa {i}', constants.TransformationType.Audio) == f'b {i}'
+        assert utils.process(f'aa {i}', constants.TransformationType.Audio) == f'b {i}'
+    assert replacement.execution_count == 10
+    assert replacement.slow_count == 10
+    assert replacement.skipped_count == 0
+    assert utils.get_slow_replacements() == [replacement]
+    assert utils.get_skipped_replacements() == []
@@ -0,0 +1,92 @@
+import json
+import gzip
+import time
+import pytest
+import transport
+import cloudlanguagetools
+import errors
+
+class FakeServerTransport():
+    # plays the role of the cloud language tools server, so that recording can be tested offline
+    def __init__(self):
+        self.request_count = 0
+
+    def request(self, method, url, json_data=None, headers=None):
+        self.request_count += 1
+        if url.endswith('/language_list'):
+            return transport.TransportResponse(200, json.dumps({'en': 'English', 'zh_cn': 'Chinese'}).encode('utf-8'))
+        if url.endswith('/verify_api_key'):
+            return transport.TransportResponse(200, json.dumps({'key_valid': True, 'msg': 'valid'}).encode('utf-8'))
+        if url.endswith('/audio_v2'):
+            return transport.TransportResponse(200, b'\xff\xfb\x90\x00' + json_data['text'].encode('utf-8'))
+        if url.endswith('/translate'):
+            return transport.TransportResponse(200, json.dumps({'translated_text': json_data['text'].upper()}).encode('utf-8'))
+        return transport.TransportResponse(404, json.dumps({'error': 'not found'}).encode('utf-8'))
+
+def record_cassette(cassette_path):
+    fake_server = FakeServerTransport()
+    recording_transport = transport.RecordingTransport(cassette_path, fake_server)
+    clt = cloudlanguagetools.CloudLanguageTools(recording_transport)
+
+    clt.get_language_list()
+    clt.api_key_validate_query('secret_api_key')
+    clt.get_tts_audio('secret_api_key', '你好', 'Azure', 'zh_CN', {'name': 'voice1'}, {})
+    clt.get_translation('secret_api_key', 'hello', {'service': 'Azure', 'source_language_id': 'en', 'target_language_id': 'fr'})
+
+    assert fake_server.request_count == 4
+    assert recording_transport.recorded_count == 4
+
+def test_record_replay(tmp_path):
+    # pytest test_transport.py -k test_record_replay
+    cassette_path = str(tmp_path / 'cassette.jsonl.gz')
+    record_cassette(cassette_path)
+
+    # api key must not be stored
+    with gzip.open(cassette_path, 'rt', encoding='utf-8') as f:
+        cassette_content = f.read()
+    assert 'secret_api_key' not in cassette_content
+    assert len(cassette_content.splitlines()) == 4
+
+    # replay, against a different server url
+    replay_transport = transport.ReplayTransport(cassette_path)
+    clt = cloudlanguagetools.CloudLanguageTools(replay_transport)
+    clt.base_url = 'http://localhost:5000'
+
+    assert clt.get_language_list() == {'en': 'English', 'zh_cn': 'Chinese'}
+    assert clt.api_key_validate_query('another_api_key')['key_valid'] == True
+    audio_content = clt.get_tts_audio('another_api_key', '你好', 'Azure', 'zh_CN', {'name': 'voice1'}, {})
+    assert audio_content == b'\xff\xfb\x90\x00' + '你好'.encode('utf-8')
+    response = clt.get_translation('another_api_key', 'hello', {'service': 'Azure', 'source_language_id': 'en', 'target_language_id': 'fr'})
+    assert response.status_code == 200
+    assert json.loads(response.content) == {'translated_text': 'HELLO'}
+    assert replay_transport.request_count == 4
+
+    # request which wasn't recorded
+    with pytest.raises(errors.ReplayCassetteMissError):
+        clt.get_tts_audio('another_api_key', '再见', 'Azure', 'zh_CN', {'name': 'voice1'}, {})
+
+def test_replay_latency_errors(tmp_path):
+    # pytest test_transport.py -k test_replay_latency_errors
+    cassette_path = str(tmp_path / 'cassette.jsonl.gz')
+    record_cassette(cassette_path)
+
+    # injected latency
+    clt = cloudlanguagetools.CloudLanguageTools(transport.ReplayTransport(cassette_path, latency_ms=50))
+    start_time = time.time()
+    clt.get_language_list()
+    assert time.time() - start_time >= 0.05
+
+    # injected errors
+    clt = cloudlanguagetools.CloudLanguageTools(transport.ReplayTransport(cassette_path, error_rate=1.0))
+    with pytest.raises(errors.AudioLanguageToolsRequestError):
+        clt.get_tts_audio('api_key', '你好', 'Azure', 'zh_CN', {'name': 'voice1'}, {})
+
+    # same seed, same sequence of errors
+    def error_sequence(seed):
+        replay_transport = transport.ReplayTransport(cassette_path, error_rate=0.5, seed=seed)
+        clt = cloudlanguagetools.CloudLanguageTools(replay_transport)
+        return [clt.get_translation('api_key', 'hello', {'service': 'Azure', 'source_language_id': 'en', 'target_language_id': 'fr'}).status_code for i in range(20)]
+    sequence = error_sequence(42)
+    assert sequence == error_sequence(42)
+    assert 503 in sequence
+    assert 200 in sequence
@@ -1,5 +1,6 @@
 import logging
 import json
+import concurrent.futures
 
 import constants
 import deck_utils
@@ -17,8 +18,14 @@ class MockAnkiUtils():
     def __init__(self, config):
         self.config = config
         self.written_config = None
+        self.get_deckid_modelid_pairs_calls = 0
+        self.notes_modified_time = 0
+        self.modified_deckid_modelid_pairs = []
         self.editor_set_field_value_calls = []
         self.added_media_file = None
+        self.media_add_files_calls = []
+        self.update_notes_calls = []
+        self.run_in_background_priorities = []
         self.show_loading_indicator_called = None
         self.hide_loading_indicator_called = None
 
@@ -28,6 +35,9 @@ class MockAnkiUtils():
     def write_config(self, config):
         self.written_config = config
 
+    def night_mode_enabled(self):
+        return False
+
     def get_green_stylesheet(self):
         return constants.GREEN_STYLESHEET
 
@@ -38,14 +48,25 @@ class MockAnkiUtils():
         self.last_played_sound_tag = text
 
     def get_deckid_modelid_pairs(self):
+        self.get_deckid_modelid_pairs_calls += 1
         return self.deckid_modelid_pairs
 
+    def get_deckid_modelid_pairs_modified_since(self, modified_time):
+        return self.modified_deckid_modelid_pairs
+
+    def deckid_modelid_pair_exists(self, deck_id, model_id):
+        return [deck_id, model_id] in self.deckid_modelid_pairs
+
     def get_noteids_for_deck_note_type(self, deck_id, model_id, sample_size):
 
         note_id_list = self.notes[deck_id][model_id].keys()
 
         return note_id_list
 
+    def get_deck_note_type_signature(self, deck_id, model_id):
+        note_ids = self.notes[deck_id][model_id].keys()
+        return [len(note_ids), self.notes_modified_time, sum(note_ids)]
+
     def get_note_by_id(self, note_id):
         return self.notes_by_id[note_id]
 
@@ -67,10 +88,27 @@ class MockAnkiUtils():
         self.added_media_file = filename
         return filename
 
-    def run_in_background(self, task_fn, task_done_fn):
+    def media_add_files(self, filenames):
+        self.media_add_files_calls.append(filenames)
+        return filenames
+
+    def update_notes(self, notes):
+        self.update_notes_calls.append(notes)
+
+    def run_in_background(self, task_fn, task_done_fn, priority=constants.TaskPriority.interactive, cancellation_token=None):
+        self.run_in_background_priorities.append(priority)
+        if cancellation_token != None and cancellation_token.cancelled:
+            return cancellation_token
         # just run the two tasks immediately
         result = task_fn()
-        task_done_fn(MockFuture(result))
+        if task_done_fn != None:
+            task_done_fn(MockFuture(result))
+        return cancellation_token
+
+    def map_in_task_class(self, fn, items, max_workers):
+        # no priority class limits here
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(fn, items))
 
     def run_on_main(self, task_fn):
         # just run the task immediately
@@ -85,6 +123,9 @@ class MockAnkiUtils():
         # just call the task for now
         task()
 
+    def stop_timer(self, timer_obj):
+        pass
+
     def info_message(self, message, parent):
         logging.info(f'info message: {message}')
         self.info_message_received = message
@@ -93,6 +134,10 @@ class MockAnkiUtils():
         logging.info(f'critical error message: {message}')
         self.critical_message_received = message
 
+    def tooltip_message(self, message):
+        logging.info(f'tooltip message: {message}')
+        self.tooltip_message_received = message
+
     def play_sound(self, filename):
         # load the json inside the file
         with open(filename) as json_file:
@@ -147,6 +192,8 @@ class MockCloudLanguageTools():
 
         self.account_info_called = False
 
+        self.language_detection_calls = 0
+
         # used to simulate translation errors
         self.translation_error_map = {}
 
@@ -308,7 +355,10 @@ class MockCloudLanguageTools():
 
 
     def language_detection(self, api_key, field_sample):
-        return self.language_detection_result[field_sample[0]]
+        self.language_detection_calls += 1
+        # most common language in the sample
+        languages = [self.language_detection_result[x] for x in field_sample]
+        return max(languages, key=languages.count)
 
     def get_tts_audio(self, api_key, source_text, service, language_code, voice_key, options):
         self.requested_audio = {
@@ -351,6 +401,9 @@ class MockNote():
     def __contains__(self, key):
         return key in self.field_dict
 
+    def keys(self):
+        return self.field_dict.keys()
+
     def __getitem__(self, key):
         return self.field_dict[key]
 
@@ -1,13 +1,163 @@
 import sys
 import logging
-import anki.utils
 import re
+import time
+import threading
+import collections
+import functools
+import html.entities
+import unicodedata
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
 
 if hasattr(sys, '_pytest_mode'):
     import constants
 else:
     from . import constants
 
+STRIP_IMAGES_RE = re.compile("(?i)<img[^>]+src=[\"']?([^\"'>]+)[\"']?[^>]*>")
+
+# equivalent of anki.utils.htmlToTextLine. the passes run in the same order (sound, type, images, comments, style,
+# script, tags), so that overlapping markup like <script>a<!--</script>-->b gives the same result, but each pass is
+# skipped when the text can't contain what it's looking for. a single scan tokenizer in python is slower than these
+# regex passes, it runs python code for every tag.
+SOUND_TAG_RE = re.compile(r'\[sound:[^]]+\]')
+TYPE_TAG_RE = re.compile(r'\[\[type:[^]]+\]\]')
+IMAGE_TAG_PREFIX_RE = re.compile('(?i)<img')
+HTML_COMMENT_RE = re.compile('(?s)<!--.*?-->')
+HTML_STYLE_PREFIX_RE = re.compile('(?i)<style')
+HTML_STYLE_RE = re.compile('(?si)<style.*?>.*?</style>')
+HTML_SCRIPT_PREFIX_RE = re.compile('(?i)<script')
+HTML_SCRIPT_RE = re.compile('(?si)<script.*?>.*?</script>')
+HTML_TAG_RE = re.compile('(?s)<.*?>')
+HTML_ENTITY_RE = re.compile(r'&#?\w+;')
+
+# zero width space, word joiner, byte order mark. zero width joiner / non-joiner are kept, they change how
+# some scripts (and emojis) are written.
+ZERO_WIDTH_RE = re.compile('[\u200b\u2060\ufeff]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+def decode_html_entity(match):
+    # same as anki.utils.entsToTxt, unknown or invalid entities are left as is
+    text = match.group(0)
+    if text[:2] == '&#':
+        try:
+            if text[:3] == '&#x':
+                return chr(int(text[3:-1], 16))
+            return chr(int(text[2:-1]))
+        except (ValueError, OverflowError):
+            return text
+    codepoint = html.entities.name2codepoint.get(text[1:-1], None)
+    if codepoint == None:
+        return text
+    return chr(codepoint)
+
+def html_to_text_line(text):
+    has_markup = '<' in text
+    if has_markup:
+        text = text.replace('<br>', ' ').replace('<br />', ' ').replace('<div>', ' ')
+    if '\n' in text:
+        text = text.replace('\n', ' ')
+    if '[' in text:
+        text = SOUND_TAG_RE.sub('', text)
+        if '[[' in text:
+            text = TYPE_TAG_RE.sub('', text)
+    if has_markup:
+        if IMAGE_TAG_PREFIX_RE.search(text) != None:
+            # keep image filenames
+            text = STRIP_IMAGES_RE.sub(' \\1 ', text)
+        if '<!--' in text:
+            text = HTML_COMMENT_RE.sub('', text)
+        if HTML_STYLE_PREFIX_RE.search(text) != None:
+            text = HTML_STYLE_RE.sub('', text)
+        if HTML_SCRIPT_PREFIX_RE.search(text) != None:
+            text = HTML_SCRIPT_RE.sub('', text)
+        text = HTML_TAG_RE.sub('', text)
+    if '&' in text:
+        text = text.replace('&nbsp;', ' ')
+        text = HTML_ENTITY_RE.sub(decode_html_entity, text)
+    return text.strip()
+
+class HtmlToTextCache():
+    # bounded LRU memo of html -> text conversions, keyed by the raw field html.
+    # the same field value typically gets converted several times in a row (is_empty, then process)
+    def __init__(self, max_size, performance_stats=None):
+        self.max_size = max_size
+        self.performance_stats = performance_stats
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, convert_fn):
+        with self.lock:
+            result = self.entries.get(key, None)
+            if result != None:
+                self.entries.move_to_end(key)
+        if result != None:
+            self.record('hit')
+            return result
+        self.record('miss')
+        result = convert_fn()
+        with self.lock:
+            self.entries[key] = result
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return result
+
+    def record(self, event):
+        if self.performance_stats != None:
+            self.performance_stats.increment(f'html_to_text_cache.{event}')
+
+    def html_to_text(self, html):
+        return self.get(html, lambda: html_to_text_line(html))
+
+    def html_to_text_without_images(self, html):
+        # separate namespace, the result differs from html_to_text
+        return self.get(('without_images', html), lambda: html_to_text_line(STRIP_IMAGES_RE.sub('', html)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def contains_unbounded_repeat(items):
+    for item in items:
+        if isinstance(item, sre_parse.SubPattern):
+            item = item.data
+        if isinstance(item, (list, tuple)):
+            if len(item) == 2 and item[0] in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                min_count, max_count, subpattern = item[1]
+                if max_count == sre_parse.MAXREPEAT or max_count > 1:
+                    return True
+            if contains_unbounded_repeat(item):
+                return True
+    return False
+
+def find_nested_quantifier(items):
+    # a repeated group containing another repeat, like (a+)+ or (.*)*, can backtrack exponentially
+    for item in items:
+        if isinstance(item, sre_parse.SubPattern):
+            item = item.data
+        if isinstance(item, (list, tuple)):
+            if len(item) == 2 and item[0] in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                min_count, max_count, subpattern = item[1]
+                if max_count == sre_parse.MAXREPEAT and contains_unbounded_repeat(subpattern):
+                    return True
+            if find_nested_quantifier(item):
+                return True
+    return False
+
+@functools.lru_cache(maxsize=256)
+def get_regex_warning(pattern):
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception as e:
+        return f'invalid regular expression: {e}'
+    if find_nested_quantifier(parsed.data):
+        return 'nested quantifiers, this pattern can be very slow on some inputs'
+    return None
+
 
 def create_text_replacement():
     return TextReplacement({
@@ -26,6 +176,18 @@ class TextReplacement():
         self.transformation_type_map = {}
         for transformation_type in constants.TransformationType:
             self.transformation_type_map[transformation_type] = options.get(transformation_type.name, True)
+        # a regex pattern flagged by get_regex_warning only runs once the user confirmed it, see is_blocked
+        self.confirmed_pattern = options.get('confirmed_pattern', None)
+        # the regex gets compiled on first use, and again if the pattern gets edited
+        self.compiled_key = None
+        self.compiled_processor = None
+        # execution time tracking, reported in the text processing dialog. slow rules still get applied
+        self.execution_count = 0
+        self.execution_time_s = 0.0
+        self.max_execution_time_s = 0.0
+        self.slow_count = 0
+        # texts on which a blocked rule wasn't applied
+        self.skipped_count = 0
 
     def to_dict(self):
         transformation_type_map = {key.name:value for (key, value) in self.transformation_type_map.items()}
@@ -34,39 +196,344 @@ class TextReplacement():
             'replace': self.replace,
             'replace_type': self.replace_type.name
         }
+        if self.confirmed_pattern != None:
+            data['confirmed_pattern'] = self.confirmed_pattern
         data.update(transformation_type_map)
         return data
 
+    def get_processor(self):
+        # returns a function text -> text, or None if this replacement is incomplete or invalid
+        key = (self.pattern, self.replace, self.replace_type)
+        if key == self.compiled_key:
+            return self.compiled_processor
+        self.compiled_key = key
+        self.compiled_processor = None
+        if self.pattern == None or self.replace == None:
+            return None
+        pattern = self.pattern
+        replace = self.replace
+        try:
+            if self.replace_type == constants.ReplaceType.regex:
+                compiled_pattern = re.compile(pattern)
+                # validates the replacement string (group references etc)
+                compiled_pattern.sub(replace, '')
+                self.compiled_processor = functools.partial(compiled_pattern.sub, replace)
+            elif self.replace_type == constants.ReplaceType.simple:
+                self.compiled_processor = lambda text: text.replace(pattern, replace)
+            else:
+                raise Exception(f'unsupported replacement type: {self.replace_type}')
+        except Exception as e:
+            logging.error(f'error while processing regular expression {self.pattern} / {self.replace}: {e}')
+        return self.compiled_processor
+
+    def get_regex_warning(self):
+        if self.replace_type != constants.ReplaceType.regex or self.pattern == None:
+            return None
+        return get_regex_warning(self.pattern)
+
+    def is_blocked(self):
+        # a running regex can't be interrupted, a pattern which can backtrack exponentially would hang text processing.
+        # such patterns don't run until the user confirmed them when saving the text processing settings. this only
+        # depends on the pattern, so a given text always gets the same result.
+        return self.confirmed_pattern != self.pattern and self.get_regex_warning() != None
+
+    def record_execution(self, elapsed_s, text):
+        self.execution_count += 1
+        self.execution_time_s += elapsed_s
+        self.max_execution_time_s = max(self.max_execution_time_s, elapsed_s)
+        if elapsed_s * 1000.0 > constants.TEXT_REPLACEMENT_TIME_BUDGET_MS:
+            self.slow_count += 1
+            logging.warning(f'text replacement {self.pattern} / {self.replace} took {elapsed_s * 1000.0:.0f}ms on a text of length {len(text)}, '
+                f'exceeding the budget of {constants.TEXT_REPLACEMENT_TIME_BUDGET_MS}ms')
+
+    def get_guarded_processor(self):
+        # processor which leaves texts unchanged when the rule is blocked, and otherwise times the rule. the computed
+        # result is always kept, the timing is only reported. cpu time of the current thread is measured, waiting
+        # for the GIL behind other threads doesn't count.
+        processor = self.get_processor()
+        if processor == None:
+            return None
+        if self.is_blocked():
+            def blocked_processor(text):
+                self.skipped_count += 1
+                return text
+            return blocked_processor
+        def guarded_processor(text):
+            start_time = time.thread_time()
+            result = processor(text)
+            self.record_execution(time.thread_time() - start_time, text)
+            return result
+        return guarded_processor
+
     def process(self, text, transformation_type):
         result = text
         if self.transformation_type_map[transformation_type]:
-            if self.pattern != None and self.replace != None:
+            processor = self.get_guarded_processor()
+            if processor != None:
                 try:
-                    if self.replace_type == constants.ReplaceType.regex:
-                        result = re.sub(self.pattern, self.replace, text)
-                    elif self.replace_type == constants.ReplaceType.simple:
-                        result = result.replace(self.pattern,  self.replace)
-                    else:
-                        raise Exception(f'unsupported replacement type: {self.replace_type}')
+                    result = processor(text)
                 except Exception as e:
                     logging.error(f'error while processing regular expression {self.pattern} / {self.replace}: {e}')
         return result
 
+class MultiPatternReplacement():
+    # applies several simple replacements in a single pass over the text. only valid for groups built
+    # by can_join_multi_pattern_group, for which the result is identical to applying them one after the other.
+    def __init__(self, replacements):
+        self.replacement_map = {replacement.pattern: replacement.replace for replacement in replacements}
+        self.regex = re.compile(build_trie_regex(self.replacement_map.keys()))
+        self.replace_match = lambda match: self.replacement_map[match.group(0)]
+
+    def process(self, text):
+        return self.regex.sub(self.replace_match, text)
+
+def build_trie_regex(patterns):
+    # a regex alternation structured as a trie, so that the regex engine doesn't try every pattern at every position.
+    # patterns must not be prefixes of each other.
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+
+    def node_to_regex(node):
+        leaves = []
+        branches = []
+        for char in sorted(node.keys()):
+            child = node[char]
+            if len(child) == 0:
+                leaves.append(re.escape(char))
+            else:
+                branches.append(re.escape(char) + node_to_regex(child))
+        if len(leaves) > 1:
+            branches.append('[' + ''.join(leaves) + ']')
+        else:
+            branches.extend(leaves)
+        if len(branches) == 1:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')'
+
+    return node_to_regex(trie)
+
+class MultiPatternGroupBuilder():
+    # accumulates consecutive simple replacements, as long as applying them in a single pass gives the same result
+    # as applying them sequentially:
+    # - patterns are not empty
+    # - after a deletion (empty replacement), only single character patterns: deleting text joins the text around it,
+    #   a longer pattern applied later could match across that junction
+    # - no occurrence of a pattern can overlap an occurrence of another one (no containment, no prefix/suffix overlap)
+    # - a pattern doesn't contain any character of an earlier replacement (so it can't match inside replaced text)
+    def __init__(self):
+        self.replacements = []
+        self.patterns = set()
+        self.joined_patterns = ''
+        self.pattern_prefixes = set()
+        self.pattern_suffixes = set()
+        self.replacement_chars = set()
+        self.has_deletion = False
+
+    def can_add(self, replacement):
+        if replacement.replace_type != constants.ReplaceType.simple:
+            return False
+        pattern = replacement.pattern
+        if len(pattern) == 0 or '\x00' in pattern:
+            return False
+        if len(self.replacements) == 0:
+            return True
+        if self.has_deletion and len(pattern) > 1:
+            return False
+        if not self.replacement_chars.isdisjoint(pattern):
+            return False
+        # is the pattern contained in an existing pattern
+        if pattern in self.joined_patterns:
+            return False
+        # does the pattern contain an existing pattern
+        pattern_length = len(pattern)
+        for start in range(pattern_length):
+            for end in range(start + 1, pattern_length + 1):
+                if pattern[start:end] in self.patterns:
+                    return False
+        # can the pattern overlap an existing pattern on either side
+        for i in range(1, pattern_length):
+            if pattern[:i] in self.pattern_suffixes or pattern[i:] in self.pattern_prefixes:
+                return False
+        return True
+
+    def add(self, replacement):
+        pattern = replacement.pattern
+        self.replacements.append(replacement)
+        self.patterns.add(pattern)
+        self.joined_patterns += pattern + '\x00'
+        for i in range(1, len(pattern)):
+            self.pattern_prefixes.add(pattern[:i])
+            self.pattern_suffixes.add(pattern[i:])
+        self.replacement_chars.update(replacement.replace)
+        if len(replacement.replace) == 0:
+            self.has_deletion = True
+
+
 class TextUtils():
-    def __init__(self, options):
+    def __init__(self, options, html_to_text_cache=None):
         self.options = options
+        self.html_to_text_cache = html_to_text_cache
+        if self.html_to_text_cache == None:
+            self.html_to_text_cache = HtmlToTextCache(constants.HTML_TO_TEXT_CACHE_SIZE)
         replacements_array = self.options.get('replacements', [])
         self.replacements = [TextReplacement(replacement) for replacement in replacements_array]
+        normalization_options = self.options.get(constants.CONFIG_TEXT_PROCESSING_NORMALIZATION, {})
+        self.normalization_options = {key: normalization_options.get(key, default) for key, default in constants.NORMALIZATION_DEFAULTS.items()}
+        # replacements are compiled once, and grouped per transformation type.
+        # the replacements shouldn't be modified afterwards, create a new TextUtils instead.
+        self.replacement_chains = self.build_replacement_chains()
+
+    def build_replacement_chains(self):
+        replacement_chains = {}
+        for transformation_type in constants.TransformationType:
+            chain = []
+            group_builder = MultiPatternGroupBuilder()
+
+            def flush_group():
+                group = group_builder.replacements
+                if len(group) >= constants.MULTI_PATTERN_MIN_GROUP_SIZE:
+                    chain.append((f'{len(group)} simple replacements', MultiPatternReplacement(group).process))
+                else:
+                    for replacement in group:
+                        chain.append((f'{replacement.pattern} / {replacement.replace}', replacement.get_processor()))
+
+            for replacement in self.replacements:
+                if replacement.transformation_type_map[transformation_type]:
+                    if replacement.replace_type == constants.ReplaceType.regex:
+                        processor = replacement.get_guarded_processor()
+                    else:
+                        # simple replacements run in linear time
+                        processor = replacement.get_processor()
+                    if processor == None:
+                        continue
+                    if group_builder.can_add(replacement):
+                        group_builder.add(replacement)
+                        continue
+                    flush_group()
+                    group_builder = MultiPatternGroupBuilder()
+                    if group_builder.can_add(replacement):
+                        group_builder.add(replacement)
+                    else:
+                        chain.append((f'{replacement.pattern} / {replacement.replace}', processor))
+            flush_group()
+            replacement_chains[transformation_type] = chain
+        return replacement_chains
 
     def is_empty(self, text):
-        stripped_field_value = anki.utils.htmlToTextLine(text)
+        stripped_field_value = self.html_to_text_cache.html_to_text(text)
         return len(stripped_field_value) == 0
 
     def process(self, text, transformation_type: constants.TransformationType):
-        result = anki.utils.htmlToTextLine(text)
+        result = self.html_to_text_cache.html_to_text(text)
 
         # apply replacements
+        for description, processor in self.replacement_chains[transformation_type]:
+            try:
+                result = processor(result)
+            except Exception as e:
+                logging.error(f'error while processing regular expression {description}: {e}')
+
+        return result
+
+    def normalize(self, text):
+        # canonical form of an already processed text, used for cache keys and deduplication,
+        # so that near duplicates (trailing spaces, &nbsp;, NFD vs NFC) map to the same entry
+        if self.normalization_options[constants.NORMALIZATION_FOLD_ENTITIES]:
+            # entities were already decoded by html_to_text_line. decoding again would turn text the user typed
+            # as &lt; into <, only fold non-breaking spaces
+            text = text.replace('&nbsp;', ' ').replace('\xa0', ' ')
+        if self.normalization_options[constants.NORMALIZATION_REMOVE_ZERO_WIDTH]:
+            text = ZERO_WIDTH_RE.sub('', text)
+        if self.normalization_options[constants.NORMALIZATION_UNICODE_NFC]:
+            text = unicodedata.normalize('NFC', text)
+        if self.normalization_options[constants.NORMALIZATION_COLLAPSE_WHITESPACE]:
+            text = WHITESPACE_RE.sub(' ', text).strip()
+        return text
+
+    def get_slow_replacements(self):
+        # rules which exceeded the time budget on some texts
+        return [replacement for replacement in self.replacements if replacement.slow_count > 0]
+
+    def get_skipped_counts(self):
+        # snapshot taken before a batch run, see get_skipped_replacements
+        return [replacement.skipped_count for replacement in self.replacements]
+
+    def get_skipped_replacements(self, skipped_counts_before=None):
+        # blocked rules which weren't applied to some texts, since skipped_counts_before was taken.
+        # returns (replacement, skipped text count) pairs
+        if skipped_counts_before == None:
+            skipped_counts_before = [0] * len(self.replacements)
+        return [(replacement, replacement.skipped_count - count_before) for replacement, count_before in zip(self.replacements, skipped_counts_before)
+            if replacement.skipped_count > count_before]
+
+    def profile_replacements(self, texts):
+        # run each rule on its own over the sample texts, to find out which ones are expensive
+        stripped_texts = [self.html_to_text_cache.html_to_text(text) for text in texts]
+        result = []
         for replacement in self.replacements:
-            result = replacement.process(result, transformation_type)
+            profile = {
+                'pattern': replacement.pattern,
+                'replace': replacement.replace,
+                'replace_type': replacement.replace_type.name,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'changed_count': 0,
+                'warning': None
+            }
+            profile['warning'] = replacement.get_regex_warning()
+            processor = replacement.get_processor()
+            if processor != None:
+                for text in stripped_texts:
+                    if profile['warning'] != None:
+                        # suspicious pattern: try growing prefixes of the text first, so that exponential backtracking
+                        # gets noticed before it takes minutes. the length grows geometrically, so that a pattern which
+                        # is fast after all only costs a few runs over the text
+                        probe_texts = []
+                        length = 2
+                        while length < len(text):
+                            probe_texts.append(text[:length])
+                            length = max(length + 2, int(length * constants.TEXT_REPLACEMENT_PROFILE_PREFIX_GROWTH))
+                        probe_texts.append(text)
+                    else:
+                        probe_texts = [text]
+                    try:
+                        for probe_text in probe_texts:
+                            start_time = time.perf_counter()
+                            processed_text = processor(probe_text)
+                            elapsed_ms = (time.perf_counter() - start_time) * 1000.0
+                            if elapsed_ms > constants.TEXT_REPLACEMENT_TIME_BUDGET_MS:
+                                break
+                    except Exception as e:
+                        profile['warning'] = str(e)
+                        break
+                    profile['total_ms'] += elapsed_ms
+                    profile['max_ms'] = max(profile['max_ms'], elapsed_ms)
+                    if elapsed_ms > constants.TEXT_REPLACEMENT_TIME_BUDGET_MS:
+                        profile['warning'] = f'exceeded time budget of {constants.TEXT_REPLACEMENT_TIME_BUDGET_MS}ms'
+                        break
+                    if processed_text != text:
+                        profile['changed_count'] += 1
+            result.append(profile)
+        return result
+
+    def measure_normalization(self, texts, transformation_type: constants.TransformationType):
+        # how many distinct keys collapse under normalization
+        processed_texts = self.process_many(texts, transformation_type)
+        distinct_processed = set(processed_texts)
+        distinct_normalized = set([self.normalize(text) for text in distinct_processed])
+        return {
+            'text_count': len(texts),
+            'distinct_count': len(distinct_processed),
+            'distinct_normalized_count': len(distinct_normalized),
+            'collapsed_count': len(distinct_processed) - len(distinct_normalized)
+        }
 
-        return result
\ No newline at end of file
+    def process_many(self, texts, transformation_type: constants.TransformationType):
+        # same result as calling process on each text. identical field values are only processed once.
+        unique_texts = list(dict.fromkeys(texts))
+        processed_texts = [self.process(text, transformation_type) for text in unique_texts]
+        processed_text_map = dict(zip(unique_texts, processed_texts))
+        return [processed_text_map[text] for text in texts]
@@ -0,0 +1,160 @@
+import sys
+import os
+import json
+import gzip
+import base64
+import time
+import random
+import threading
+import logging
+import urllib.parse
+import requests
+
+if hasattr(sys, '_pytest_mode'):
+    import constants
+    import errors
+else:
+    from . import constants
+    from . import errors
+
+# transport layer underneath CloudLanguageTools. the default transport talks to the server using requests,
+# the recording / replay transports allow running benchmarks repeatably without hitting the production service.
+
+class TransportResponse():
+    # subset of requests.Response used by the addon
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class RequestsTransport():
+    def request(self, method, url, json_data=None, headers=None):
+        if method == 'GET':
+            return requests.get(url, headers=headers)
+        return requests.post(url, json=json_data, headers=headers)
+
+
+def sanitize_request_data(json_data):
+    # never store the api key in a cassette
+    if not isinstance(json_data, dict):
+        return json_data
+    return {key: value for key, value in json_data.items() if key != 'api_key'}
+
+def get_request_key(method, url, json_data):
+    # the base url is not part of the key, so that a cassette recorded against one server can be replayed anywhere
+    path = urllib.parse.urlparse(url).path
+    return json.dumps([method, path, sanitize_request_data(json_data)], sort_keys=True, ensure_ascii=False)
+
+
+class RecordingTransport():
+    # forwards requests to the inner transport, and appends each request/response pair to a gzipped json-lines cassette
+    def __init__(self, cassette_path, inner_transport=None):
+        self.cassette_path = cassette_path
+        self.inner_transport = inner_transport
+        if self.inner_transport == None:
+            self.inner_transport = RequestsTransport()
+        self.lock = threading.Lock()
+        self.recorded_count = 0
+
+    def request(self, method, url, json_data=None, headers=None):
+        start_time = time.time()
+        response = self.inner_transport.request(method, url, json_data=json_data, headers=headers)
+        elapsed = time.time() - start_time
+        entry = {
+            'method': method,
+            'path': urllib.parse.urlparse(url).path,
+            'data': sanitize_request_data(json_data),
+            'status_code': response.status_code,
+            'content': base64.b64encode(response.content).decode('ascii'),
+            'elapsed': elapsed
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            # gzip supports appending members, each request is persisted as soon as it's done
+            with gzip.open(self.cassette_path, 'at', encoding='utf-8') as f:
+                f.write(line)
+            self.recorded_count += 1
+        return response
+
+
+def load_cassette(cassette_path):
+    entries = {}
+    with gzip.open(cassette_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            entry = json.loads(line)
+            key = get_request_key(entry['method'], entry['path'], entry['data'])
+            # when the same request got recorded multiple times, the last one wins
+            entries[key] = entry
+    return entries
+
+
+class ReplayTransport():
+    # serves responses from a cassette, with optional injected latency and errors
+    def __init__(self, cassette_path, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None, use_recorded_latency=False):
+        self.entries = load_cassette(cassette_path)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.use_recorded_latency = use_recorded_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.request_count = 0
+        self.injected_error_count = 0
+        logging.info(f'loaded {len(self.entries)} entries from cassette {cassette_path}')
+
+    def request(self, method, url, json_data=None, headers=None):
+        key = get_request_key(method, url, json_data)
+        entry = self.entries.get(key, None)
+        if entry == None:
+            raise errors.ReplayCassetteMissError(f'no recorded response for {method} {urllib.parse.urlparse(url).path}')
+
+        with self.lock:
+            # draw random numbers under the lock, so that a given seed produces the same sequence
+            jitter = 0
+            if self.jitter_ms > 0:
+                jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+            inject_error = self.error_rate > 0 and self.random.random() < self.error_rate
+            self.request_count += 1
+            if inject_error:
+                self.injected_error_count += 1
+
+        delay_s = max(0, self.latency_ms + jitter) / 1000.0
+        if self.use_recorded_latency:
+            delay_s += entry['elapsed']
+        if delay_s > 0:
+            time.sleep(delay_s)
+
+        if inject_error:
+            return TransportResponse(503, json.dumps({'error': 'injected replay error'}).encode('utf-8'))
+        return TransportResponse(entry['status_code'], base64.b64decode(entry['content']))
+
+
+def build_transport_from_environment():
+    mode = os.environ.get(constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_TRANSPORT, None)
+    if mode == None:
+        return RequestsTransport()
+    cassette_path = os.environ[constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_CASSETTE]
+    if mode == constants.TRANSPORT_MODE_RECORD:
+        logging.info(f'recording requests to {cassette_path}')
+        return RecordingTransport(cassette_path)
+    if mode == constants.TRANSPORT_MODE_REPLAY:
+        seed = os.environ.get(constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_SEED, None)
+        if seed != None:
+            seed = int(seed)
+        return ReplayTransport(cassette_path,
+            latency_ms=float(os.environ.get(constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_LATENCY_MS, 0)),
+            jitter_ms=float(os.environ.get(constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_JITTER_MS, 0)),
+            error_rate=float(os.environ.get(constants.ENV_VAR_ANKI_LANGUAGE_TOOLS_REPLAY_ERROR_RATE, 0)),
+            seed=seed)
+    raise ValueError(f'unknown transport mode: {mode}')